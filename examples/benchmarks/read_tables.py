@@ -0,0 +1,65 @@
+""" Micro-benchmark of reading the tables of TRIM output files
+
+Compares :meth:`srim.output.SRIM_Output._read_table` with the
+previous regex and ``np.genfromtxt`` reader on the output files in
+``test_files`` (directories 1-4; 5 is an SR calculation without
+TRIM tables).
+
+    python examples/benchmarks/read_tables.py
+
+The ``srim`` package of this checkout is used even when pysrim is not
+installed.
+"""
+import os
+import re
+import sys
+import timeit
+from io import BytesIO
+
+import numpy as np
+
+ROOT_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+from srim.output import SRIM_Output
+
+TESTDATA_DIRECTORY = os.path.join(ROOT_DIRECTORY, 'test_files')
+FILENAMES = ['IONIZ.txt', 'VACANCY.txt', 'NOVAC.txt', 'E2RECOIL.txt', 'PHONON.txt', 'RANGE.txt']
+
+
+def genfromtxt_table(output):
+    """Previous reader (without header parsing)"""
+    match = re.search((
+        rb'>>>\s+(.*)\s+<<<+\s+=+\s+([\w\W\s]*)'
+        rb'\r\n'
+        rb'\-+(?:\s+-+)+'
+    ), output, re.DOTALL)
+    return np.genfromtxt(BytesIO(output[match.end():]), max_rows=100)
+
+
+def main(number=200):
+    outputs = []
+    for directory in ['1', '2', '3', '4', '5']:
+        for filename in FILENAMES:
+            path = os.path.join(TESTDATA_DIRECTORY, directory, filename)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    output = f.read()
+                # NOVAC.txt of Kinchin-Pease calculations has no table
+                if b'>>>' in output:
+                    outputs.append(output)
+
+    reader = SRIM_Output()
+    for output in outputs:
+        np.testing.assert_array_equal(reader._read_table(output)[0], genfromtxt_table(output))
+
+    times = {}
+    for name, read in [('genfromtxt', genfromtxt_table), ('_read_table', lambda output: reader._read_table(output)[0])]:
+        times[name] = min(timeit.repeat(
+            lambda: [read(output) for output in outputs], number=number, repeat=3)) / number
+        print('{:>12}: {:8.3f} ms for {} tables'.format(name, 1e3 * times[name], len(outputs)))
+    print('{:>12}: {:8.1f}x'.format('speedup', times['genfromtxt'] / times['_read_table']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,3 @@
 from .srim import TRIM, SR
-from .core import ElementDB, Element, Material, Ion, Layer, Target
+from .core import ElementDB, Element, Material, Ion, IonBeam, Layer, Target
 from ._version import __version__
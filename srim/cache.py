@@ -0,0 +1,150 @@
+""" Cache output files of SRIM calculations on disk
+
+A calculation is identified by the exact bytes of the input file
+pysrim writes for it (``TRIM.IN`` or ``SR.IN``). Running the same
+calculation again returns the cached output files instead of
+launching SRIM.
+"""
+import os
+import uuid
+import shutil
+import hashlib
+
+
+class ResultCache(object):
+    """ Content addressed on-disk cache of TRIM and SR output files
+
+    Each calculation is stored in a directory named by the sha256 of
+    its input file. Entries are evicted least recently used first
+    once the cache grows beyond ``max_size``.
+
+    Parameters
+    ----------
+    directory : :obj:`str`
+        directory to store cached calculations in. Created if it does
+        not exist.
+    max_size : :obj:`int`, optional
+        maximum size [bytes] of cache. Default no limit.
+
+    Notes
+    -----
+        TRIM calculations get a random seed by default. Set
+        ``random_seed`` for a calculation to ever be found in the
+        cache.
+
+    Examples
+    --------
+    >>> cache = ResultCache('/tmp/srim_cache', max_size=10 * 1024**3)
+    >>> results = trim.run('/tmp/srim', cache=cache)
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, calculation):
+        """Key of calculation (:class:`srim.srim.TRIM` or :class:`srim.srim.SR`) in cache"""
+        return hashlib.sha256(calculation._cache_key()).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entries(self):
+        return [
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if not name.startswith('.')
+        ]
+
+    @staticmethod
+    def _entry_size(entry):
+        return sum(os.path.getsize(os.path.join(entry, filename)) for filename in os.listdir(entry))
+
+    def get(self, calculation):
+        """Directory of cached output files for calculation
+
+        Marks the entry as most recently used.
+
+        Returns
+        -------
+        :obj:`str`
+            directory with output files or None if not cached
+        """
+        entry = self._entry(self.key(calculation))
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def put(self, calculation, src_directory, filenames, since=None):
+        """Store output files of calculation
+
+        Parameters
+        ----------
+        calculation : :class:`srim.srim.TRIM` or :class:`srim.srim.SR`
+            calculation the files belong to
+        src_directory : :obj:`str`
+            directory the calculation was run in
+        filenames : :obj:`list`
+            names of files in ``src_directory`` to store. Missing
+            files are skipped.
+        since : :obj:`float`, optional
+            only store files modified at or after this time (e.g. the
+            modification time of the input file). Older files were
+            left behind by a previous calculation. Default store all
+            files.
+
+        Returns
+        -------
+        :obj:`str`
+            directory of the cache entry
+        """
+        entry = self._entry(self.key(calculation))
+
+        # copy to a hidden directory first so that readers never see
+        # a partially written entry
+        staging = os.path.join(self.directory, '.{}'.format(uuid.uuid4().hex))
+        os.makedirs(staging)
+        for filename in filenames:
+            path = os.path.join(src_directory, filename)
+            if os.path.isfile(path) and (since is None or os.path.getmtime(path) >= since):
+                shutil.copy(path, staging)
+
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # entry was stored by someone else in the meantime
+            shutil.rmtree(staging, ignore_errors=True)
+            os.utime(entry)
+
+        self.evict()
+        return entry
+
+    @property
+    def size(self):
+        """Total size [bytes] of cached output files"""
+        return sum(self._entry_size(entry) for entry in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until cache fits ``max_size``"""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((os.path.getmtime(entry), self._entry_size(entry), entry))
+            except FileNotFoundError:
+                continue # evicted concurrently
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all entries from cache"""
+        for entry in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
@@ -0,0 +1,237 @@
+""" Run thick targets as a chain of thinner segments
+
+TRIM tabulates the results of a calculation in 100 depth bins over
+the whole target and slows down for thick targets. A
+:class:`srim.chain.TRIMChain` splits the target into segments. The
+ions transmitted through a segment (``TRANSMIT.txt``) start the next
+segment through ``TRIM.DAT``, and the results of all segments are
+stitched into a single depth profile with 100 bins per segment.
+"""
+import os
+import shutil
+import tempfile
+import concurrent.futures
+
+from .core.layer import Layer
+from .core.target import Target
+from .config import DEFAULT_SRIM_DIRECTORY
+from .output import Results, Transmit
+from .parallel import TRIMPool
+from .srim import TRIM, TRIMSettings, _shard_seeds
+
+
+def _split_target(target, segment_width):
+    """Segments of target and the index in target of each of their layers"""
+    segments = []
+    layers, origins = [], []
+    remaining = segment_width
+    for index, layer in enumerate(target.layers):
+        width = layer.width
+        while width > 0:
+            # ignore slivers left by floating point error
+            if width <= 1e-9 * segment_width:
+                break
+
+            part = min(width, remaining)
+            layers.append(Layer(layer.elements, layer.density, part, layer.phase,
+                                layer.name, layer.bragg_correction))
+            origins.append(index)
+            width -= part
+            remaining -= part
+            if remaining <= 1e-9 * segment_width:
+                segments.append((Target(layers), origins))
+                layers, origins = [], []
+                remaining = segment_width
+
+    if layers:
+        segments.append((Target(layers), origins))
+    return segments
+
+
+def split_target(target, segment_width):
+    """Split target into consecutive segments
+
+    Layers crossing a segment boundary are split in two.
+
+    Parameters
+    ----------
+    target : :class:`srim.core.target.Target`
+        target to split
+    segment_width : :obj:`float`
+        width [Angstroms] of each segment. The last segment is
+        thinner when the target width is not a multiple of it.
+
+    Returns
+    -------
+    :obj:`list`
+        list of :class:`srim.core.target.Target`
+    """
+    if segment_width <= 0:
+        raise ValueError('segment_width must be greater than zero')
+    return [segment for segment, _ in _split_target(target, segment_width)]
+
+
+class TRIMChain(object):
+    """ Thick target TRIM calculation run as a chain of segments
+
+    The ions of the calculation are split into independent batches.
+    Each batch runs the segments in order: the first segment with the
+    ion of the calculation and every following segment (calculation
+    4 or 5) with the ions transmitted through the previous one. The
+    batches run in parallel on a :class:`srim.parallel.TRIMPool`.
+
+    Parameters
+    ----------
+    target : :class:`srim.core.target.Target`
+        constructed target for TRIM calculation
+    ion : :class:`srim.core.ion.Ion`
+        constructed ion for TRIM calculation
+    segment_width : :obj:`float`
+        width [Angstroms] of each segment
+    number_ions : :obj:`int`, optional
+        number of ions to simulate. Default 1000
+    calculation : :obj:`int`, optional
+        (1) quick KP or (2) full cascades. Default 1
+    kwargs :
+        See :class:`srim.srim.TRIMSettings` for available TRIM
+        options. ``transmit`` is always enabled for all but the last
+        segment.
+
+    Notes
+    -----
+        Recoils leaving the back of a segment are not followed into
+        the next segment. Only ions are transmitted.
+
+    Examples
+    --------
+    A 20 um target run as 10 segments of 2 um in 8 batches.
+
+    >>> chain = TRIMChain(target, Ion('He', 5.0e6), segment_width=2.0e4, number_ions=10000)
+    >>> results = chain.run('/tmp/srim', batches=8)
+    """
+    def __init__(self, target, ion, segment_width, number_ions=1000, calculation=1, **kwargs):
+        if segment_width <= 0:
+            raise ValueError('segment_width must be greater than zero')
+        if calculation not in (1, 2):
+            raise ValueError('chained calculations must be calculation 1 or 2')
+
+        self.settings = TRIMSettings(**kwargs)
+        self._kwargs = kwargs
+        self.target = target
+        self.ion = ion
+        self.number_ions = number_ions
+        self.calculation = calculation
+        self._segments = _split_target(target, segment_width)
+
+    @property
+    def segments(self):
+        """Targets of segments in order of depth"""
+        return [segment for segment, _ in self._segments]
+
+    def _trim(self, index, number_ions, random_seed, trim_dat=None):
+        """TRIM calculation of segment index"""
+        kwargs = dict(self._kwargs, random_seed=random_seed)
+        if index < len(self._segments) - 1:
+            kwargs['transmit'] = 1
+
+        target = self._segments[index][0]
+        if trim_dat is None:
+            return TRIM(target, self.ion, self.calculation, number_ions, **kwargs)
+        # calculation 1 -> 4 (quick KP) and 2 -> 5 (full cascades)
+        return TRIM(target, self.ion, self.calculation + 3, number_ions, trim_dat=trim_dat, **kwargs)
+
+    def _columns(self):
+        """Index of element columns of each segment in tables of whole target"""
+        offsets = [0]
+        for layer in self.target.layers:
+            offsets.append(offsets[-1] + len(layer.elements))
+
+        columns = []
+        for _, origins in self._segments:
+            columns.append([
+                column for origin in origins
+                for column in range(offsets[origin], offsets[origin + 1])
+            ])
+        return columns, offsets[-1]
+
+    def run(self, srim_directory=DEFAULT_SRIM_DIRECTORY, batches=None, workers=None,
+            directory=None, threads=False):
+        """Run all segments and stitch their results
+
+        Parameters
+        ----------
+        srim_directory : :obj:`str`, optional
+            path to srim directory. Copied once for each worker.
+            Default ``/tmp/srim``.
+        batches : :obj:`int`, optional
+            number of independent batches to split the ions into.
+            Default number of workers.
+        workers : :obj:`int`, optional
+            number of segments to run at once. Default number of
+            cpus on machine.
+        directory : :obj:`str`, optional
+            directory to keep the output files of every batch and
+            segment in (``batch-<i>/segment-<j>``). Default temporary
+            directory removed after the run.
+        threads : :obj:`bool`, optional
+            use threads instead of processes for workers. Default False.
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+            results over the whole target. Tables are normalized per
+            ion of the calculation.
+        """
+        workers = workers or os.cpu_count() or 1
+        batches = min(batches or workers, self.number_ions)
+        batch_ions = [
+            self.number_ions // batches + (1 if i < self.number_ions % batches else 0)
+            for i in range(batches)
+        ]
+        seeds = _shard_seeds(self.settings.random_seed, batches * len(self._segments))
+
+        temporary = directory is None
+        directory = os.path.abspath(directory or tempfile.mkdtemp(prefix='pysrim-chain-'))
+        segment_results = [[] for _ in self._segments]
+        try:
+            with TRIMPool(srim_directory, workers=min(workers, batches), threads=threads) as pool:
+                pending = {}
+
+                def submit(batch, index, number_ions, trim_dat=None):
+                    trim = self._trim(index, number_ions, seeds[batch * len(self._segments) + index], trim_dat)
+                    output_directory = os.path.join(
+                        directory, 'batch-{}'.format(batch), 'segment-{}'.format(index))
+                    pending[pool.submit(trim, output_directory)] = (batch, index, output_directory)
+
+                for batch, number_ions in enumerate(batch_ions):
+                    submit(batch, 0, number_ions)
+
+                while pending:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        batch, index, output_directory = pending.pop(future)
+                        segment_results[index].append(future.result())
+                        if index == len(self._segments) - 1:
+                            continue
+
+                        # segments transmitting no ions may not write TRANSMIT.txt
+                        if not os.path.isfile(os.path.join(output_directory, 'TRANSMIT.txt')):
+                            continue
+                        transmit = Transmit(output_directory)
+                        if transmit.num_ions:
+                            submit(batch, index + 1, transmit.num_ions, transmit.to_trim_dat())
+        finally:
+            if temporary:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        # only segments reached by ions have results
+        reached = [results for results in segment_results if results]
+        merged = [Results.merge(results) for results in reached]
+        offsets, depth = [], 0.0
+        for segment, _ in self._segments[:len(reached)]:
+            offsets.append(depth)
+            depth += segment.width
+        scales = [results.ioniz.num_ions / self.number_ions for results in merged]
+        columns, number_columns = self._columns()
+        return Results.stitch(merged, offsets, scales, self.number_ions,
+                              columns[:len(reached)], number_columns)
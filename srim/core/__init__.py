@@ -4,3 +4,5 @@ from .material import Material
 from .ion import Ion
 from .layer import Layer
 from .target import Target
+from .beam import IonBeam
+from .recoil import PKASpectrum
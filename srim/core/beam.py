@@ -0,0 +1,239 @@
+import numpy as np
+
+from .ion import Ion
+from .utils import check_input, is_positive, is_srim_degrees
+from ..input import TRIMDat
+
+
+def _histogram(counts, edges):
+    """Check histogram and return probabilities and edges of bins"""
+    counts = np.asarray(counts, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    if counts.ndim != 1 or edges.shape != (len(counts) + 1,):
+        raise ValueError('edges must have one more bin edge than counts')
+    if np.any(counts < 0) or counts.sum() <= 0:
+        raise ValueError('counts must be positive and not all zero')
+    if edges[0] <= 0 or np.any(np.diff(edges) <= 0):
+        raise ValueError('edges must be positive and increasing')
+    return counts / counts.sum(), edges
+
+
+def _sample_histogram(rng, histogram, size):
+    """Values drawn uniformly within bins chosen by their probability"""
+    probabilities, edges = histogram
+    bins = rng.choice(len(probabilities), size=size, p=probabilities)
+    return rng.uniform(edges[bins], edges[bins + 1])
+
+
+def _sample_trim_dat(source, number_ions, seed=None, chunk_size=None):
+    """TRIMDat of ions sampled by ``source._sample(rng, number_ions)``"""
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    if chunk_size is None:
+        return source._sample(np.random.default_rng(seed), number_ions)
+    return TRIMDat.from_chunks(_SampledChunks(source, number_ions, seed, chunk_size))
+
+
+class IonBeam(Ion):
+    """ Beam of ions with an energy spread, spot size and divergence
+
+    Like :class:`srim.core.ion.Ion` except that each ion of the beam
+    is sampled with its own energy, lateral position and direction.
+    All ions are given to TRIM in a single calculation 4 run
+    through ``TRIM.DAT`` (see :class:`srim.input.TRIMDat`) instead of
+    one calculation per energy or angle.
+
+    Parameters
+    ----------
+    identifier : :obj:`str`, :obj:`int`
+        Symbol, Name, or Atomic Number of ion
+    energy : :obj:`float`
+        mean energy [eV] of beam
+    mass : :obj:`float`, optional
+        Mass [amu] of element. Default is most common isotope atomic
+        weight
+    energy_spread : :obj:`float`, optional
+        standard deviation [eV] of gaussian energy distribution. The
+        distribution is truncated at 4 standard deviations. Default 0.0
+    spot_size : :obj:`float`, optional
+        standard deviation [Angstroms] of gaussian lateral position of
+        ions on the surface. Default 0.0
+    divergence : :obj:`float`, optional
+        standard deviation [degrees] of gaussian angle between ions and
+        the beam axis in each lateral direction. Default 0.0
+    angle : :obj:`float`, optional
+        angle [degrees] of beam axis to the surface normal. Default 0.0
+
+    Examples
+    --------
+    A 2 MeV Nickel beam with 10 keV spread, a 1 um spot and 0.5
+    degrees divergence.
+
+    >>> beam = IonBeam('Ni', 2.0e6, energy_spread=1.0e4, spot_size=1.0e4, divergence=0.5)
+    >>> trim = beam.trim(target, number_ions=100000)
+    """
+    _truncation = 4.0 # standard deviations of energy distribution kept
+
+    def __init__(self, identifier, energy, mass=None, energy_spread=0.0,
+                 spot_size=0.0, divergence=0.0, angle=0.0):
+        """Initialize IonBeam"""
+        super(IonBeam, self).__init__(identifier, energy, mass)
+        self.energy_spread = check_input(float, is_positive, energy_spread)
+        self.spot_size = check_input(float, is_positive, spot_size)
+        self.divergence = check_input(float, is_positive, divergence)
+        self.angle = check_input(float, is_srim_degrees, angle)
+        self._spectrum = None
+
+    @classmethod
+    def from_spectrum(cls, identifier, counts, edges, mass=None, **kwargs):
+        """Beam with energies distributed as histogram
+
+        Energies are drawn uniformly within each bin with probability
+        proportional to the counts of the bin.
+
+        Parameters
+        ----------
+        identifier : :obj:`str`, :obj:`int`
+            Symbol, Name, or Atomic Number of ion
+        counts : :obj:`numpy.ndarray`
+            counts (or weights) of each energy bin
+        edges : :obj:`numpy.ndarray`
+            energy [eV] bin edges. One more than ``counts``
+        mass : :obj:`float`, optional
+            Mass [amu] of element.
+        kwargs :
+            ``spot_size``, ``divergence`` and ``angle`` of beam
+
+        Examples
+        --------
+        >>> IonBeam.from_spectrum('He', *np.histogram(measured_energies, bins=40))
+        """
+        probabilities, edges = _histogram(counts, edges)
+        mean_energy = np.sum(probabilities * (edges[:-1] + edges[1:]) / 2)
+        beam = cls(identifier, mean_energy, mass, **kwargs)
+        beam._spectrum = (probabilities, edges)
+        return beam
+
+    def __repr__(self):
+        return "<IonBeam element:{} mass:{:2.2f} energy:{:1.2E} eV>".format(
+            self.name, self.mass, self.energy)
+
+    @property
+    def max_energy(self):
+        """Highest energy [eV] an ion of the beam can have"""
+        if self._spectrum is not None:
+            return float(self._spectrum[1][-1])
+        return self.energy + self._truncation * self.energy_spread
+
+    def _sample_energy(self, rng, number_ions):
+        if self._spectrum is not None:
+            return _sample_histogram(rng, self._spectrum, number_ions)
+
+        energy = rng.normal(self.energy, self.energy_spread, size=number_ions)
+        rejected = (np.abs(energy - self.energy) > self._truncation * self.energy_spread) | (energy <= 0)
+        while np.any(rejected):
+            energy[rejected] = rng.normal(self.energy, self.energy_spread, size=np.count_nonzero(rejected))
+            rejected = (np.abs(energy - self.energy) > self._truncation * self.energy_spread) | (energy <= 0)
+        return energy
+
+    def _sample_direction(self, rng, number_ions):
+        # small angle deflections in each lateral direction about beam axis
+        tan_y = np.tan(np.radians(rng.normal(0.0, self.divergence, size=number_ions)))
+        tan_z = np.tan(np.radians(rng.normal(0.0, self.divergence, size=number_ions)))
+        direction = np.stack([np.ones(number_ions), tan_y, tan_z], axis=1)
+        direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
+
+        # tilt beam axis by angle towards y (as TRIM does for angle_ions)
+        angle = np.radians(self.angle)
+        return np.stack([
+            direction[:, 0] * np.cos(angle) - direction[:, 1] * np.sin(angle),
+            direction[:, 0] * np.sin(angle) + direction[:, 1] * np.cos(angle),
+            direction[:, 2]
+        ], axis=1)
+
+    def _sample(self, rng, number_ions):
+        energy = self._sample_energy(rng, number_ions)
+        position = np.zeros((number_ions, 3))
+        position[:, 1:] = rng.normal(0.0, self.spot_size, size=(number_ions, 2))
+
+        direction = self._sample_direction(rng, number_ions)
+        outward = direction[:, 0] <= 0 # resample ions not entering target
+        while np.any(outward):
+            direction[outward] = self._sample_direction(rng, np.count_nonzero(outward))
+            outward = direction[:, 0] <= 0
+        return TRIMDat(self.atomic_number, energy, position, direction)
+
+    def sample(self, number_ions, seed=None, chunk_size=None):
+        """Sample ions of beam for ``TRIM.DAT``
+
+        Parameters
+        ----------
+        number_ions : :obj:`int`
+            number of ions to sample
+        seed : :obj:`int`, optional
+            seed of random number generator. Default random
+        chunk_size : :obj:`int`, optional
+            sample ions in chunks of this many ions when written
+            instead of all at once. Default sample all ions now
+
+        Returns
+        -------
+        :class:`srim.input.TRIMDat`
+        """
+        return _sample_trim_dat(self, number_ions, seed, chunk_size)
+
+    def trim(self, target, number_ions, calculation=4, seed=None, chunk_size=None, **kwargs):
+        """TRIM calculation of all ions of the beam in a single run
+
+        Parameters
+        ----------
+        target : :class:`srim.core.target.Target`
+            constructed target for TRIM calculation
+        number_ions : :obj:`int`
+            number of ions to simulate
+        calculation : :obj:`int`, optional
+            (4) quick KP damage or (5) full cascades. Default 4
+        seed : :obj:`int`, optional
+            seed for sampling ions. Also used as TRIM ``random_seed``
+            unless given. Default random
+        chunk_size : :obj:`int`, optional
+            see :meth:`sample`
+        kwargs :
+            See :class:`srim.srim.TRIMSettings` for available TRIM
+            options.
+
+        Returns
+        -------
+        :class:`srim.srim.TRIM`
+        """
+        from ..srim import TRIM
+
+        if calculation not in (4, 5):
+            raise ValueError('ion beams are run with calculation 4 or 5')
+
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        kwargs.setdefault('random_seed', seed % (2**31 - 1))
+        kwargs.setdefault('angle_ions', self.angle)
+
+        # TRIM sets up its tables for the energy in TRIM.IN
+        ion = Ion(self.atomic_number, self.max_energy, self.mass)
+        trim_dat = self.sample(number_ions, seed, chunk_size)
+        return TRIM(target, ion, calculation, number_ions, trim_dat=trim_dat, **kwargs)
+
+
+class _SampledChunks(object):
+    """Reproducible chunks of sampled ions (sampled again on each iteration)"""
+    def __init__(self, source, number_ions, seed, chunk_size):
+        self._source = source
+        self._number_ions = number_ions
+        self._seed = seed
+        self._chunk_size = check_input(int, is_positive, chunk_size)
+        if self._chunk_size == 0:
+            raise ValueError('chunk_size must be greater than zero')
+
+    def __iter__(self):
+        rng = np.random.default_rng(self._seed)
+        for start in range(0, self._number_ions, self._chunk_size):
+            yield self._source._sample(rng, min(self._chunk_size, self._number_ions - start))
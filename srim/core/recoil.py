@@ -0,0 +1,163 @@
+import numpy as np
+
+from .ion import Ion
+from .beam import _histogram, _sample_histogram, _sample_trim_dat
+from ..input import TRIMDat
+
+
+class PKASpectrum(object):
+    """ Primary knock-on atoms (PKAs) created throughout a target
+
+    Recoils from e.g. neutron irradiation start inside the target
+    instead of entering from the surface. Each recoil is sampled with
+    an element of the target, a depth within a layer containing that
+    element, an isotropic direction and an energy from the PKA
+    spectrum. The recoils drive TRIM calculations 6-8 through
+    ``TRIM.DAT`` (see :class:`srim.input.TRIMDat`).
+
+    Parameters
+    ----------
+    target : :class:`srim.core.target.Target`
+        target the recoils are created in
+    counts : :obj:`numpy.ndarray`
+        counts (or weights) of each PKA energy bin
+    edges : :obj:`numpy.ndarray`
+        PKA energy [eV] bin edges. One more than ``counts``
+    fractions : :obj:`dict`, optional
+        fraction of recoils of each element (symbol) of the
+        target. Default proportional to the number of atoms of each
+        element in the target. Within an element recoils are spread
+        over the layers by their number of atoms of that element and
+        uniformly in depth within a layer.
+
+    Examples
+    --------
+    Recoils in SiC with a PKA spectrum from a neutron transport code.
+
+    >>> pka = PKASpectrum(target, counts, edges, fractions={'Si': 0.4, 'C': 0.6})
+    >>> trim = pka.trim(number_ions=1000000, chunk_size=100000)
+    """
+    def __init__(self, target, counts, edges, fractions=None):
+        self.target = target
+        self._spectrum = _histogram(counts, edges)
+
+        # every (layer, element) pair recoils can start in
+        sites = []
+        depth = 0.0
+        for layer in target.layers:
+            mean_mass = sum(element.mass * layer.elements[element]['stoich'] for element in layer.elements)
+            for element in layer.elements:
+                atoms = layer.width * layer.density / mean_mass * layer.elements[element]['stoich']
+                if atoms > 0:
+                    sites.append((element, depth, layer.width, atoms))
+            depth += layer.width
+
+        atoms = np.array([site[3] for site in sites])
+        if fractions is None:
+            weights = atoms
+        else:
+            symbols = {site[0].symbol for site in sites}
+            unknown = set(fractions) - symbols
+            if unknown:
+                raise ValueError('elements {} are not in target'.format(', '.join(sorted(unknown))))
+            if any(fraction < 0 for fraction in fractions.values()) or sum(fractions.values()) <= 0:
+                raise ValueError('fractions must be positive and not all zero')
+
+            element_atoms = {}
+            for site in sites:
+                element_atoms[site[0].symbol] = element_atoms.get(site[0].symbol, 0.0) + site[3]
+            weights = np.array([
+                fractions.get(site[0].symbol, 0.0) * site[3] / element_atoms[site[0].symbol]
+                for site in sites
+            ])
+
+        self._probabilities = weights / weights.sum()
+        self._atomic_number = np.array([site[0].atomic_number for site in sites])
+        self._start = np.array([site[1] for site in sites])
+        self._width = np.array([site[2] for site in sites])
+        self._elements = [site[0] for site in sites]
+
+    @property
+    def max_energy(self):
+        """Highest energy [eV] of a recoil"""
+        return float(self._spectrum[1][-1])
+
+    @property
+    def fractions(self):
+        """Fraction of recoils of each element (symbol)"""
+        fractions = {}
+        for element, probability in zip(self._elements, self._probabilities):
+            fractions[element.symbol] = fractions.get(element.symbol, 0.0) + probability
+        return fractions
+
+    def _sample(self, rng, number_ions):
+        sites = rng.choice(len(self._probabilities), size=number_ions, p=self._probabilities)
+        energy = _sample_histogram(rng, self._spectrum, number_ions)
+
+        position = np.zeros((number_ions, 3))
+        position[:, 0] = self._start[sites] + rng.uniform(0.0, 1.0, size=number_ions) * self._width[sites]
+
+        cos_x = rng.uniform(-1.0, 1.0, size=number_ions)
+        sin_x = np.sqrt(1.0 - cos_x**2)
+        phi = rng.uniform(0.0, 2 * np.pi, size=number_ions)
+        direction = np.stack([cos_x, sin_x * np.cos(phi), sin_x * np.sin(phi)], axis=1)
+
+        return TRIMDat(self._atomic_number[sites], energy, position, direction)
+
+    def sample(self, number_ions, seed=None, chunk_size=None):
+        """Sample recoils for ``TRIM.DAT``
+
+        Parameters
+        ----------
+        number_ions : :obj:`int`
+            number of recoils to sample
+        seed : :obj:`int`, optional
+            seed of random number generator. Default random
+        chunk_size : :obj:`int`, optional
+            sample recoils in chunks of this many recoils while
+            ``TRIM.DAT`` is written instead of all at once. Default
+            sample all recoils now
+
+        Returns
+        -------
+        :class:`srim.input.TRIMDat`
+        """
+        return _sample_trim_dat(self, number_ions, seed, chunk_size)
+
+    def trim(self, number_ions, calculation=6, seed=None, chunk_size=None, **kwargs):
+        """TRIM calculation of recoils
+
+        Parameters
+        ----------
+        number_ions : :obj:`int`
+            number of recoils to simulate
+        calculation : :obj:`int`, optional
+            (6) full cascades, (7) full cascades and monolayer steps,
+            or (8) quick KP damage. Default 6
+        seed : :obj:`int`, optional
+            seed for sampling recoils. Also used as TRIM
+            ``random_seed`` unless given. Default random
+        chunk_size : :obj:`int`, optional
+            see :meth:`sample`
+        kwargs :
+            See :class:`srim.srim.TRIMSettings` for available TRIM
+            options.
+
+        Returns
+        -------
+        :class:`srim.srim.TRIM`
+        """
+        from ..srim import TRIM
+
+        if calculation not in (6, 7, 8):
+            raise ValueError('recoil cascades are run with calculation 6, 7, or 8')
+
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        kwargs.setdefault('random_seed', seed % (2**31 - 1))
+
+        # TRIM sets up its tables for the heaviest recoil at the highest energy
+        heaviest = max(self._elements, key=lambda element: element.mass)
+        ion = Ion(heaviest.atomic_number, self.max_energy, heaviest.mass)
+        trim_dat = self.sample(number_ions, seed, chunk_size)
+        return TRIM(self.target, ion, calculation, number_ions, trim_dat=trim_dat, **kwargs)
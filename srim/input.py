@@ -1,10 +1,18 @@
 """ Write Inputfile for SRIM and TRIM calculations
 
 """
+import os
+import shutil
+import hashlib
+
+import numpy as np
+
+# Directory TRIM autosaves calculations to and resumes them from
+RESTORE_DIRECTORY = 'SRIM Restore'
 
 
 class AutoTRIM(object):
-    def __init__(self, mode=1, restart_directroy=None):
+    def __init__(self, mode=1, restart_directory=None):
         """Writes a file AUTOTRIM to TRIM directory for autostart
 
         Parameters
@@ -14,13 +22,30 @@ class AutoTRIM(object):
             (2) TRIM resumes running its last saved calculation. Default 1
             and is really the only sane option when using Python for automation
         restart_directory : str
-            currently not implemented. default None
+            directory with files of a saved calculation (a copy of
+            ``SRIM Restore``) to resume from in mode 2. Default None
+            resumes the calculation last saved in the TRIM directory
         """
+        if restart_directory is not None and mode != 2:
+            raise ValueError('restart_directory requires mode 2')
+
         self._mode = mode
+        self._restart_directory = restart_directory
 
-    def write(self):
-        """ write AUTOTRIM in current directory """
-        with open('TRIMAUTO', 'w') as f:
+    def write(self, directory='.'):
+        """ write AUTOTRIM to directory
+
+        Parameters
+        ----------
+        directory : :obj:`str`, optional
+            directory to write ``TRIMAUTO`` to. Default current directory
+        """
+        if self._restart_directory is not None:
+            shutil.copytree(self._restart_directory,
+                            os.path.join(directory, RESTORE_DIRECTORY),
+                            dirs_exist_ok=True)
+
+        with open(os.path.join(directory, 'TRIMAUTO'), 'w') as f:
             f.write('{}'.format(self._mode))
 
 
@@ -187,31 +212,256 @@ class TRIMInput(object):
             'Stopping Power Version (1=2011, 0=2011)'
         ) + self.newline + '{}'.format(self._trim.settings.version) + self.newline
 
-    def write(self):
-        """Write TRIMInput class to ``TRIM.IN``"""
-        with open('TRIM.IN', 'wb') as f:
-            methods = [
-                self._write_title,
-                self._write_ion,
-                self._write_cascade_options,
-                self._write_plot_on_off,
-                self._write_target,
-                self._write_plot_options,
-                self._write_elements,
-                self._write_layer,
-                self._write_solid_gas,
-                self._write_bragg_correction,
-                self._write_displacement_energies,
-                self._write_lattice_binding,
-                self._write_surface_binding,
-                self._write_version
-            ]
-
-            input_str = ''
-            for method in methods:
-                input_str += method.__call__()
-
-            f.write(input_str.encode('utf-8'))
+    def to_bytes(self):
+        """Contents of ``TRIM.IN`` exactly as written by :meth:`write`"""
+        methods = [
+            self._write_title,
+            self._write_ion,
+            self._write_cascade_options,
+            self._write_plot_on_off,
+            self._write_target,
+            self._write_plot_options,
+            self._write_elements,
+            self._write_layer,
+            self._write_solid_gas,
+            self._write_bragg_correction,
+            self._write_displacement_energies,
+            self._write_lattice_binding,
+            self._write_surface_binding,
+            self._write_version
+        ]
+
+        input_str = ''
+        for method in methods:
+            input_str += method.__call__()
+        return input_str.encode('utf-8')
+
+    def write(self, directory='.'):
+        """Write TRIMInput class to ``TRIM.IN``
+
+        Parameters
+        ----------
+        directory : :obj:`str`, optional
+            directory to write ``TRIM.IN`` to. Default current directory
+        """
+        with open(os.path.join(directory, 'TRIM.IN'), 'wb') as f:
+            f.write(self.to_bytes())
+
+
+def _fixed_width(values, width, decimals=0, zero_pad=False):
+    """Format numbers right aligned in columns of fixed width
+
+    Digits are computed with array arithmetic (one pass per column of
+    characters) instead of formatting each number in python.
+
+    Parameters
+    ----------
+    values : :obj:`numpy.ndarray`
+        1d array of numbers to format
+    width : :obj:`int`
+        number of characters of each formatted number
+    decimals : :obj:`int`, optional
+        digits after the decimal point. Default 0 (integers without
+        decimal point)
+    zero_pad : :obj:`bool`, optional
+        pad with zeros instead of spaces. Default False
+
+    Returns
+    -------
+    :obj:`numpy.ndarray`
+        array of ascii characters with shape ``(len(values), width)``
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not np.all(np.isfinite(values)):
+        raise ValueError('values must be finite')
+
+    remaining = np.rint(np.abs(values) * 10**decimals).astype(np.int64)
+    negative = (values < 0) & (remaining > 0)
+    if zero_pad and np.any(negative):
+        raise ValueError('zero padded values must not be negative')
+
+    # built column by column so that each column is contiguous
+    space = ord('0') if zero_pad else ord(' ')
+    characters = np.full((width, len(values)), space, dtype=np.uint8)
+
+    # minimum number of characters written for every value: all
+    # decimals, the decimal point and one integer digit
+    minimum = decimals + 2 if decimals else 1
+    for position in range(width):
+        column = characters[width - 1 - position]
+        if decimals and position == decimals:
+            column[:] = ord('.')
+            continue
+
+        remaining, digit = np.divmod(remaining, 10)
+        digit = digit.astype(np.uint8) + ord('0')
+        if position < minimum:
+            column[:] = digit
+        else:
+            np.copyto(column, digit, where=(digit != ord('0')) | (remaining > 0))
+
+    if np.any(remaining > 0):
+        raise ValueError('values do not fit in {} characters'.format(width))
+
+    if np.any(negative):
+        sign_row = np.argmax(characters != ord(' '), axis=0) - 1
+        if np.any(sign_row[negative] < 0):
+            raise ValueError('values do not fit in {} characters'.format(width))
+        characters[sign_row[negative], np.flatnonzero(negative)] = ord('-')
+    return characters.T
+
+
+class TRIMDat(object):
+    """Starting atom, energy, position and direction of ions in ``TRIM.DAT``
+
+    Calculations 4-8 of :class:`srim.srim.TRIM` read each ion from
+    ``TRIM.DAT`` instead of ``TRIM.IN``. Large files can be written
+    from chunks (see :meth:`from_chunks`) without holding all ions in
+    memory.
+
+    Parameters
+    ----------
+    atomic_number : :obj:`int` or :obj:`numpy.ndarray`
+        atomic number of each ion
+    energy : :obj:`numpy.ndarray`
+        energy of each ion [eV]
+    position : :obj:`numpy.ndarray`, optional
+        depth ``x`` and lateral position ``y``, ``z`` of each ion
+        with shape ``(number_ions, 3)`` [Angstroms]. Default surface
+        origin
+    direction : :obj:`numpy.ndarray`, optional
+        direction cosines of each ion with shape ``(number_ions, 3)``.
+        Default normal incidence ``(1, 0, 0)``
+
+    Examples
+    --------
+    >>> energy = np.random.normal(1.0e6, 1.0e4, size=100000)
+    >>> trim = TRIM(target, Ion('Ni', 1.0e6), calculation=4, number_ions=100000,
+    ...             trim_dat=TRIMDat(28, energy))
+    """
+    newline = b'\r\n' # TRIM uses microsoft newlines
+
+    # (width, decimals) of columns: name, atom, energy, x, y, z, cos(x), cos(y), cos(z)
+    _name_width = 7
+    _atom_width = 3
+    _energy_format = (15, 3)
+    _position_format = (14, 4)
+    _direction_format = (10, 7)
+
+    def __init__(self, atomic_number, energy, position=(0.0, 0.0, 0.0), direction=(1.0, 0.0, 0.0)):
+        self.energy = np.atleast_1d(np.asarray(energy, dtype=np.float64))
+        if self.energy.ndim != 1:
+            raise ValueError('energy must be 1d array')
+
+        number_ions = len(self.energy)
+        self.atomic_number = np.broadcast_to(np.asarray(atomic_number, dtype=np.int64), (number_ions,))
+        self.position = np.broadcast_to(np.asarray(position, dtype=np.float64), (number_ions, 3))
+        self.direction = np.broadcast_to(np.asarray(direction, dtype=np.float64), (number_ions, 3))
+
+        if np.any((self.atomic_number < 1) | (self.atomic_number > 92)):
+            raise ValueError('atomic_number must be between 1 and 92')
+        if not np.all(self.energy > 0):
+            raise ValueError('energy must be greater than zero')
+        if not np.allclose(np.linalg.norm(self.direction, axis=1), 1.0, atol=1e-4):
+            raise ValueError('direction must be unit vectors of direction cosines')
+
+        self._chunks = None
+        self.number_ions = number_ions
+        self._digest = None
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """TRIM.DAT written from chunks of ions
+
+        Parameters
+        ----------
+        chunks : iterable
+            :class:`srim.input.TRIMDat` chunks of ions, e.g. yielded
+            by a generator. Only one chunk is held in memory at a
+            time. A generator can only be written once.
+
+        Returns
+        -------
+        :class:`srim.input.TRIMDat`
+            ``number_ions`` is only known after :meth:`write`
+        """
+        trim_dat = cls.__new__(cls)
+        trim_dat._chunks = chunks
+        trim_dat.number_ions = None
+        trim_dat._digest = None
+        return trim_dat
+
+    def chunks(self):
+        """Iterate over chunks of ions (:class:`srim.input.TRIMDat`)"""
+        if self._chunks is None:
+            return iter([self])
+        return iter(self._chunks)
+
+    def _write_header(self):
+        lines = [
+            '<<<<<< TRIM.DAT generated by pysrim >>>>>>',
+            'Starting atom, energy, position and direction of each ion.',
+            'The first 10 lines of this file are ignored by TRIM.',
+            '=' * 78, '', '', '', '=' * 78,
+            'Event  Atom     Energy         Depth      Lateral-Position         ------- Atom Direction -------',
+            'Name   Numb      (eV)          X (A)        Y (A)         Z (A)      Cos(X)     Cos(Y)     Cos(Z)'
+        ]
+        return self.newline.join(line.encode('utf-8') for line in lines) + self.newline
+
+    def _write_chunk(self, start):
+        """Rows of chunk with event names numbered from start"""
+        number_ions = len(self.energy)
+        space = np.full((number_ions, 1), ord(' '), dtype=np.uint8)
+        newline = np.frombuffer(self.newline, dtype=np.uint8)[np.newaxis].repeat(number_ions, axis=0)
+
+        names = (np.arange(start, start + number_ions) + 1) % 10**self._name_width
+        columns = [
+            _fixed_width(names, self._name_width, zero_pad=True), space,
+            _fixed_width(self.atomic_number, self._atom_width), space,
+            _fixed_width(self.energy, *self._energy_format)
+        ]
+        for i in range(3):
+            columns.extend([space, _fixed_width(self.position[:, i], *self._position_format)])
+        for i in range(3):
+            columns.extend([space, _fixed_width(self.direction[:, i], *self._direction_format)])
+        columns.append(newline)
+        return np.hstack(columns).tobytes()
+
+    def _write_all(self):
+        """Yield contents of ``TRIM.DAT`` piece by piece"""
+        yield self._write_header()
+        number_ions = 0
+        for chunk in self.chunks():
+            yield chunk._write_chunk(number_ions)
+            number_ions += len(chunk.energy)
+        self.number_ions = number_ions
+
+    def digest(self):
+        """sha256 of ``TRIM.DAT`` contents (identifies file in :class:`srim.cache.ResultCache`)"""
+        if self._digest is None:
+            if self._chunks is not None and iter(self._chunks) is self._chunks:
+                raise ValueError('TRIM.DAT from a generator must be written before computing its digest')
+
+            digest = hashlib.sha256()
+            for data in self._write_all():
+                digest.update(data)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def write(self, directory='.'):
+        """Write ions to ``TRIM.DAT``
+
+        Parameters
+        ----------
+        directory : :obj:`str`, optional
+            directory to write ``TRIM.DAT`` to. Default current directory
+        """
+        digest = hashlib.sha256()
+        with open(os.path.join(directory, 'TRIM.DAT'), 'wb') as f:
+            for data in self._write_all():
+                digest.update(data)
+                f.write(data)
+        self._digest = digest.hexdigest()
 
 
 class SRInput(object):
@@ -286,20 +536,29 @@ class SRInput(object):
             self._sr.ion.energy / 1.0e3
         ) + self.newline
 
-    def write(self):
-        """Write SR calcualtion to ``SR.IN``"""
-        with open('SR.IN', 'wb') as f:
-            methods = [
-                self._write_filename,
-                self._write_ion,
-                self._write_layer_info,
-                self._write_elements,
-                self._write_output_options,
-                self._write_ion_energy_range
-            ]
-
-            input_str = ''
-            for method in methods:
-                input_str += method.__call__()
-
-            f.write(input_str.encode('utf-8'))
+    def to_bytes(self):
+        """Contents of ``SR.IN`` exactly as written by :meth:`write`"""
+        methods = [
+            self._write_filename,
+            self._write_ion,
+            self._write_layer_info,
+            self._write_elements,
+            self._write_output_options,
+            self._write_ion_energy_range
+        ]
+
+        input_str = ''
+        for method in methods:
+            input_str += method.__call__()
+        return input_str.encode('utf-8')
+
+    def write(self, directory='.'):
+        """Write SR calcualtion to ``SR.IN``
+
+        Parameters
+        ----------
+        directory : :obj:`str`, optional
+            directory to write ``SR.IN`` to. Default current directory
+        """
+        with open(os.path.join(directory, 'SR.IN'), 'wb') as f:
+            f.write(self.to_bytes())
@@ -2,11 +2,20 @@
 """
 import os
 import re
+import mmap
+import json
+import zlib
+import struct
 from io import BytesIO
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
 
 import numpy as np
 
 from .core.ion import Ion
+from .core.elementdb import ElementDB
+from .input import TRIMDat
 
 # Valid double_regex (works for: .4, 0.4, 4, 4.0, 4.0e100, etc.)
 double_regex = r'[-+]?\d+\.?\d*(?:[eE][-+]?\d+)?'
@@ -52,6 +61,73 @@ class Layer(object):
         self.elements.append(Element(element_id, name, atomic_percent, mass_percent))
 
 
+_BLANK_LINE = re.compile(rb'\n[ \t\r]*(?:\n|$)')
+
+
+def _read_rows(output, start, max_rows=None):
+    """Table of numbers from start of output up to the next blank line
+
+    All values are converted by a single numpy conversion. A last row
+    cut off by the end of the file (e.g. TRIM still writing) is
+    ignored.
+
+    Parameters
+    ----------
+    output : :obj:`bytes`
+        contents of file
+    start : :obj:`int`
+        offset of first row
+    max_rows : :obj:`int`, optional
+        read at most max_rows rows. Default all rows
+
+    Returns
+    -------
+    :obj:`numpy.ndarray`
+        2D array with one row per line
+    """
+    # SRIM writes tables with fixed width rows: every row ends at the
+    # same column so the table is found without looking at each line
+    length = output.find(b'\n', start) + 1 - start
+    if length > 1:
+        block = output[start:] if max_rows is None else output[start:start + length * max_rows]
+        newlines = block[length - 1::length]
+        number_rows = len(newlines) - len(newlines.lstrip(b'\n'))
+        end = start + number_rows * length
+        following = output[end:output.find(b'\n', end) + 1 or len(output)]
+        if (max_rows is not None and number_rows == max_rows) or not following.strip() or not following.endswith(b'\n'):
+            values = _to_floats(block[:number_rows * length], number_rows)
+            if values is not None:
+                return values
+
+    match = _BLANK_LINE.search(output, start)
+    end = match.start() + 1 if match else len(output)
+    rows = output[start:end].split(b'\n')
+    if end == len(output) and not output.endswith(b'\n'):
+        rows = rows[:-1] # truncated
+    rows = [row for row in rows[:max_rows] if row.strip()]
+    values = _to_floats(b'\n'.join(rows), len(rows))
+    if values is None:
+        raise SRIMOutputParseError("unable to extract table from file")
+    return values
+
+
+def _to_floats(block, number_rows):
+    """Rows of whitespace separated numbers as 2D array (None if not a table)"""
+    if number_rows == 0:
+        return None
+    tokens = block.split()
+    columns = len(block[:block.find(b'\n')].split()) if b'\n' in block else len(tokens)
+    if columns == 0 or len(tokens) != columns * number_rows:
+        return None
+    try:
+        return np.array(tokens, dtype=np.float64).reshape(number_rows, columns)
+    except ValueError:
+        return None
+
+
+_RunHeader = namedtuple('_RunHeader', ['ion', 'num_ions', 'target'])
+
+
 class SRIM_Output(object):
     def _read_name(self, output):
         raise NotImplementedError()
@@ -98,6 +174,22 @@ class SRIM_Output(object):
             return res_layers
         raise SRIMOutputParseError("unable to extract total target from file")
 
+    def _read_run_header(self, output):
+        """Ion, number of ions and target of calculation
+
+        Every output file starts with the same description of the
+        calculation. Only the part before the table is searched.
+        """
+        table = output.find(b'>>>')
+        if table != -1:
+            try:
+                return _RunHeader(self._read_ion(output[:table]),
+                                  self._read_num_ions(output[:table]),
+                                  self._read_target(output[:table]))
+            except SRIMOutputParseError:
+                pass
+        return _RunHeader(self._read_ion(output), self._read_num_ions(output), self._read_target(output))
+
     def _read_num_ions(self, output):
         match = re.search(b'Total Ions calculated\\s+=(\\d+.\\d+)', output)
         if match:
@@ -105,34 +197,177 @@ class SRIM_Output(object):
             return int(float(match.group(1)))
         raise SRIMOutputParseError("unable to extract total ions from file")
 
-    def _read_table(self, output):
-        match = re.search((
-            rb'>>>\s+(.*)\s+<<<+\s+=+\s+([\w\W\s]*)'
-            rb'\r\n'
-            rb'\-+(?:\s+-+)+'
-        ), output, re.DOTALL)
-        # Read Data from table
+    def _read_table(self, output, max_rows=100):
+        units_start = output.find(b'>>>')
+        units_end = output.find(b'<<<', units_start)
+        if units_start == -1 or units_end == -1:
+            raise SRIMOutputParseError("unable to extract table from file")
+        # Units
+        units = output[units_start:units_end].lstrip(b'>').strip().decode("utf-8")
+
+        # header lines are between the rule below the units and the dashed rule
+        header_start = output.find(b'\n', output.find(b'\n', units_end) + 1) + 1
+        header_end = output.find(b'\n-', header_start)
+        if header_start == 0 or header_end == -1:
+            raise SRIMOutputParseError("unable to extract table from file")
+
+        # Headers
+        cols = [re.split(r'\s{2,}', s.strip()) for s in output[header_start:header_end].decode("utf-8").split("\n") if s.strip() != '']
+        header = []
+        for col in cols:
+            for j, c in enumerate(col):
+                c = c.strip()
+                if len(header) == j:
+                    header.append(c)
+                else:
+                    header[j] += ' '
+                    header[j] += c
 
-        if match:
-            # Headers
-            cols = [re.split(r'\s{2,}', s.strip()) for s in match.group(2).decode("utf-8").split("\r\n") if s.strip() != '']
-            header = []
-            for col in cols:
-                for j, c in enumerate(col):
-                    c = c.strip()
-                    if len(header) == j:
-                        header.append(c)
-                    else:
-                        header[j] += ' '
-                        header[j] += c
+        data = _read_rows(output, output.find(b'\n', header_end + 1) + 1, max_rows)
+        return data, header, units
 
-            # Units
-            units = match.group(1).strip().decode("utf-8")
+    @classmethod
+    def merge(cls, outputs):
+        """Combine outputs of independent calculations of the same setup
 
-            # Data
-            data = np.genfromtxt(BytesIO(output[match.end():]), max_rows=100)
-            return data, header, units
-        raise SRIMOutputParseError("unable to extract table from file")
+        All tables in SRIM output files are normalized per ion so the
+        combined tables are the average of each table weighted by the
+        number of ions in each calculation.
+
+        Parameters
+        ----------
+        outputs : :obj:`list`
+            outputs of the same type (e.g. :class:`srim.output.Ioniz`)
+            with identical depth bins
+
+        Returns
+        -------
+        output of same type with ``num_ions`` the total number of ions
+        """
+        outputs = list(outputs)
+        if not outputs:
+            raise ValueError('at least one output required to merge')
+
+        for output in outputs[1:]:
+            if not np.array_equal(output._depth, outputs[0]._depth):
+                raise ValueError('outputs must have identical depth bins to merge')
+
+        num_ions = sum(output.num_ions for output in outputs)
+        merged = cls.__new__(cls)
+        merged.__dict__.update(outputs[0].__dict__)
+        for key, value in outputs[0].__dict__.items():
+            if isinstance(value, np.ndarray) and key != '_depth':
+                merged.__dict__[key] = sum(
+                    output.__dict__[key] * output.num_ions for output in outputs
+                ) / num_ions
+        merged._num_ions = num_ions
+        return merged
+
+    @classmethod
+    def stitch(cls, outputs, offsets, scales, num_ions, columns=None, number_columns=None):
+        """Join outputs of consecutive depth segments of a target
+
+        Parameters
+        ----------
+        outputs : :obj:`list`
+            outputs of the same type, one per segment in order of depth
+        offsets : :obj:`list`
+            depth [Angstroms] of the front of each segment
+        scales : :obj:`list`
+            factor to multiply tables of each segment with, e.g. the
+            fraction of ions reaching the segment
+        num_ions : :obj:`int`
+            number of ions of the stitched output
+        columns : :obj:`list`, optional
+            for each segment the index of every element column of its
+            tables in the stitched tables. Needed when segments
+            contain different target elements
+        number_columns : :obj:`int`, optional
+            number of element columns of the stitched tables
+
+        Returns
+        -------
+        output of same type with depth bins of all segments
+        """
+        outputs = list(outputs)
+        if not outputs:
+            raise ValueError('at least one output required to stitch')
+
+        stitched = cls.__new__(cls)
+        stitched.__dict__.update(outputs[0].__dict__)
+        stitched._depth = np.concatenate([
+            output._depth + offset for output, offset in zip(outputs, offsets)
+        ])
+        for key, value in outputs[0].__dict__.items():
+            if not isinstance(value, np.ndarray) or key == '_depth':
+                continue
+
+            tables = []
+            for i, (output, scale) in enumerate(zip(outputs, scales)):
+                table = output.__dict__[key] * scale
+                if table.ndim == 2 and columns is not None and table.shape[1] == len(columns[i]):
+                    full_table = np.zeros((table.shape[0], number_columns))
+                    full_table[:, columns[i]] = table
+                    table = full_table
+                tables.append(table)
+            stitched.__dict__[key] = np.concatenate(tables)
+        stitched._num_ions = num_ions
+        return stitched
+
+
+class _LazyOutput(object):
+    """Output of :class:`Results` read from its directory on first access
+
+    The output is stored in the instance ``__dict__`` so that later
+    accesses do not go through the descriptor. Results without a
+    directory (e.g. merged) or without an optional file give None.
+
+    Parameters
+    ----------
+    output_class : :obj:`callable`
+        returns output class. Outputs are defined after Results so
+        the class is only looked up on first access
+    filename : :obj:`str`
+        filename of output in directory
+    required : :obj:`bool`, optional
+        raise when file is missing instead of giving None. Default False
+    errors : :obj:`tuple`, optional
+        exceptions of output class that mean the calculation did not
+        write the output and give None. Default ()
+    run_header : :obj:`bool`, optional
+        reuse the run header of ``IONIZ.txt`` once it has been
+        read. Default False
+    """
+    def __init__(self, output_class, filename, required=False, errors=(), run_header=False):
+        self.output_class = output_class
+        self.filename = filename
+        self.required = required
+        self.errors = errors
+        self.run_header = run_header
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, results, owner):
+        if results is None:
+            return self
+
+        directory = results.__dict__.get('_directory')
+        output = None
+        if directory is not None and (self.required or os.path.isfile(os.path.join(directory, self.filename))):
+            kwargs = {}
+            ioniz = results.__dict__.get('ioniz')
+            if self.run_header and ioniz is not None:
+                # all files describe the same calculation as IONIZ.txt
+                kwargs['run_header'] = _RunHeader(ioniz.ion, ioniz.num_ions, ioniz.target)
+
+            try:
+                output = self.output_class()(directory, self.filename, **kwargs)
+            except self.errors:
+                output = None
+        results.__dict__[self.name] = output
+        return output
 
 
 class Results(object):
@@ -142,6 +377,9 @@ class Results(object):
     ----------
     directory : :obj:`str`
         directory to look for TRIM calculations
+    lazy : :obj:`bool`, optional
+        read each file on first access of its attribute instead of
+        all files now. Default False
 
     Notes
     -----
@@ -155,20 +393,116 @@ class Results(object):
     
     Optionals:
       - ``RANGE-3D.txt`` handled by :class:`srim.output.Range3D`
+      - ``RANGE_3D.txt`` handled by :class:`srim.output.Range3DPositions`
+
+    Read on first access (None when the file was not written):
+      - ``BACKSCAT.txt`` as ``backscat`` handled by :class:`srim.output.Backscat`
+      - ``TRANSMIT.txt`` as ``transmit`` handled by :class:`srim.output.Transmit`
+      - ``SPUTTER.txt`` as ``sputter`` handled by :class:`srim.output.Sputter`
+
+    The run header (ion, number of ions and target) of ``IONIZ.txt``
+    is shared with the other files once ``IONIZ.txt`` has been
+    read. A lazy Results reads only the files that are used. Call
+    :meth:`srim.output.Results.read` before the directory is removed
+    or reused.
+
+    Examples
+    --------
+    Ion distributions of many calculations reading only ``RANGE.txt``
+
+    >>> [Results(directory, lazy=True).range.ions for directory in directories]
     """
-    def __init__(self, directory):
+    _outputs = ['ioniz', 'vacancy', 'novac', 'etorecoils', 'phonons', 'range']
+    _optional_outputs = ['backscat', 'transmit', 'sputter']
+
+    def __init__(self, directory, lazy=False):
         """ Retrives all the calculation files in a given directory"""
-        self.ioniz = Ioniz(directory)
-        self.vacancy = Vacancy(directory)
+        self._directory = directory
+        if not lazy:
+            for name in self._outputs:
+                getattr(self, name)
+
+    ioniz = _LazyOutput(lambda: Ioniz, 'IONIZ.txt', required=True)
+    vacancy = _LazyOutput(lambda: Vacancy, 'VACANCY.txt', required=True, run_header=True)
+    # NOVAC.txt has no table for quick KP calculations
+    novac = _LazyOutput(lambda: NoVacancy, 'NOVAC.txt', required=True, errors=ValueError, run_header=True)
+    etorecoils = _LazyOutput(lambda: EnergyToRecoils, 'E2RECOIL.txt', required=True, run_header=True)
+    phonons = _LazyOutput(lambda: Phonons, 'PHONON.txt', required=True, run_header=True)
+    range = _LazyOutput(lambda: Range, 'RANGE.txt', required=True, run_header=True)
+    backscat = _LazyOutput(lambda: Backscat, 'BACKSCAT.txt')
+    transmit = _LazyOutput(lambda: Transmit, 'TRANSMIT.txt')
+    sputter = _LazyOutput(lambda: Sputter, 'SPUTTER.txt')
+
+    def read(self):
+        """Read every output of Results not read yet
+
+        Afterwards Results no longer depends on its directory, which
+        may then be removed or reused by another calculation.
+        """
+        for name in self._outputs + self._optional_outputs:
+            getattr(self, name)
 
-        try:
-            self.novac = NoVacancy(directory)
-        except ValueError:
-            self.novac = None
+    @property
+    def available_files(self):
+        """Output files of Results written in directory (files are not read)"""
+        if self._directory is None:
+            return []
+
+        filenames = set(os.listdir(self._directory))
+        return [
+            output.filename for output in vars(type(self)).values()
+            if isinstance(output, _LazyOutput) and output.filename in filenames
+        ]
+
+    @classmethod
+    def merge(cls, results):
+        """Combine results of independent calculations of the same setup
+
+        See :meth:`srim.output.SRIM_Output.merge` for how each output
+        is combined.
+
+        Parameters
+        ----------
+        results : :obj:`list`
+            list of :class:`srim.output.Results`
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+        """
+        results = list(results)
+        merged = cls.__new__(cls)
+        merged._directory = None
+        for name in cls._outputs:
+            outputs = [getattr(result, name) for result in results]
+            if any(output is None for output in outputs):
+                setattr(merged, name, None)
+            else:
+                setattr(merged, name, type(outputs[0]).merge(outputs))
+        return merged
 
-        self.etorecoils = EnergyToRecoils(directory)
-        self.phonons = Phonons(directory)
-        self.range = Range(directory)
+    @classmethod
+    def stitch(cls, results, offsets, scales, num_ions, columns=None, number_columns=None):
+        """Join results of consecutive depth segments of a target
+
+        See :meth:`srim.output.SRIM_Output.stitch` for the parameters
+        and how each output is joined.
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+        """
+        results = list(results)
+        stitched = cls.__new__(cls)
+        stitched._directory = None
+        for name in cls._outputs:
+            outputs = [getattr(result, name) for result in results]
+            if any(output is None for output in outputs):
+                setattr(stitched, name, None)
+            else:
+                setattr(stitched, name, type(outputs[0]).stitch(
+                    outputs, offsets, scales, num_ions, columns, number_columns))
+        return stitched
 
     def get_range3d(self, directory):
         self.range3d = Range3D(directory)
@@ -183,14 +517,15 @@ class Ioniz(SRIM_Output):
          directory of calculation
     filename : :obj:`str`, optional
          filename for Ioniz. Default ``IONIZ.txt``
+    run_header : :obj:`tuple`, optional
+         ion, number of ions and target already read from another
+         output file of the calculation. Default read from this file
     """
-    def __init__(self, directory, filename='IONIZ.txt'):
+    def __init__(self, directory, filename='IONIZ.txt', run_header=None):
         with open(os.path.join(directory, filename), 'rb') as f:
             output = f.read()
-            ion = self._read_ion(output)
-            num_ions = self._read_num_ions(output)
+            ion, num_ions, target = run_header or self._read_run_header(output)
             data, header, units = self._read_table(output)
-            target = self._read_target(output)
 
         self._ion = ion
         self._num_ions = num_ions
@@ -268,14 +603,15 @@ class Vacancy(SRIM_Output):
          directory of calculation
     filename : :obj:`str`, optional
          filename for Vacancy. Default ``VACANCY.txt``
+    run_header : :obj:`tuple`, optional
+         ion, number of ions and target already read from another
+         output file of the calculation. Default read from this file
     """
-    def __init__(self, directory, filename='VACANCY.txt'):
+    def __init__(self, directory, filename='VACANCY.txt', run_header=None):
         with open(os.path.join(directory, filename), 'rb') as f:
             output = f.read()
-            ion = self._read_ion(output)
-            num_ions = self._read_num_ions(output)
+            ion, num_ions, target = run_header or self._read_run_header(output)
             data, header, units = self._read_table(output)
-            target = self._read_target(output)
 
         self._ion = ion
         self._num_ions = num_ions
@@ -351,8 +687,11 @@ class NoVacancy(SRIM_Output):
          directory of calculation
     filename : :obj:`str`, optional
          filename for NoVacancy. Default ``NOVAC.txt``
+    run_header : :obj:`tuple`, optional
+         ion, number of ions and target already read from another
+         output file of the calculation. Default read from this file
     """
-    def __init__(self, directory, filename='NOVAC.txt'):
+    def __init__(self, directory, filename='NOVAC.txt', run_header=None):
         with open(os.path.join(directory, filename), 'rb') as f:
             output = f.read()
 
@@ -361,10 +700,8 @@ class NoVacancy(SRIM_Output):
                          output):
                 raise ValueError('NOVAC has no data for KP calculations')
 
-            ion = self._read_ion(output)
-            num_ions = self._read_num_ions(output)
+            ion, num_ions, target = run_header or self._read_run_header(output)
             data, header, units = self._read_table(output)
-            target = self._read_target(output)
 
         self._ion = ion
         self._num_ions = num_ions
@@ -434,14 +771,15 @@ class EnergyToRecoils(SRIM_Output):
          directory of calculation
     filename : :obj:`str`, optional
          filename for EnergyToRecoils. Default ``E2RECOIL.txt``
+    run_header : :obj:`tuple`, optional
+         ion, number of ions and target already read from another
+         output file of the calculation. Default read from this file
     """
-    def __init__(self, directory, filename='E2RECOIL.txt'):
+    def __init__(self, directory, filename='E2RECOIL.txt', run_header=None):
         with open(os.path.join(directory, filename), 'rb') as f:
             output = f.read()
-            ion = self._read_ion(output)
-            num_ions = self._read_num_ions(output)
+            ion, num_ions, target = run_header or self._read_run_header(output)
             data, header, units = self._read_table(output)
-            target = self._read_target(output)
 
         self._ion = ion
         self._num_ions = num_ions
@@ -520,14 +858,15 @@ class Phonons(SRIM_Output):
          directory of calculation
     filename : :obj:`str`, optional
          filename for Phonons. Default ``PHONON.txt``
+    run_header : :obj:`tuple`, optional
+         ion, number of ions and target already read from another
+         output file of the calculation. Default read from this file
     """
-    def __init__(self, directory, filename='PHONON.txt'):
+    def __init__(self, directory, filename='PHONON.txt', run_header=None):
         with open(os.path.join(directory, filename), 'rb') as f:
             output = f.read()
-            ion = self._read_ion(output)
-            num_ions = self._read_num_ions(output)
+            ion, num_ions, target = run_header or self._read_run_header(output)
             data, header, units = self._read_table(output)
-            target = self._read_target(output)
 
         self._ion = ion
         self._num_ions = num_ions
@@ -604,14 +943,15 @@ class Range(SRIM_Output):
          directory of calculation
     filename : :obj:`str`, optional
          filename for Range. Default ``RANGE.txt``
+    run_header : :obj:`tuple`, optional
+         ion, number of ions and target already read from another
+         output file of the calculation. Default read from this file
     """
-    def __init__(self, directory, filename='RANGE.txt'):
+    def __init__(self, directory, filename='RANGE.txt', run_header=None):
         with open(os.path.join(directory, filename), 'rb') as f:
             output = f.read()
-            ion = self._read_ion(output)
-            num_ions = self._read_num_ions(output)
+            ion, num_ions, target = run_header or self._read_run_header(output)
             data, header, units = self._read_table(output)
-            target = self._read_target(output)
 
         self._ion = ion
         self._num_ions = num_ions
@@ -760,28 +1100,412 @@ class Range3D(SRIM_Output):
         return self._elements
 
 
-class Backscat(object):
+class Range3DPositions(SRIM_Output):
+    """``RANGE_3D.txt`` Final position of every ion stopped in the target
+
+    Parameters
+    ----------
+    directory : :obj:`str`
+         directory of calculation
+    filename : :obj:`str`, optional
+         filename for Range3DPositions. Default ``RANGE_3D.txt``
+    """
+    def __init__(self, directory, filename='RANGE_3D.txt'):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            output = f.read()
+            ion = self._read_ion(output)
+            data = self._read_positions(output)
+
+        self._ion = ion
+        self._ion_numbers = data[:, 0].astype(np.int64)
+        self._positions = data[:, 1:4]
+        self._depth = data[:, 1]
+        self._header = ["ION NUMBER", "DEPTH X (Ang)", "LATERAL Y (Ang)", "LATERAL Z (Ang)"]
+        self._units = 'Angstrom'
+        # the target of RANGE_3D.txt is written without stoichiometry
+        self._target = None
+
+    def _read_ion(self, output):
+        ion_regex = r'Ion\s+=\s+({})\s+\(\d+\).*?Energy\s+=\s+({})\s+keV'.format(
+            symbol_regex, double_regex)
+        match = re.search(ion_regex.encode('utf-8'), output, re.DOTALL)
+        if match:
+            symbol = str(match.group(1).decode('utf-8'))
+            energy = float(match.group(2)) #keV
+            return Ion(symbol, 1000.0 * energy)
+        raise SRIMOutputParseError("unable to extract ion from file")
+
+    def _read_positions(self, output):
+        match = re.search(rb'\n-+[ \t]+-[- \t]*\r?\n', output)
+        if match is None:
+            raise SRIMOutputParseError("unable to extract table from file")
+        return _read_rows(output, match.end())
+
+    @property
+    def header(self):
+        """Header of data table in SRIM Output file"""
+        return self._header
+
+    @property
+    def units(self):
+        """Units of positions"""
+        return self._units
+
+    @property
+    def target(self):
+        """Target is not in ``RANGE_3D.txt`` (None)"""
+        return self._target
+
+    @property
+    def ion(self):
+        """Ion used in SRIM calculation
+
+        **mass** could be wrong
+        """
+        return self._ion
+
+    @property
+    def num_ions(self):
+        """Number of ions stopped in target"""
+        return len(self._ion_numbers)
+
+    @property
+    def ion_numbers(self):
+        """Number of each ion in calculation"""
+        return self._ion_numbers
+
+    @property
+    def depth(self):
+        """Final depth [Ang] of each ion"""
+        return self._depth
+
+    @property
+    def positions(self):
+        """Final depth and lateral position (y, z) [Ang] of each ion"""
+        return self._positions
+
+
+class _Particles(object):
+    """ Particles leaving the target, one row per particle
+
+    ``BACKSCAT.txt``, ``TRANSMIT.txt`` and ``SPUTTER.txt`` share the
+    ``TRIM.DAT`` format with rows marked by their first letter. All
+    rows are converted with a single vectorized float conversion.
+    """
+    _record = None
+    _description = None
+
+    def __init__(self, directory, filename):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            output = f.read()
+
+        # rows: record, ion number, atomic number, energy, x, y, z, cos(x), cos(y), cos(z)
+        rows = re.findall(rb'^' + self._record + rb'[ \t]*(\d[^\r\n]*)', output, re.MULTILINE)
+        try:
+            # some locales write decimal commas
+            data = np.array(b' '.join(rows).replace(b',', b'.').split(), dtype=np.float64)
+        except ValueError:
+            raise SRIMOutputParseError('unable to read {} from file'.format(self._description))
+        if len(data) % 9:
+            raise SRIMOutputParseError('unable to read {} from file'.format(self._description))
+        data = data.reshape(-1, 9)
+
+        self._ion_number = data[:, 0].astype(np.int64)
+        self._atomic_number = data[:, 1].astype(np.int64)
+        self._energy = data[:, 2]
+        self._position = data[:, 3:6]
+        self._direction = data[:, 6:9]
+
+    @property
+    def num_ions(self):
+        """Number of particles"""
+        return len(self._energy)
+
+    @property
+    def ion_number(self):
+        """Number of ion in calculation of each particle"""
+        return self._ion_number
+
+    @property
+    def atomic_number(self):
+        """Atomic number of each particle"""
+        return self._atomic_number
+
+    @property
+    def energy(self):
+        """Energy [eV] of each particle"""
+        return self._energy
+
+    @property
+    def position(self):
+        """Depth and lateral position [Angstroms] where each particle left target"""
+        return self._position
+
+    @property
+    def direction(self):
+        """Direction cosines of each particle"""
+        return self._direction
+
+
+class Backscat(_Particles):
     """ The kinetics of all backscattered ions (energy, location and trajectory)
 
-    TODO: one day to be implemented! submit pull request please!
+    Parameters
+    ----------
+    directory : :obj:`str`
+         directory of calculation
+    filename : :obj:`str`, optional
+         filename for Backscat. Default ``BACKSCAT.txt``
     """
-    pass
+    _record = b'B'
+    _description = 'backscattered ions'
+
+    def __init__(self, directory, filename='BACKSCAT.txt'):
+        super(Backscat, self).__init__(directory, filename)
 
 
-class Transmit(object):
+class Transmit(_Particles):
     """ The kinetics of all transmitted ions (energy, location and trajectory)
 
-    TODO: one day to be implemented! submit pull request please!
+    ``TRANSMIT.txt`` has the same format as ``TRIM.DAT`` so the
+    transmitted ions can start a calculation behind the target (see
+    :meth:`to_trim_dat`).
+
+    Parameters
+    ----------
+    directory : :obj:`str`
+         directory of calculation
+    filename : :obj:`str`, optional
+         filename for Transmit. Default ``TRANSMIT.txt``
     """
-    pass
+    _record = b'T'
+    _description = 'transmitted ions'
+
+    def __init__(self, directory, filename='TRANSMIT.txt'):
+        super(Transmit, self).__init__(directory, filename)
+
+    def to_trim_dat(self):
+        """Transmitted ions starting at the surface of the next target
+
+        Returns
+        -------
+        :class:`srim.input.TRIMDat`
+            ions with depth reset to zero, and the lateral position
+            and direction they left the target with
+        """
+        position = self._position.copy()
+        position[:, 0] = 0.0
+        # cosines are written with few digits
+        direction = self._direction / np.linalg.norm(self._direction, axis=1)[:, np.newaxis]
+        return TRIMDat(self._atomic_number, self._energy, position, direction)
 
 
-class Sputter(object):
+class Sputter(_Particles):
     """ The kinetics of all target atoms sputtered from the target.
 
-    TODO: one day to be implemented! submit pull request please!
+    :attr:`atomic_number` is the element of each sputtered atom and
+    :attr:`ion_number` the ion whose cascade sputtered it.
+
+    Parameters
+    ----------
+    directory : :obj:`str`
+         directory of calculation
+    filename : :obj:`str`, optional
+         filename for Sputter. Default ``SPUTTER.txt``
     """
-    pass
+    _record = b'S'
+    _description = 'sputtered atoms'
+
+    def __init__(self, directory, filename='SPUTTER.txt'):
+        super(Sputter, self).__init__(directory, filename)
+
+    def yields(self, num_ions):
+        """Sputtering yield (atoms/ion) of each element
+
+        Parameters
+        ----------
+        num_ions : :obj:`int`
+            number of ions of calculation
+
+        Returns
+        -------
+        :obj:`dict`
+            atomic number to sputtered atoms per ion
+        """
+        numbers, counts = np.unique(self._atomic_number, return_counts=True)
+        return {int(number): float(count) / num_ions for number, count in zip(numbers, counts)}
+
+
+class Exyz(object):
+    """ Reads the ion trajectories of ``EXYZ.txt``
+
+    TRIM writes the position of each ion every ``exyz`` eV of energy
+    loss (see :class:`srim.srim.TRIMSettings`). The file is memory
+    mapped and read in batches of points so that files larger than
+    memory can be processed.
+
+    Each point is a row of a structured array with fields
+    ``ion_number``, ``energy`` [keV], ``position`` [Angstroms] (depth,
+    lateral y and z), ``stopping`` electronic stopping [eV/A] and
+    ``recoil_energy`` energy lost to last recoil [eV].
+
+    Parameters
+    ----------
+    directory : :obj:`str`
+         directory of calculation
+    filename : :obj:`str`, optional
+         filename for trajectories. Default ``EXYZ.txt``
+
+    Examples
+    --------
+    Density of ion track points on a 100x50x50 grid
+
+    >>> counts, edges = Exyz('/tmp/srim').histogram((100, 50, 50))
+    """
+    dtype = np.dtype([
+        ('ion_number', np.int64),
+        ('energy', np.float64),
+        ('position', np.float64, (3,)),
+        ('stopping', np.float64),
+        ('recoil_energy', np.float64),
+    ])
+
+    def __init__(self, directory, filename='EXYZ.txt'):
+        self.filename = os.path.join(directory, filename)
+        self._mmap = _map_file(self.filename)
+
+        # points start with the (zero padded) ion number
+        match = re.search(rb'^\d', self._mmap, re.MULTILINE)
+        self._start = match.start() if match else len(self._mmap)
+
+    def _read_points(self, data):
+        try:
+            # some locales write decimal commas
+            values = np.array(bytes(data).replace(b',', b'.').split(), dtype=np.float64)
+        except ValueError:
+            raise SRIMOutputParseError('unable to read trajectories from file')
+        if len(values) % 7:
+            raise SRIMOutputParseError('unable to read trajectories from file')
+        values = values.reshape(-1, 7)
+
+        points = np.empty(len(values), dtype=self.dtype)
+        points['ion_number'] = values[:, 0]
+        points['energy'] = values[:, 1]
+        points['position'] = values[:, 2:5]
+        points['stopping'] = values[:, 5]
+        points['recoil_energy'] = values[:, 6]
+        return points
+
+    def iter_batches(self, batch_size=1000000):
+        """Iterate over points in batches of whole trajectories
+
+        A batch holds about ``batch_size`` points. Batches never split
+        the trajectory of an ion so a batch is larger than
+        ``batch_size`` when a single ion has more points.
+
+        Parameters
+        ----------
+        batch_size : :obj:`int`, optional
+            approximate number of points in each batch. Default 1000000
+
+        Yields
+        ------
+        :obj:`numpy.ndarray`
+            points of consecutive ions. See :class:`srim.output.Exyz`
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size must be greater than zero')
+
+        line_length = self._mmap.find(b'\n', self._start) - self._start + 1
+        block_size = max(1, line_length) * batch_size
+
+        carry = None
+        position = self._start
+        while position < len(self._mmap):
+            end = self._mmap.find(b'\n', min(position + block_size, len(self._mmap)))
+            end = len(self._mmap) if end == -1 else end + 1
+            with memoryview(self._mmap)[position:end] as data:
+                points = self._read_points(data)
+            position = end
+
+            if carry is not None:
+                points = np.concatenate([carry, points])
+            if position >= len(self._mmap):
+                carry = None
+            else:
+                # keep last ion for next batch as it may continue there
+                last = np.searchsorted(points['ion_number'], points['ion_number'][-1]) \
+                    if np.all(np.diff(points['ion_number']) >= 0) else len(points)
+                if last == 0:
+                    # the ion continues past this block
+                    carry = points
+                    continue
+                points, carry = points[:last], points[last:]
+            yield points
+
+        if carry is not None and len(carry):
+            yield carry
+
+    def iter_ions(self, batch_size=1000000):
+        """Iterate over the trajectory of each ion
+
+        Yields
+        ------
+        :obj:`tuple`
+            ion number and its points
+        """
+        for points in self.iter_batches(batch_size):
+            starts = np.flatnonzero(np.diff(points['ion_number'])) + 1
+            for trajectory in np.split(points, starts):
+                if len(trajectory):
+                    yield int(trajectory['ion_number'][0]), trajectory
+
+    def histogram(self, bins=(100, 100, 100), range=None, batch_size=1000000):
+        """Histogram of trajectory points on a 3D grid of depth, y and z
+
+        Points are counted batch by batch so all points are never held
+        in memory at once.
+
+        Parameters
+        ----------
+        bins : :obj:`int` or :obj:`tuple`, optional
+            number of bins in each direction. Default (100, 100, 100)
+        range : :obj:`tuple`, optional
+            ((min, max), (min, max), (min, max)) [Angstroms] of grid.
+            Points outside are not counted. Default range of all
+            points (requires an additional pass over file)
+        batch_size : :obj:`int`, optional
+            see :meth:`iter_batches`
+
+        Returns
+        -------
+        :obj:`tuple`
+            counts in each bin and list of bin edges in each direction
+        """
+        if range is None:
+            low, high = np.full(3, np.inf), np.full(3, -np.inf)
+            for points in self.iter_batches(batch_size):
+                low = np.minimum(low, points['position'].min(axis=0))
+                high = np.maximum(high, points['position'].max(axis=0))
+            if np.any(np.isinf(low)):
+                low, high = np.zeros(3), np.ones(3)
+            range = list(zip(low, np.where(high > low, high, low + 1.0)))
+
+        counts, edges = np.histogramdd(np.zeros((0, 3)), bins=bins, range=range)
+        for points in self.iter_batches(batch_size):
+            counts += np.histogramdd(points['position'], bins=edges)[0]
+        return counts, edges
+
+    def close(self):
+        """Unmap the trajectories file"""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class Collision:
@@ -790,8 +1514,16 @@ class Collision:
     This is the most important file in my opinion. It records every
     single collision and its energies. The file will get huge for
     simulations with many collisions. Since the file can be larger
-    than the amount of RAM it will read the file in sections
-    (buffers).
+    than the amount of RAM it is memory mapped and only the ions
+    that are accessed are read.
+
+    The offsets of the ions and the summary of each ion are saved in
+    a sidecar index (``COLLISON.txt.idx``) next to the file. The index
+    is reused as long as the size and modification time of the file
+    are unchanged so that only the first open scans the file. The
+    first :meth:`query` adds the range of depths and recoil energies
+    and the atoms of every block of ions to the index so that later
+    queries skip blocks without parsing them.
 
     Parameters
     ----------
@@ -799,15 +1531,98 @@ class Collision:
          directory of calculation
     filename : :obj:`str`, optional
          filename for Collisions. Default ``COLLISON.txt``
+    index : :obj:`bool`, optional
+         read and write the sidecar index. The index is silently not
+         written when the directory is read only. Default True
 
     """
-    def __init__(self, directory, filename='COLLISON.txt'):
+    # start of the table of collisions of every ion
+    _ion_marker = b"  Ion    Energy"
+    _summary_marker = b"Summary of Ion #"
+    # number of ions of each block of the block statistics
+    _block_size = 1000
+
+    def __init__(self, directory, filename='COLLISON.txt', index=True):
         self.filename = os.path.join(directory, filename)
 
         with open(self.filename, encoding="latin-1") as f:
             self._read_header(f)
 
-        self._ion_index = buffered_findall(self.filename, b"  Ion    Energy")
+        self._mmap = _map_file(self.filename)
+        self._index_filename = self.filename + '.idx' if index else None
+        self._stat = os.stat(self.filename)
+        loaded = _read_collision_index(self._index_filename, self._stat, self._block_size) if index else None
+        if loaded is None:
+            self._ion_index = np.array(mmap_findall(self._mmap, self._ion_marker), dtype=np.int64)
+            self._summaries = self._read_summaries()
+            self._block_statistics = None
+            if index:
+                _write_collision_index(self._index_filename, self._stat, self._ion_index, self._summaries)
+        else:
+            self._ion_index, self._summaries, self._block_statistics = loaded
+
+    def arrays(self, start=0, stop=None):
+        """Collisions and cascades of ions as columnar arrays
+
+        Much more compact than :meth:`__getitem__` and allows
+        histogramming collisions without python loops.
+
+        Parameters
+        ----------
+        start : :obj:`int`, optional
+            index of first ion. Default 0
+        stop : :obj:`int`, optional
+            index after last ion. Default all ions in file
+
+        Returns
+        -------
+        :class:`srim.output.CollisionArrays`
+
+        Examples
+        --------
+        Histogram of the depth of collisions with recoils of Ni
+
+        >>> arrays = Collision('/tmp/srim').arrays()
+        >>> collisions = arrays.collisions
+        >>> np.histogram(collisions['depth'][collisions['atom'] == 28], bins=100)
+        """
+        start, stop, _ = slice(start, stop).indices(len(self._ion_index))
+        if start >= stop:
+            return _parse_collisions('')
+
+        begin = self._ion_index[start]
+        end = self._ion_index[stop] if stop < len(self._ion_index) else len(self._mmap)
+        with memoryview(self._mmap)[begin:end] as ion_bytes:
+            return _parse_collisions(str(ion_bytes, 'latin-1'))
+
+    @property
+    def summaries(self):
+        """Summary of every ion from its footer
+
+        Structured array with fields ``ion_number`` and the totals
+        ``displacements``, ``replacements``, ``vacancies``,
+        ``interstitials``, ``sputtered_atoms`` and
+        ``transmitted_atoms`` (each also as ``avg_<total>``) as in
+        :meth:`__getitem__`. Ions without a summary are ``-1`` and
+        ``nan``.
+        """
+        return self._summaries
+
+    def _read_summaries(self):
+        """Read footer of every ion without parsing its collisions"""
+        summaries = np.zeros(len(self._ion_index), dtype=_SUMMARY_DTYPE)
+        ends = list(self._ion_index[1:]) + [len(self._mmap)]
+        for i, (start, end) in enumerate(zip(self._ion_index, ends)):
+            position = self._mmap.find(self._summary_marker, start, end)
+            if position == -1:
+                summaries[i] = (-1,) + (np.nan,) * 12
+                continue
+
+            footer_end = self._mmap.find(b"\n=", position, end)
+            footer = self._mmap[position:end if footer_end == -1 else footer_end]
+            matches = re.findall(double_regex.encode('utf-8'), footer)
+            summaries[i] = (int(matches[0]),) + tuple(float(match) for match in matches[1:13])
+        return summaries
 
     def _read_header(self, f):
         """Read Header of COLLISON.txt
@@ -830,182 +1645,971 @@ class Collision:
         format:
            1 - Kinchin-Pease Theory (No full cascades)
            2 - full cascades
+
+        Parsed by the same rules as :meth:`arrays` (see
+        ``_iter_collision_ions``).
         """
-        # Notice that lines is an generator!
-        # This makes it so we can walk through lines
-        # in multiple for loops
-        lines = (line for line in ion_str.split('\n'))
+        for summary, rows in _iter_collision_ions(ion_str):
+            if summary is None:
+                raise SRIMOutputParseError("unable to extract ion summary from file")
+
+            collisions = []
+            for row, cascade in rows:
+                target = [None if value != value else value for value in row[8:12]]
+                collisions.append({
+                    'ion_number': row[0],
+                    'kinetic_energy': row[1],
+                    'depth': row[2],
+                    'lat_y_dist': row[3],
+                    'lat_z_dist': row[4],
+                    'stopping_energy': row[5],
+                    'atom': row[6],
+                    'recoil_energy': row[7],
+                    'target_disp': target[0],
+                    'target_vac': target[1],
+                    'target_replac': target[2],
+                    'target_inter': target[3],
+                    'cascade': None if cascade is None else [{
+                        'recoil': recoil[0],
+                        'atom': recoil[1],
+                        'recoil_energy': recoil[2],
+                        'position': np.array(recoil[3]),
+                        'vac': recoil[4],
+                        'repl': recoil[5]
+                    } for recoil in cascade]
+                })
+
+            ion = dict(zip(_SUMMARY_DTYPE.names, summary))
+            ion['collisions'] = collisions
+            return ion
+        raise SRIMOutputParseError("unable to extract ion from file")
 
-        # Skip Ion Header
-        for line in lines:
-            if re.match("^-+\r$", line):
-                break
+    def parse_parallel(self, workers=None, start=0, stop=None):
+        """Parse ions into columnar arrays with many processes
+
+        The ions are split into ranges of about equal size in bytes
+        that are parsed by separate processes. Each process hands its
+        arrays back through shared memory instead of pickling them.
+
+        Parameters
+        ----------
+        workers : :obj:`int`, optional
+            number of processes. Default number of cpus on machine
+        start : :obj:`int`, optional
+            index of first ion. Default 0
+        stop : :obj:`int`, optional
+            index after last ion. Default all ions in file
+
+        Returns
+        -------
+        :class:`srim.output.CollisionArrays`
+            same as :meth:`arrays`
+        """
+        workers = workers or os.cpu_count() or 1
+        start, stop, _ = slice(start, stop).indices(len(self))
+        ranges = self._byte_ranges(start, stop, 4 * workers)
+        if workers == 1 or len(ranges) <= 1:
+            return self.arrays(start, stop)
+
+        if os.name == 'posix':
+            # workers share the resource tracker of this process which
+            # removes any block left behind when this process exits
+            resource_tracker.ensure_running()
+
+        parts, errors = [], []
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_parse_to_shared_memory, self.filename, begin, end)
+                    for begin, end in ranges
+                ]
+                # wait for every worker so that no block is created after cleanup
+                for future in futures:
+                    try:
+                        parts.append(future.result())
+                    except Exception as error:
+                        errors.append(error)
+            if errors:
+                raise errors[0]
+            return _from_shared_memory(parts)
+        finally:
+            for name, _ in parts:
+                _unlink_shared_memory(name)
+
+    def query(self, table='collisions', atom=None, energy=None, depth=None,
+              ion_number=None, batch_size=10000):
+        """Collisions or recoils matching all filters
+
+        Ions outside of ``ion_number`` are skipped using the summaries
+        of the ion index. Blocks of ions whose range of depths and
+        recoil energies or whose atoms can not match the filters are
+        skipped using the block statistics of the index. The first
+        query with these filters parses every block once to record
+        its statistics. The remaining ions are parsed in batches.
+
+        Parameters
+        ----------
+        table : :obj:`str`, optional
+            ``collisions`` or ``recoils`` of cascades. Default
+            ``collisions``
+        atom : :obj:`str`, :obj:`int` or :obj:`list`, optional
+            symbol or atomic number of recoil atom (or list of them)
+        energy : :obj:`tuple`, optional
+            (min, max) recoil energy [eV]. Use None for an open bound
+        depth : :obj:`tuple`, optional
+            (min, max) depth [Angstroms] of collision or recoil
+        ion_number : :obj:`tuple`, optional
+            (min, max) ion number
+        batch_size : :obj:`int`, optional
+            number of ions parsed at once. Default 10000
+
+        Returns
+        -------
+        :obj:`numpy.ndarray`
+            matching rows of ``table``. See :class:`srim.output.CollisionArrays`
+
+        Examples
+        --------
+        Recoils of Ta above 1 keV between 2 and 5 um
+
+        >>> Collision('/tmp/srim').query('recoils', atom='Ta', energy=(1e3, None), depth=(2e4, 5e4))
+        """
+        filters = _query_filters(table, atom, energy, depth, ion_number)
+        if self._block_statistics is None and set(filters) - {'ion_number'}:
+            return self._query_recording_statistics(table, filters)
+
+        selected = np.ones(len(self), dtype=bool)
+        if ion_number is not None:
+            numbers = self._summaries['ion_number']
+            # ions without summary can not be skipped
+            selected = (numbers == -1) | _in_range(numbers, filters['ion_number'])
+        if self._block_statistics is not None:
+            blocks = _blocks_may_match(self._block_statistics, table, filters)
+            selected &= np.repeat(blocks, self._block_size)[:len(self)]
+
+        rows = []
+        starts = np.flatnonzero(selected & ~np.concatenate([[False], selected[:-1]]))
+        stops = np.flatnonzero(selected & ~np.concatenate([selected[1:], [False]])) + 1
+        for first, last in zip(starts, stops):
+            for start in range(first, last, batch_size):
+                rows.append(_select(self.arrays(start, min(start + batch_size, last)), table, filters))
+        return _concatenate_rows(rows, table)
+
+    def _query_recording_statistics(self, table, filters):
+        """Query every block of ions and record its statistics in the index"""
+        statistics = np.zeros(-(-len(self) // self._block_size), dtype=_BLOCK_STATISTICS_DTYPE)
+        rows = []
+        for i, start in enumerate(range(0, len(self), self._block_size)):
+            arrays = self.arrays(start, start + self._block_size)
+            statistics[i] = _block_statistics(arrays)
+            rows.append(_select(arrays, table, filters))
+
+        self._block_statistics = statistics
+        if self._index_filename is not None:
+            _write_collision_index(
+                self._index_filename, self._stat, self._ion_index, self._summaries,
+                statistics, self._block_size)
+        return _concatenate_rows(rows, table)
+
+    def to_store(self, filename, batch_size=10000, compression_level=6):
+        """Convert collisions into a compressed columnar store
+
+        The ions are parsed once in batches (see :meth:`iter_batches`)
+        and every batch is written as a chunk of zlib compressed numpy
+        arrays. Later analysis reads the store with
+        :class:`srim.output.CollisionStore` without parsing text.
+
+        Parameters
+        ----------
+        filename : :obj:`str`
+            filename of store
+        batch_size : :obj:`int`, optional
+            number of ions in each chunk. Default 10000
+        compression_level : :obj:`int`, optional
+            zlib compression level 0-9. Default 6
+        """
+        _write_collision_store(filename, self.iter_batches(batch_size), compression_level)
+
+    def _byte_ranges(self, start, stop, number):
+        """Split ions start to stop into at most number byte ranges of about equal size"""
+        if start >= stop:
+            return []
+
+        offsets = np.append(self._ion_index[start:stop], len(self._mmap)
+                            if stop == len(self) else self._ion_index[stop])
+        targets = np.linspace(offsets[0], offsets[-1], number + 1)
+        bounds = np.unique(np.searchsorted(offsets, targets))
+        bounds = np.unique(np.concatenate([[0], bounds, [len(offsets) - 1]]))
+        return [(int(offsets[i]), int(offsets[j])) for i, j in zip(bounds[:-1], bounds[1:])]
+
+    def iter_batches(self, batch_size=10000):
+        """Iterate over all ions in batches of columnar arrays
+
+        The file is read once from start to end and pages of the
+        file already parsed are released so that memory use is
+        bounded by the size of a batch for any file size.
+
+        Parameters
+        ----------
+        batch_size : :obj:`int`, optional
+            number of ions in each batch. Default 10000
+
+        Yields
+        ------
+        :class:`srim.output.CollisionArrays`
+            collisions and cascades of the next ``batch_size`` ions
+
+        Examples
+        --------
+        >>> counts = np.zeros(100)
+        >>> for batch in Collision('/tmp/srim').iter_batches(100000):
+        ...     counts += np.histogram(batch.recoils['position'][:, 0], bins=100, range=(0, 1e5))[0]
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size must be greater than zero')
+
+        if hasattr(self._mmap, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+        released = 0
+        for start in range(0, len(self), batch_size):
+            yield self.arrays(start, start + batch_size)
+
+            # drop pages of parsed ions from memory (file is read only)
+            stop = min(start + batch_size, len(self))
+            end = self._ion_index[stop] if stop < len(self) else len(self._mmap)
+            end -= end % mmap.PAGESIZE
+            if end > released and hasattr(mmap, 'MADV_DONTNEED') and not self._mmap.closed:
+                self._mmap.madvise(mmap.MADV_DONTNEED, released, end - released)
+                released = end
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('ion index out of range')
+
+        start = self._ion_index[i]
+
+        if i == len(self) - 1:
+            end = len(self._mmap)
+        else:
+            end = self._ion_index[i+1]
+
+        # We assume that ion_str will fit in RAM
+        with memoryview(self._mmap)[start:end] as ion_bytes:
+            return self._read_ion(str(ion_bytes, 'latin-1'))
+
+    def __len__(self):
+        return len(self._ion_index)
 
-        collisions = []
+    def close(self):
+        """Unmap the collisions file"""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
 
-        # Reads collisions for an ion
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CollisionArrays(object):
+    """ Columnar collisions and cascades of a range of ions
+
+    Atoms are stored as atomic numbers. The recoils of the cascade of
+    collision ``i`` are ``recoils[cascade_offsets[i]:cascade_offsets[i+1]]``
+    (see :meth:`cascade`). Collisions without a cascade have no recoils.
+
+    Parameters
+    ----------
+    ions : :obj:`numpy.ndarray`
+        summary of every ion. See :attr:`srim.output.Collision.summaries`
+    collisions : :obj:`numpy.ndarray`
+        structured array of collisions with fields ``ion_number``,
+        ``kinetic_energy`` [keV], ``depth``, ``lat_y_dist``,
+        ``lat_z_dist`` [Angstroms], ``stopping_energy`` [eV/A],
+        ``atom``, ``recoil_energy`` [eV], ``target_disp``,
+        ``target_vac``, ``target_replac`` and ``target_inter``
+        (``nan`` for cascades without summary)
+    recoils : :obj:`numpy.ndarray`
+        structured array of recoils of cascades with fields
+        ``recoil``, ``atom``, ``recoil_energy`` [eV], ``position``
+        [Angstroms], ``vac`` and ``repl``
+    cascade_offsets : :obj:`numpy.ndarray`
+        offset of first recoil of the cascade of each collision. One
+        more than ``collisions``
+    """
+    def __init__(self, ions, collisions, recoils, cascade_offsets):
+        self.ions = ions
+        self.collisions = collisions
+        self.recoils = recoils
+        self.cascade_offsets = cascade_offsets
+
+    def __len__(self):
+        return len(self.collisions)
+
+    def cascade(self, i):
+        """Recoils of cascade of collision i"""
+        return self.recoils[self.cascade_offsets[i]:self.cascade_offsets[i+1]]
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """Join arrays of consecutive ranges of ions
+
+        Parameters
+        ----------
+        arrays : :obj:`list`
+            list of :class:`srim.output.CollisionArrays`
+
+        Returns
+        -------
+        :class:`srim.output.CollisionArrays`
+        """
+        arrays = list(arrays)
+        if not arrays:
+            return _parse_collisions('')
+
+        recoil_offsets = np.cumsum([0] + [len(array.recoils) for array in arrays[:-1]])
+        return cls(
+            np.concatenate([array.ions for array in arrays]),
+            np.concatenate([array.collisions for array in arrays]),
+            np.concatenate([array.recoils for array in arrays]),
+            np.concatenate([arrays[0].cascade_offsets[:1]] + [
+                array.cascade_offsets[1:] + offset
+                for array, offset in zip(arrays, recoil_offsets)
+            ])
+        )
+
+    @property
+    def nbytes(self):
+        """Memory [bytes] used by arrays"""
+        return sum(array.nbytes for array in [
+            self.ions, self.collisions, self.recoils, self.cascade_offsets])
+
+
+_COLLISION_DTYPE = np.dtype([
+    ('ion_number', np.int32),
+    ('kinetic_energy', np.float64),
+    ('depth', np.float64),
+    ('lat_y_dist', np.float64),
+    ('lat_z_dist', np.float64),
+    ('stopping_energy', np.float64),
+    ('atom', np.uint8),
+    ('recoil_energy', np.float64),
+    ('target_disp', np.float64),
+    ('target_vac', np.float64),
+    ('target_replac', np.float64),
+    ('target_inter', np.float64),
+])
+
+_RECOIL_DTYPE = np.dtype([
+    ('recoil', np.int32),
+    ('atom', np.uint8),
+    ('recoil_energy', np.float64),
+    ('position', np.float64, (3,)),
+    ('vac', np.uint8),
+    ('repl', np.uint8),
+])
+
+
+def _is_rule(line, char):
+    """Line made only of char (e.g. ``====``)"""
+    line = line.rstrip()
+    return bool(line) and not line.strip(char)
+
+
+def _iter_collision_ions(text, atom=str.strip):
+    """Parse consecutive ions of COLLISON.txt
+
+    Yields a summary ``(ion_number, totals...)`` (None when the ion
+    footer is missing) and a list of ``(collision, cascade)`` for each
+    ion. A collision is a tuple of the fields of ``_COLLISION_DTYPE``
+    with the atom given by ``atom`` of its column (default symbol)
+    and NaN for a missing cascade summary. The cascade is a list of recoil tuples of the fields of
+    ``_RECOIL_DTYPE`` (None without full cascades).
+    """
+    nan = float('nan')
+    atoms = {} # atom of each distinct column
+
+    lines = iter(text.split('\n'))
+    for line in lines:
+        # dashes end the header of an ion
+        if not _is_rule(line, '-'):
+            continue
+
+        rows = []
         for line in lines:
-            if re.match("^=+\r$", line):
+            if _is_rule(line, '='):
                 break
 
             tokens = line.split(chr(179))[1:-1]
-
-            # Check if a full_cascades simulation
-            # Read Cascade information
-            if re.match(r"\s+<== Start of New Cascade\s+", tokens[-1]):
-                (target_disp,
-                 target_vac,
-                 target_replac,
-                 target_inter,
-                 cascade) = self._read_cascade(lines)
+            cascade = None
+            if 'Start of New Cascade' not in tokens[-1]:
+                target = (float(tokens[8]), 0, 0, 0)
             else:
-                target_disp = float(tokens[8])
-                target_vac = 0
-                target_replac = 0
-                target_inter = 0
-                cascade = None
-
-            collisions.append({
-                'ion_number': int(tokens[0]),
-                'kinetic_energy': float(tokens[1]),
-                'depth': float(tokens[2]),
-                'lat_y_dist': float(tokens[3]),
-                'lat_z_dist': float(tokens[4]),
-                'stopping_energy': float(tokens[5]),
-                'atom': re.search("([A-Z][a-z]?)", tokens[6]).group(1),
-                'recoil_energy': float(tokens[7]),
-                'target_disp': target_disp,
-                'target_vac': target_vac,
-                'target_replac': target_replac,
-                'target_inter': target_inter,
-                'cascade': cascade
-            })
+                target = (nan, nan, nan, nan)
+                cascade = []
+                next(lines) # rule
+                next(lines) # cascade header
+                for line in lines:
+                    if _is_rule(line, '='):
+                        break
+                    values = line.split()[1:-1]
+                    cascade.append((
+                        int(values[0]), int(values[1]), float(values[2]),
+                        (float(values[3]), float(values[4]), float(values[5])),
+                        int(values[6]), int(values[7])
+                    ))
+
+                if line.count('=') <= 100:
+                    values = next(lines).split(chr(179))[1:-1]
+                    if values:
+                        target = tuple(float(value) for value in values[2:6])
+
+            if tokens[6] not in atoms:
+                atoms[tokens[6]] = atom(tokens[6])
+            rows.append(((
+                int(tokens[0]), float(tokens[1]), float(tokens[2]),
+                float(tokens[3]), float(tokens[4]), float(tokens[5]),
+                atoms[tokens[6]], float(tokens[7])
+            ) + target, cascade))
 
             # Handles weird case where no summary of cascade
-            if target_disp is None:
-                break;
+            if target[0] != target[0]:
+                break
 
         # Reads ion footer
-        ion_number = re.search(int_regex, next(lines)).group(0)
-
-        footer = ""
-        for line in lines:
-            if re.match("^=+\r$", line):
+        line = next(lines, '')
+        footer = ''
+        for footer_line in lines:
+            if _is_rule(footer_line, '='):
                 break
-            footer += line
-
+            footer += footer_line
         matches = re.findall(double_regex, footer)
+        number = re.search(int_regex, line)
+        if number and len(matches) >= 12:
+            summary = (int(number.group(0)),) + tuple(float(match) for match in matches[:12])
+        else:
+            summary = None
+        yield summary, rows
+
+
+def _parse_collisions(text):
+    """Parse consecutive ions of COLLISON.txt into columnar arrays
+
+    Same rules as :meth:`Collision._read_ion` (both use
+    ``_iter_collision_ions``) with rows collected in arrays instead of
+    a dict per collision.
+    """
+    ions, collisions, recoils = [], [], []
+    offsets = [0]
+    missing = (-1,) + (float('nan'),) * 12
 
-        line = next(lines)
-
-        return {
-            'ion_number': int(ion_number),
-            'displacements': float(matches[0]),
-            'avg_displacements': float(matches[1]),
-            'replacements': float(matches[2]),
-            'avg_replacements': float(matches[3]),
-            'vacancies': float(matches[4]),
-            'avg_vacancies': float(matches[5]),
-            'interstitials': float(matches[6]),
-            'avg_interstitials': float(matches[7]),
-            'sputtered_atoms': float(matches[8]),
-            'avg_sputtered_atoms': float(matches[9]),
-            'transmitted_atoms': float(matches[10]),
-            'avg_transmitted_atoms': float(matches[11]),
-            'collisions': collisions
+    def atomic_number(column):
+        return ElementDB.lookup(column.strip())['z']
+
+    for summary, rows in _iter_collision_ions(text, atomic_number):
+        ions.append(missing if summary is None else summary)
+        for row, cascade in rows:
+            collisions.append(row)
+            if cascade:
+                recoils.extend(cascade)
+            offsets.append(len(recoils))
+
+    return CollisionArrays(
+        np.array(ions, dtype=_SUMMARY_DTYPE),
+        np.array(collisions, dtype=_COLLISION_DTYPE),
+        np.array(recoils, dtype=_RECOIL_DTYPE),
+        np.array(offsets, dtype=np.int64)
+    )
+
+
+class CollisionStore(object):
+    """ Reads a columnar store of collisions
+
+    The store is written by :meth:`srim.output.Collision.to_store`. It
+    holds chunks of consecutive ions with each array compressed
+    separately. The file is memory mapped and chunks are only
+    decompressed when read.
+
+    Parameters
+    ----------
+    filename : :obj:`str`
+        filename of store
+
+    Examples
+    --------
+    >>> Collision('/tmp/srim').to_store('/tmp/collisions.store')
+    >>> with CollisionStore('/tmp/collisions.store') as store:
+    ...     arrays = store.arrays()
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._mmap = _map_file(filename)
+
+        trailer = _STORE_TRAILER.size
+        if len(self._mmap) < len(_STORE_MAGIC) + trailer or self._mmap[:len(_STORE_MAGIC)] != _STORE_MAGIC:
+            self.close()
+            raise ValueError('{} is not a collision store'.format(filename))
+
+        offset, length, magic = _STORE_TRAILER.unpack(self._mmap[-trailer:])
+        if magic != _STORE_MAGIC:
+            self.close()
+            raise ValueError('{} is not a complete collision store'.format(filename))
+        header = json.loads(self._mmap[offset:offset + length].decode('utf-8'))
+
+        self._dtypes = {
+            name: np.lib.format.descr_to_dtype(_descr_from_json(descr))
+            for name, descr in header['dtypes'].items()
         }
+        self.chunks = header['chunks']
 
-    def _read_cascade(self, lines):
-        line = next(lines)
+    def __len__(self):
+        return sum(chunk['ions'] for chunk in self.chunks)
 
-        assert re.match("^=+\r$", line)
+    def read_chunk(self, i):
+        """Collisions and cascades of chunk i
 
+        Returns
+        -------
+        :class:`srim.output.CollisionArrays`
+        """
+        chunk = self.chunks[i]
+        arrays = {}
+        for name, (offset, size, length) in chunk['arrays'].items():
+            with memoryview(self._mmap)[offset:offset + size] as blob:
+                arrays[name] = np.frombuffer(zlib.decompress(blob), dtype=self._dtypes[name], count=length)
+        return CollisionArrays(
+            arrays['ions'], arrays['collisions'], arrays['recoils'], arrays['cascade_offsets'])
+
+    def query(self, table='collisions', atom=None, energy=None, depth=None, ion_number=None):
+        """Collisions or recoils matching all filters
+
+        Chunks whose range of values (see :meth:`srim.output.Collision.to_store`)
+        can not match the filters are not decompressed.
+
+        Parameters
+        ----------
+        table : :obj:`str`, optional
+            ``collisions`` or ``recoils`` of cascades. Default
+            ``collisions``
+        atom, energy, depth, ion_number :
+            filters. See :meth:`srim.output.Collision.query`
+
+        Returns
+        -------
+        :obj:`numpy.ndarray`
+            matching rows of ``table``
+        """
+        filters = _query_filters(table, atom, energy, depth, ion_number)
+        rows = []
+        for i, chunk in enumerate(self.chunks):
+            if _chunk_may_match(chunk['statistics'], table, filters):
+                rows.append(_select(self.read_chunk(i), table, filters))
+        return _concatenate_rows(rows, table)
+
+    def iter_batches(self):
+        """Iterate over chunks of store
+
+        Yields
+        ------
+        :class:`srim.output.CollisionArrays`
+        """
+        for i in range(len(self.chunks)):
+            yield self.read_chunk(i)
 
-        line = next(lines)
-        assert re.match((
-                r"  Recoil Atom Energy\(eV\)   X \(A\)      Y \(A\)      Z \(A\)"
-                r"   Vac Repl Ion Numb \d+="
-        ), line)
+    def arrays(self):
+        """Collisions and cascades of all ions in store
 
-        cascade = []
-        for line in lines:
-            if re.match("^=+\r$", line):
-                break
-            tokens = line.split()[1:-1]
-
-            cascade.append({
-                'recoil': int(tokens[0]),
-                'atom': int(tokens[1]),
-                'recoil_energy': float(tokens[2]),
-                'position': np.array([float(tokens[3]),
-                                      float(tokens[4]),
-                                      float(tokens[5])]),
-                'vac': int(tokens[6]),
-                'repl': int(tokens[7])
-            })
-
-        if line.count('=') > 100:
-            return None, None, None, None, cascade
-
-        line = next(lines)
-        tokens = line.split(chr(179))[1:-1]
-
-        if tokens:
-
-            target_disp = float(tokens[2])
-            target_vac = float(tokens[3])
-            target_replac = float(tokens[4])
-            target_inter = float(tokens[5])
-        else:
-            target_disp = None
-            target_vac = None
-            target_replac = None
-            target_inter = None
+        Returns
+        -------
+        :class:`srim.output.CollisionArrays`
+        """
+        return CollisionArrays.concatenate(self.iter_batches())
+
+    def close(self):
+        """Unmap the store"""
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# layout: magic, compressed arrays of every chunk, json header, trailer
+_STORE_MAGIC = b'PYSRIMCS'
+_STORE_VERSION = 1
+# offset and length of json header, magic
+_STORE_TRAILER = struct.Struct('<QQ8s')
+
+
+def _descr_from_json(descr):
+    """numpy dtype descr from its json representation (lists for tuples)"""
+    if isinstance(descr, str):
+        return descr
+    # fields are (name, descr) or (name, descr, shape)
+    return [(field[0], _descr_from_json(field[1])) + tuple(tuple(shape) for shape in field[2:])
+            for field in descr]
+
+
+def _chunk_statistics(arrays):
+    """Range of values of each numeric column of a chunk"""
+    statistics = {}
+    for name in ['collisions', 'recoils']:
+        array = getattr(arrays, name)
+        for field in array.dtype.names:
+            column = array[field]
+            if field == 'position':
+                column = column[:, 0]
+                field = 'depth'
+            column = column[~np.isnan(column)] if column.dtype.kind == 'f' else column
+            if len(column):
+                statistics['{}.{}'.format(name, field)] = [column.min().item(), column.max().item()]
+    return statistics
+
+
+_QUERY_STATISTICS = {
+    'collisions': {'energy': 'collisions.recoil_energy', 'depth': 'collisions.depth',
+                   'ion_number': 'collisions.ion_number', 'atom': 'collisions.atom'},
+    'recoils': {'energy': 'recoils.recoil_energy', 'depth': 'recoils.depth',
+                'ion_number': 'collisions.ion_number', 'atom': 'recoils.atom'},
+}
 
-        return target_disp, target_vac, target_replac, target_inter, cascade
 
-    def __getitem__(self, i):
-        start = self._ion_index[i]
+def _query_filters(table, atom, energy, depth, ion_number):
+    """Check filters of query and convert atoms to atomic numbers"""
+    if table not in _QUERY_STATISTICS:
+        raise ValueError('table must be collisions or recoils')
+
+    filters = {}
+    if atom is not None:
+        atoms = atom if isinstance(atom, (list, tuple, set)) else [atom]
+        filters['atom'] = [
+            ElementDB.lookup(atom)['z'] if isinstance(atom, str) else int(atom) for atom in atoms
+        ]
+    for name, bounds in [('energy', energy), ('depth', depth), ('ion_number', ion_number)]:
+        if bounds is None:
+            continue
+        if len(bounds) != 2:
+            raise ValueError('{} must be (min, max)'.format(name))
+        filters[name] = (
+            -np.inf if bounds[0] is None else bounds[0],
+            np.inf if bounds[1] is None else bounds[1]
+        )
+    return filters
+
+
+def _in_range(values, bounds):
+    return (values >= bounds[0]) & (values <= bounds[1])
+
+
+def _chunk_may_match(statistics, table, filters):
+    """False if range of values of chunk excludes any filter"""
+    for name, bounds in filters.items():
+        key = _QUERY_STATISTICS[table][name]
+        if key not in statistics:
+            # column is empty (or only nan) in chunk
+            return False
+        low, high = statistics[key]
+        if name == 'atom':
+            if not any(low <= atom <= high for atom in bounds):
+                return False
+        elif high < bounds[0] or low > bounds[1]:
+            return False
+    return True
+
+
+# range of depth and recoil energy and bitmask of atomic numbers
+# (bit z % 64 of word z // 64) of the collisions and recoils of a block
+_BLOCK_STATISTICS_DTYPE = np.dtype([
+    ('{}_{}'.format(table, name), dtype, 2)
+    for table in ['collisions', 'recoils']
+    for name, dtype in [('depth', '<f8'), ('energy', '<f8'), ('atoms', '<u8')]
+])
+
+
+def _atom_bitmask(atoms):
+    """Bitmask of atomic numbers for the block statistics"""
+    bitmask = [0, 0]
+    for atom in atoms:
+        if 0 <= atom < 128:
+            bitmask[atom // 64] |= 1 << (atom % 64)
+    return np.array(bitmask, dtype=np.uint64)
+
+
+def _block_statistics(arrays):
+    """Block statistics of CollisionArrays"""
+    statistics = np.zeros((), dtype=_BLOCK_STATISTICS_DTYPE)
+    for table in ['collisions', 'recoils']:
+        rows = getattr(arrays, table)
+        depth = rows['depth'] if table == 'collisions' else rows['position'][:, 0]
+        for name, column in [('depth', depth), ('energy', rows['recoil_energy'])]:
+            column = column[~np.isnan(column)]
+            # an empty range never matches
+            statistics['{}_{}'.format(table, name)] = (
+                (column.min(), column.max()) if len(column) else (np.inf, -np.inf))
+        statistics['{}_atoms'.format(table)] = _atom_bitmask(np.unique(rows['atom']).tolist())
+    return statistics
+
+
+def _blocks_may_match(statistics, table, filters):
+    """False for blocks whose statistics exclude any filter"""
+    may_match = np.ones(len(statistics), dtype=bool)
+    for name, bounds in filters.items():
+        if name == 'ion_number':
+            continue # summaries of the index skip ions
+        if name == 'atom':
+            may_match &= np.any(statistics['{}_atoms'.format(table)] & _atom_bitmask(bounds), axis=1)
+        else:
+            low, high = statistics['{}_{}'.format(table, name)].T
+            may_match &= (high >= bounds[0]) & (low <= bounds[1])
+    return may_match
+
+
+def _select(arrays, table, filters):
+    """Rows of table of CollisionArrays matching filters"""
+    rows = getattr(arrays, table)
+    if table == 'collisions':
+        columns = {'depth': rows['depth'], 'ion_number': rows['ion_number']}
+    else:
+        cascade_sizes = np.diff(arrays.cascade_offsets)
+        columns = {
+            'depth': rows['position'][:, 0],
+            'ion_number': np.repeat(arrays.collisions['ion_number'], cascade_sizes)
+        }
+    columns['energy'] = rows['recoil_energy']
 
-        if i == len(self._ion_index):
-            end = os.path.getsize(self.filename)
+    mask = np.ones(len(rows), dtype=bool)
+    for name, bounds in filters.items():
+        if name == 'atom':
+            mask &= np.isin(rows['atom'], bounds)
         else:
-            end = self._ion_index[i+1]
+            mask &= _in_range(columns[name], bounds)
+    return rows[mask]
+
+
+def _concatenate_rows(rows, table):
+    if not rows:
+        return np.zeros(0, dtype=_COLLISION_DTYPE if table == 'collisions' else _RECOIL_DTYPE)
+    return np.concatenate(rows)
+
+
+def _write_collision_store(filename, batches, compression_level=6):
+    """Write chunks of CollisionArrays to a collision store"""
+    chunks = []
+    dtypes = {}
+    ion = 0
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(_STORE_MAGIC)
+            for arrays in batches:
+                chunk = {'first_ion': ion, 'ions': len(arrays.ions), 'arrays': {}}
+                for name in ['ions', 'collisions', 'recoils', 'cascade_offsets']:
+                    array = getattr(arrays, name)
+                    dtypes[name] = np.lib.format.dtype_to_descr(array.dtype)
+                    blob = zlib.compress(np.ascontiguousarray(array).tobytes(), compression_level)
+                    chunk['arrays'][name] = [f.tell(), len(blob), len(array)]
+                    f.write(blob)
+                chunk['statistics'] = _chunk_statistics(arrays)
+                chunks.append(chunk)
+                ion += len(arrays.ions)
+
+            if not dtypes:
+                empty = _parse_collisions('')
+                dtypes = {
+                    name: np.lib.format.dtype_to_descr(getattr(empty, name).dtype)
+                    for name in ['ions', 'collisions', 'recoils', 'cascade_offsets']
+                }
+
+            header = json.dumps({
+                'version': _STORE_VERSION, 'dtypes': dtypes, 'chunks': chunks
+            }).encode('utf-8')
+            offset = f.tell()
+            f.write(header)
+            f.write(_STORE_TRAILER.pack(offset, len(header), _STORE_MAGIC))
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _parse_to_shared_memory(filename, begin, end):
+    """Parse bytes begin to end of COLLISON.txt into a new shared memory block
+
+    Returns the name of the block and the length of each array. The
+    caller unlinks the block.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(begin)
+        arrays = _parse_collisions(f.read(end - begin).decode('latin-1'))
+
+    parts = [arrays.ions, arrays.collisions, arrays.recoils, arrays.cascade_offsets]
+    block = shared_memory.SharedMemory(create=True, size=max(1, sum(part.nbytes for part in parts)))
+    try:
+        position = 0
+        for part in parts:
+            block.buf[position:position + part.nbytes] = part.tobytes()
+            position += part.nbytes
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+    return block.name, [len(part) for part in parts]
+
+
+def _from_shared_memory(parts):
+    """Copy arrays of consecutive shared memory blocks into one CollisionArrays"""
+    dtypes = [_SUMMARY_DTYPE, _COLLISION_DTYPE, _RECOIL_DTYPE, np.dtype(np.int64)]
+    totals = [sum(lengths[i] for _, lengths in parts) for i in range(3)]
+    arrays = [np.empty(total, dtype=dtype) for total, dtype in zip(totals, dtypes)]
+    cascade_offsets = [np.zeros(1, dtype=np.int64)]
+
+    filled = [0, 0, 0]
+    for name, lengths in parts:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            position = 0
+            for i, (length, dtype) in enumerate(zip(lengths, dtypes)):
+                view = np.frombuffer(block.buf, dtype=dtype, count=length, offset=position)
+                if i < 3:
+                    arrays[i][filled[i]:filled[i] + length] = view
+                else:
+                    cascade_offsets.append(view[1:] + filled[2])
+                position += view.nbytes
+                del view
+            for i in range(3):
+                filled[i] += lengths[i]
+        finally:
+            block.close()
 
-        with open(self.filename, "rb") as f:
-            f.seek(start)
-            # We assume that ion_str will fit in RAM
-            ion_str = f.read(end - start)
-            return self._read_ion(ion_str.decode('latin-1'))
+    return CollisionArrays(arrays[0], arrays[1], arrays[2], np.concatenate(cascade_offsets))
 
-    def __len__(self):
-        return len(self._ion_index) - 1
 
+def _unlink_shared_memory(name):
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
 
-def buffered_findall(filename, string, start=0):
-    """A method of reading a file in buffered pieces (needed for HUGE files)"""
+
+_SUMMARY_DTYPE = np.dtype([('ion_number', np.int64)] + [
+    (name, np.float64) for total in [
+        'displacements', 'replacements', 'vacancies', 'interstitials',
+        'sputtered_atoms', 'transmitted_atoms'
+    ] for name in [total, 'avg_' + total]
+])
+
+# magic, version, number of ions, size and mtime [ns] of indexed
+# file, number of ions of each block and number of block statistics
+_INDEX_HEADER = struct.Struct('<8sIQQqQQ')
+_INDEX_MAGIC = b'PYSRIMCI'
+_INDEX_VERSION = 2
+
+
+def _read_collision_index(filename, stat, block_size):
+    """Ion offsets, summaries and block statistics from sidecar index
+
+    Returns None if the index is missing or stale. The block
+    statistics are None if the index has none for ``block_size``.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(_INDEX_HEADER.size)
+            if len(header) != _INDEX_HEADER.size:
+                return None
+            magic, version, number_ions, size, mtime, index_block_size, number_blocks = _INDEX_HEADER.unpack(header)
+            if (magic, version, size, mtime) != (_INDEX_MAGIC, _INDEX_VERSION, stat.st_size, stat.st_mtime_ns):
+                return None
+            offsets = np.fromfile(f, dtype='<i8', count=number_ions)
+            summaries = np.fromfile(f, dtype=_SUMMARY_DTYPE.newbyteorder('<'), count=number_ions)
+            statistics = np.fromfile(f, dtype=_BLOCK_STATISTICS_DTYPE, count=number_blocks)
+    except OSError:
+        return None
+
+    if len(offsets) != number_ions or len(summaries) != number_ions:
+        return None
+    if number_blocks == 0 or index_block_size != block_size or len(statistics) != number_blocks:
+        statistics = None
+    return offsets.astype(np.int64), summaries.astype(_SUMMARY_DTYPE), statistics
+
+
+def _write_collision_index(filename, stat, offsets, summaries, statistics=None, block_size=0):
+    """Write sidecar index atomically (skipped if not possible)"""
+    if statistics is None:
+        statistics = np.zeros(0, dtype=_BLOCK_STATISTICS_DTYPE)
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(_INDEX_HEADER.pack(
+                _INDEX_MAGIC, _INDEX_VERSION, len(offsets), stat.st_size, stat.st_mtime_ns,
+                block_size, len(statistics)))
+            offsets.astype('<i8').tofile(f)
+            summaries.astype(_SUMMARY_DTYPE.newbyteorder('<')).tofile(f)
+            statistics.tofile(f)
+        os.replace(temporary, filename)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _map_file(filename):
+    """Read only memory map of file (empty bytes for an empty file)"""
     with open(filename, 'rb') as f:
-        filesize = os.path.getsize(filename)
-        BUFFERSIZE = 4096
-        overlap = len(string) - 1
-        buffer = None
-        positions = []
-
-        if start > 0:
-            f.seek(start)
-
-        while True:
-            if (f.tell() >= overlap and f.tell() < filesize):
-                f.seek(f.tell() - overlap)
-            buffer = f.read(BUFFERSIZE)
-            if buffer:
-                buffer_positions = [m.start() for m in re.finditer(string, buffer)]
-
-                for position in buffer_positions:
-                    if position >= 0:
-                        positions.append(f.tell() - len(buffer) + position)
-            else:
-                return positions
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        # the map stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def mmap_findall(buffer, string, start=0):
+    """Offsets of every occurrence of string in buffer
+
+    Uses the bytes search of :obj:`mmap.mmap` (or :obj:`bytes`) so
+    that a memory mapped file is searched at disk bandwidth.
+
+    Parameters
+    ----------
+    buffer : :obj:`mmap.mmap` or :obj:`bytes`
+        buffer to search
+    string : :obj:`bytes`
+        string to search for
+    start : :obj:`int`, optional
+        offset to start search from. Default 0
+
+    Returns
+    -------
+    :obj:`list`
+        offsets of string in increasing order
+    """
+    positions = []
+    position = buffer.find(string, start)
+    while position != -1:
+        positions.append(position)
+        position = buffer.find(string, position + len(string))
+    return positions
+
+
+def buffered_findall(filename, string, start=0):
+    """Offsets of every occurrence of string in file (needed for HUGE files)
+
+    The file is memory mapped instead of read into memory. See
+    :func:`srim.output.mmap_findall`.
+    """
+    buffer = _map_file(filename)
+    try:
+        return mmap_findall(buffer, string, start)
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
 
 class SRResults(object):
     """Read SR_OUTPUT.txt file generated by pysrim SR.run()"""
@@ -0,0 +1,325 @@
+""" Run many srim calculations at once
+
+TRIM reads its input from and writes its output to the directory it
+is launched in. Two calculations can therefore only run at the same
+time when each one has its own copy of the SRIM installation. The
+:class:`srim.parallel.TRIMPool` makes those copies and hands one to
+each worker. Since :meth:`srim.srim.TRIM.run` never changes the
+working directory the workers may either be processes or threads.
+"""
+import os
+import queue
+import asyncio
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .config import DEFAULT_SRIM_DIRECTORY
+
+# State private to each worker of a pool (one per process or thread)
+_worker = threading.local()
+
+
+def clone_srim_directory(srim_directory, directory):
+    """Copy a SRIM installation to directory
+
+    Parameters
+    ----------
+    srim_directory : :obj:`str`
+        path to srim directory. ``TRIM.exe`` should be located in
+        this directory.
+    directory : :obj:`str`
+        destination of the copy. Existing files are overwritten.
+
+    Returns
+    -------
+    :obj:`str`
+        absolute path of the copy
+    """
+    if not os.path.isdir(srim_directory):
+        raise ValueError('srim_directory must be directory')
+
+    shutil.copytree(srim_directory, directory, dirs_exist_ok=True)
+    return os.path.abspath(directory)
+
+
+def _init_worker(directories):
+    """Claim a SRIM directory for the lifetime of the worker"""
+    _worker.directory = directories.get()
+
+
+def _run_trim(trim, output_directory=None, timeout=None, idle_timeout=None):
+    """Run TRIM calculation in the worker's SRIM directory"""
+    # the directory is reused so remove the output files of the
+    # previous calculation (e.g. a TRANSMIT.txt this one does not write)
+    for path in trim._output_files(_worker.directory):
+        if os.path.isfile(path):
+            os.remove(path)
+    results = trim.run(_worker.directory, timeout=timeout, idle_timeout=idle_timeout)
+    # the next calculation overwrites the outputs and the pool removes the directory
+    results.read()
+    if output_directory is not None:
+        os.makedirs(output_directory, exist_ok=True)
+        trim.copy_output_files(_worker.directory, output_directory)
+        results._directory = output_directory
+    return results
+
+
+class TRIMPool(object):
+    """ Pool of workers running TRIM calculations in parallel
+
+    Each worker is given its own copy of the SRIM installation so
+    that ``TRIM.IN`` and the output files of one calculation never
+    collide with another.
+
+    Parameters
+    ----------
+    srim_directory : :obj:`str`, optional
+        path to srim directory to copy for each worker. Default
+        ``/tmp/srim``.
+    workers : :obj:`int`, optional
+        number of calculations to run at once. Default number of
+        cpus on machine.
+    directory : :obj:`str`, optional
+        directory to create worker copies of SRIM in. Default is a
+        temporary directory which is removed when the pool is closed.
+    threads : :obj:`bool`, optional
+        use threads instead of processes for workers. Each thread only
+        supervises a TRIM subprocess so this avoids starting a python
+        interpreter per worker. Default False.
+
+    Examples
+    --------
+    Run 32 Nickel in Nickel calculations 8 at a time.
+
+    >>> with TRIMPool('/tmp/srim', workers=8) as pool:
+    ...     results = pool.map([TRIM(target, ion, number_ions=100) for _ in range(32)])
+    """
+    def __init__(self, srim_directory=DEFAULT_SRIM_DIRECTORY, workers=None, directory=None, threads=False):
+        self.workers = workers or os.cpu_count() or 1
+        if self.workers < 1:
+            raise ValueError('workers must be greater than zero')
+
+        self._temporary = directory is None
+        self.directory = os.path.abspath(directory or tempfile.mkdtemp(prefix='pysrim-'))
+        self.worker_directories = [
+            clone_srim_directory(srim_directory, os.path.join(self.directory, 'worker-{}'.format(i)))
+            for i in range(self.workers)
+        ]
+
+        if threads:
+            directories = queue.Queue()
+            executor_class = ThreadPoolExecutor
+        else:
+            directories = multiprocessing.Queue()
+            executor_class = ProcessPoolExecutor
+
+        for worker_directory in self.worker_directories:
+            directories.put(worker_directory)
+
+        self._executor = executor_class(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(directories,))
+        self._futures = set()
+
+    def submit(self, trim, output_directory=None, timeout=None, idle_timeout=None):
+        """Schedule a TRIM calculation
+
+        Parameters
+        ----------
+        trim : :class:`srim.srim.TRIM`
+            calculation to run
+        output_directory : :obj:`str`, optional
+            if given copy the output files of calculation to this
+            directory. See :meth:`srim.srim.TRIM.copy_output_files`.
+        timeout : :obj:`float`, optional
+            seconds before TRIM is killed. Default no limit.
+        idle_timeout : :obj:`float`, optional
+            seconds without progress before TRIM is killed. Default no
+            limit. See :meth:`srim.srim.TRIMProcess.wait`.
+
+        Returns
+        -------
+        :class:`concurrent.futures.Future`
+            future of :class:`srim.output.Results`
+        """
+        future = self._executor.submit(_run_trim, trim, output_directory, timeout, idle_timeout)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def map(self, trims, output_directories=None):
+        """Run TRIM calculations and wait for all of them
+
+        Parameters
+        ----------
+        trims : :obj:`list`
+            list of :class:`srim.srim.TRIM` calculations
+        output_directories : :obj:`list`, optional
+            list of directories (one per calculation) to copy output
+            files to.
+
+        Returns
+        -------
+        :obj:`list`
+            list of :class:`srim.output.Results` in the same order as
+            ``trims``
+        """
+        trims = list(trims)
+        if output_directories is None:
+            output_directories = [None] * len(trims)
+        elif len(output_directories) != len(trims):
+            raise ValueError('output_directories must have one directory per calculation')
+
+        futures = [self.submit(trim, output_directory) for trim, output_directory in zip(trims, output_directories)]
+        return [future.result() for future in futures]
+
+    def close(self, cancel=False):
+        """Wait for running calculations and remove temporary SRIM copies
+
+        Parameters
+        ----------
+        cancel : :obj:`bool`, optional
+            cancel calculations that have not started yet. Default False.
+        """
+        # shutdown(cancel_futures=True) requires python 3.9
+        if cancel:
+            for future in list(self._futures):
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+
+def run_many(trims, srim_directory=DEFAULT_SRIM_DIRECTORY, workers=None, output_directories=None, threads=False):
+    """Run TRIM calculations in parallel
+
+    Shortcut for creating a :class:`srim.parallel.TRIMPool`, running
+    all calculations, and closing the pool.
+
+    Parameters
+    ----------
+    trims : :obj:`list`
+        list of :class:`srim.srim.TRIM` calculations
+    srim_directory : :obj:`str`, optional
+        path to srim directory. Default ``/tmp/srim``.
+    workers : :obj:`int`, optional
+        number of calculations to run at once. Default number of cpus
+        on machine.
+    output_directories : :obj:`list`, optional
+        list of directories (one per calculation) to copy output files
+        to.
+    threads : :obj:`bool`, optional
+        use threads instead of processes for workers. Default False.
+
+    Returns
+    -------
+    :obj:`list`
+        list of :class:`srim.output.Results` in submission order
+    """
+    trims = list(trims)
+    workers = min(workers or os.cpu_count() or 1, max(len(trims), 1))
+    with TRIMPool(srim_directory, workers=workers, threads=threads) as pool:
+        return pool.map(trims, output_directories)
+
+
+async def gather(*aws, limit=None, return_exceptions=False):
+    """Like :func:`asyncio.gather` with at most ``limit`` awaitables running at once
+
+    Coroutines are only started once a slot is free so hundreds of
+    calculations may be queued without launching them all.
+
+    Parameters
+    ----------
+    aws :
+        coroutines to run, e.g. from :meth:`srim.srim.TRIM.run_async`
+    limit : :obj:`int`, optional
+        maximum number of coroutines running at once. Default no limit
+    return_exceptions : :obj:`bool`, optional
+        see :func:`asyncio.gather`. Default False
+
+    Returns
+    -------
+    :obj:`list`
+        results in the same order as ``aws``
+    """
+    if limit is None:
+        return await asyncio.gather(*aws, return_exceptions=return_exceptions)
+
+    if limit < 1:
+        raise ValueError('limit must be greater than zero')
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[bounded(aw) for aw in aws], return_exceptions=return_exceptions)
+
+
+async def run_many_async(trims, srim_directory=DEFAULT_SRIM_DIRECTORY, workers=None, directory=None):
+    """Run TRIM calculations concurrently from an asyncio event loop
+
+    The SRIM installation is copied once per worker and each
+    calculation waits for a free copy before launching.
+
+    Parameters
+    ----------
+    trims : :obj:`list`
+        list of :class:`srim.srim.TRIM` calculations
+    srim_directory : :obj:`str`, optional
+        path to srim directory. Default ``/tmp/srim``.
+    workers : :obj:`int`, optional
+        number of calculations to run at once. Default number of cpus
+        on machine.
+    directory : :obj:`str`, optional
+        directory to create worker copies of SRIM in. Default is a
+        temporary directory which is removed when all calculations
+        have finished.
+
+    Returns
+    -------
+    :obj:`list`
+        list of :class:`srim.output.Results` in submission order
+    """
+    trims = list(trims)
+    workers = min(workers or os.cpu_count() or 1, max(len(trims), 1))
+    temporary = directory is None
+    directory = os.path.abspath(directory or tempfile.mkdtemp(prefix='pysrim-'))
+
+    directories = asyncio.Queue()
+    for i in range(workers):
+        directories.put_nowait(clone_srim_directory(
+            srim_directory, os.path.join(directory, 'worker-{}'.format(i))))
+
+    async def run(trim):
+        worker_directory = await directories.get()
+        try:
+            results = await trim.run_async(worker_directory)
+            results.read() # before worker directory is reused or removed
+            return results
+        finally:
+            directories.put_nowait(worker_directory)
+
+    tasks = [asyncio.ensure_future(run(trim)) for trim in trims]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # do not leave calculations running in directories about to be removed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
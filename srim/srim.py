@@ -2,9 +2,16 @@
 
 """
 import os
+import re
 import random
+import asyncio
+import time
+import signal
 import subprocess
 import shutil
+import functools
+import concurrent.futures
+from collections import namedtuple
 
 from .core.utils import (
     check_input,
@@ -15,9 +22,409 @@ from .core.utils import (
     is_quoteless
 )
 
-from .output import Results, SRResults
-from .input import AutoTRIM, TRIMInput, SRInput
+from .output import Results, SRResults, SRIMOutputParseError
+from .input import AutoTRIM, TRIMInput, SRInput, RESTORE_DIRECTORY
 from .config import DEFAULT_SRIM_DIRECTORY
+from .parallel import TRIMPool
+
+
+# Files written by TRIM that pysrim knows about (and TRIM.IN)
+TRIM_OUTPUT_FILES = {
+    'TRIM.IN', 'PHONON.txt', 'E2RECOIL.txt', 'IONIZ.txt',
+    'LATERAL.txt', 'NOVAC.txt', 'RANGE.txt', 'VACANCY.txt',
+    'COLLISON.txt', 'BACKSCAT.txt', 'SPUTTER.txt',
+    'RANGE_3D.txt', 'TRANSMIT.txt', 'TRIMOUT.txt',
+    'TDATA.txt', 'EXYZ.txt'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _wine_executable():
+    """Path to wine (looked up once per process) or None"""
+    return shutil.which("wine")
+
+
+def _launch_command(directory, executable):
+    """Command to launch SRIM executable located in directory
+
+    Make sure compatible with Windows, OSX, and Linux. If 'wine'
+    command exists use it to launch executable.
+    """
+    executable = os.path.join(os.path.abspath(directory), executable)
+    wine = _wine_executable()
+    if wine:
+        return [wine, executable]
+    return [executable]
+
+
+def _remove_files(paths):
+    """Remove files that exist of paths"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _restore_from_cache(cache, calculation, directory):
+    """Copy cached output files of calculation to directory
+
+    Returns True if the calculation was found in cache.
+    """
+    entry = cache.get(calculation)
+    if entry is None:
+        return False
+
+    try:
+        for filename in os.listdir(entry):
+            shutil.copy(os.path.join(entry, filename), directory)
+    except FileNotFoundError:
+        return False # evicted while copying
+    return True
+
+
+def _kill(process):
+    """Kill process started in its own session together with its children"""
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def _check_call_async(command, cwd, env=None):
+    """Asyncio equivalent of :func:`subprocess.check_call`
+
+    The child is started in its own session so that wine's children
+    are killed with it. If the awaiting task is cancelled the child is
+    killed before the cancellation propagates.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd, env=env, start_new_session=(os.name == 'posix'))
+    try:
+        returncode = await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            _kill(process)
+            await process.wait()
+        raise
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def _has_checkpoint(srim_directory, since):
+    """Whether TRIM autosaved a calculation after time since"""
+    restore_directory = os.path.join(srim_directory, RESTORE_DIRECTORY)
+    if not os.path.isdir(restore_directory):
+        return False
+    return any(
+        os.path.getmtime(os.path.join(restore_directory, filename)) >= since
+        for filename in os.listdir(restore_directory)
+    )
+
+
+class TRIMRunError(Exception):
+    """TRIM calculation did not complete"""
+    pass
+
+
+class TRIMTimeoutError(TRIMRunError):
+    """TRIM was killed for running too long or making no progress"""
+    pass
+
+
+# Output files every TRIM calculation writes and Results requires
+_REQUIRED_OUTPUT_FILES = ['IONIZ.txt', 'VACANCY.txt', 'E2RECOIL.txt', 'PHONON.txt', 'RANGE.txt']
+
+
+def _progress_files(srim_directory):
+    """Paths of files TRIM writes while it runs (output and autosave files)"""
+    filenames = [os.path.join(srim_directory, filename) for filename in TRIM_OUTPUT_FILES - {'TRIM.IN'}]
+    restore_directory = os.path.join(srim_directory, RESTORE_DIRECTORY)
+    if os.path.isdir(restore_directory):
+        filenames.extend(os.path.join(restore_directory, filename) for filename in os.listdir(restore_directory))
+    return filenames
+
+
+def _last_modified(srim_directory):
+    """Most recent modification time of TRIM output and autosave files"""
+    last_modified = None
+    for filename in _progress_files(srim_directory):
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            continue
+        if last_modified is None or mtime > last_modified:
+            last_modified = mtime
+    return last_modified
+
+
+def _last_progress(srim_directory, started):
+    """Unix time TRIM launched at started last wrote an output or autosave file"""
+    last_modified = _last_modified(srim_directory)
+    if last_modified is None or last_modified < started:
+        return started
+    return last_modified
+
+
+def _check_timeouts(srim_directory, started, timeout=None, idle_timeout=None):
+    """Raise :class:`srim.srim.TRIMTimeoutError` if TRIM launched at started timed out"""
+    now = time.time()
+    if timeout is not None and now - started > timeout:
+        raise TRIMTimeoutError('TRIM ran longer than {} seconds'.format(timeout))
+    if idle_timeout is not None and now - _last_progress(srim_directory, started) > idle_timeout:
+        raise TRIMTimeoutError('TRIM made no progress for {} seconds'.format(idle_timeout))
+
+
+def _trim_results(trim, srim_directory, since):
+    """Results of trim in srim_directory after checking they are complete
+
+    Output files older than ``since`` (modification time of the input
+    file) were left behind by a previous calculation.
+    """
+    for filename in _REQUIRED_OUTPUT_FILES:
+        path = os.path.join(srim_directory, filename)
+        if not os.path.isfile(path):
+            raise TRIMRunError('TRIM did not write {}'.format(filename))
+        if os.path.getmtime(path) < since:
+            raise TRIMRunError('{} is left over from a previous calculation'.format(filename))
+
+    try:
+        results = Results(srim_directory)
+    except SRIMOutputParseError as e:
+        raise TRIMRunError('TRIM output files are incomplete') from e
+
+    if results.ioniz.num_ions < trim.number_ions:
+        raise TRIMRunError('TRIM exited after {} of {} ions'.format(
+            results.ioniz.num_ions, trim.number_ions))
+    return results
+
+
+Progress = namedtuple('Progress', ['ions', 'total', 'elapsed', 'rate', 'average_rate', 'eta'])
+Progress.__doc__ = """Progress of a running TRIM calculation
+
+``ions`` is the number of ions TRIM last reported as completed out
+of ``total``. ``elapsed`` is the seconds since launch. ``rate`` is
+the ions/s between the last two reports and ``average_rate`` the
+ions/s since launch (both None before the first report). ``eta`` is
+the estimated seconds until all ions are completed (or None).
+"""
+
+_TOTAL_IONS_RE = re.compile(rb'Total Ions calculated\s*=\s*([\d.]+)')
+
+
+def _ions_completed(srim_directory, since):
+    """Number of ions reported by files TRIM wrote after time since
+
+    Returns the number of ions and the modification time of the file
+    reporting it (None and None when no file reports ions yet).
+    """
+    ions, reported = None, None
+    for filename in _progress_files(srim_directory):
+        try:
+            mtime = os.path.getmtime(filename)
+            if mtime < since:
+                continue
+            with open(filename, 'rb') as f:
+                match = _TOTAL_IONS_RE.search(f.read(8192)) # number is in header
+        except OSError:
+            continue
+        if match and (ions is None or int(float(match.group(1))) > ions):
+            ions, reported = int(float(match.group(1))), mtime
+    return ions, reported
+
+
+class TRIMProcess(object):
+    """ Handle of a running TRIM calculation
+
+    Returned by :meth:`srim.srim.TRIM.start`. The input files must
+    already be written to ``srim_directory``.
+
+    Parameters
+    ----------
+    trim : :class:`srim.srim.TRIM`
+        calculation being run
+    srim_directory : :obj:`str`
+        path to srim directory TRIM is launched in
+    env : :obj:`dict`, optional
+        environment variables for TRIM process. Default inherit from
+        python process.
+    """
+    def __init__(self, trim, srim_directory, env=None):
+        self.trim = trim
+        self.srim_directory = os.path.abspath(srim_directory)
+        self.command = _launch_command(self.srim_directory, 'TRIM.exe')
+        # filesystem time of the input files so that comparing with
+        # output files does not depend on the filesystem's clock
+        self._since = max(
+            os.path.getmtime(trim._input_file(self.srim_directory)),
+            os.path.getmtime(os.path.join(self.srim_directory, 'TRIMAUTO')))
+        self.started = time.time()
+        # own session so that killing TRIM also kills wine's children
+        self._process = subprocess.Popen(
+            self.command, cwd=self.srim_directory, env=env,
+            start_new_session=(os.name == 'posix'))
+        self._reports = [] # (time, ions) of distinct progress reports
+
+    @property
+    def returncode(self):
+        """Exit code of TRIM or None while running"""
+        return self._process.poll()
+
+    def last_progress(self):
+        """Unix time TRIM last wrote an output or autosave file (or was launched)"""
+        return _last_progress(self.srim_directory, self.started)
+
+    def progress(self):
+        """Current progress of calculation
+
+        Reads the number of ions completed from the output, ``TDATA.txt``
+        and autosave files TRIM wrote since launch. TRIM only updates
+        these files on autosave (see ``autosave`` of
+        :class:`srim.srim.TRIMSettings`) and on exit so a smaller
+        autosave interval gives finer progress.
+
+        Returns
+        -------
+        :class:`srim.srim.Progress`
+        """
+        now = time.time()
+        ions, reported = _ions_completed(self.srim_directory, self._since)
+        if ions is not None and (not self._reports or ions > self._reports[-1][1]):
+            self._reports.append((max(reported, self.started), ions))
+
+        rate, average_rate, eta = None, None, None
+        if self._reports:
+            reported, ions = self._reports[-1]
+            if reported > self.started:
+                average_rate = ions / (reported - self.started)
+            rate = average_rate
+            if len(self._reports) > 1:
+                previous_reported, previous_ions = self._reports[-2]
+                if reported > previous_reported:
+                    rate = (ions - previous_ions) / (reported - previous_reported)
+            if rate:
+                eta = max(self.trim.number_ions - ions, 0) / rate
+        else:
+            ions = 0
+
+        return Progress(
+            ions=ions, total=self.trim.number_ions, elapsed=now - self.started,
+            rate=rate, average_rate=average_rate, eta=eta)
+
+    def watch(self, interval=1.0):
+        """Yield progress every interval seconds until TRIM exits
+
+        The last progress is yielded after TRIM has exited.
+
+        Examples
+        --------
+        >>> process = trim.start('/tmp/srim')
+        >>> for progress in process.watch(interval=10):
+        ...     print('{0.ions}/{0.total} ions, eta {0.eta} s'.format(progress))
+        >>> results = process.wait()
+        """
+        while True:
+            try:
+                self._process.wait(timeout=interval)
+            except subprocess.TimeoutExpired:
+                yield self.progress()
+            else:
+                yield self.progress()
+                return
+
+    def kill(self):
+        """Kill TRIM (and wine) and wait for it to exit"""
+        if self._process.poll() is None:
+            _kill(self._process)
+        self._process.wait()
+
+    def wait(self, timeout=None, idle_timeout=None, poll_interval=1.0, callback=None):
+        """Wait for TRIM to finish and return its verified results
+
+        Parameters
+        ----------
+        timeout : :obj:`float`, optional
+            seconds TRIM may run in total. Default no limit.
+        idle_timeout : :obj:`float`, optional
+            seconds TRIM may run without writing an output or
+            autosave file. Default no limit.
+        poll_interval : :obj:`float`, optional
+            seconds between checks of TRIM. Default 1.
+        callback : :obj:`callable`, optional
+            called with :class:`srim.srim.Progress` after every check
+            of TRIM. May call :meth:`srim.srim.TRIMProcess.kill` to
+            stop a straggler.
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+
+        Raises
+        ------
+        :class:`srim.srim.TRIMTimeoutError`
+            TRIM was killed after a timeout
+        :class:`subprocess.CalledProcessError`
+            TRIM exited with an error
+        :class:`srim.srim.TRIMRunError`
+            output files are missing, stale, or have too few ions
+        """
+        try:
+            while True:
+                try:
+                    returncode = self._process.wait(timeout=poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                self._check(timeout, idle_timeout, callback)
+        except BaseException:
+            self.kill()
+            raise
+        return self._results(returncode)
+
+    async def wait_async(self, timeout=None, idle_timeout=None, poll_interval=1.0, callback=None):
+        """Await TRIM from an asyncio event loop and return its verified results
+
+        Same as :meth:`srim.srim.TRIMProcess.wait` except that TRIM is
+        awaited instead of blocking. Cancelling the task kills TRIM.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    returncode = await loop.run_in_executor(None, self._process.wait, poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                self._check(timeout, idle_timeout, callback)
+        except BaseException:
+            self.kill()
+            raise
+        return self._results(returncode)
+
+    def _check(self, timeout, idle_timeout, callback):
+        """Report progress and raise if TRIM timed out"""
+        if callback is not None:
+            callback(self.progress())
+        _check_timeouts(self.srim_directory, self.started, timeout, idle_timeout)
+
+    def _results(self, returncode):
+        """Verified results of TRIM after it exited with returncode"""
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command)
+        return _trim_results(self.trim, self.srim_directory, self._since)
+
+
+def _shard_seeds(random_seed, number_shards):
+    """Distinct random seeds for shards of a calculation
+
+    The seeds are drawn from a generator seeded with ``random_seed``
+    so that the same calculation always produces the same shards.
+    """
+    return random.Random(random_seed).sample(range(2**31 - 1), number_shards)
 
 
 class TRIMSettings(object):
@@ -33,8 +440,10 @@ class TRIMSettings(object):
     reminders : :obj:`str`, optional
        TODO: could not find description. default 0
     autosave : :obj:`int`, optional
-       save calculations after every `autosave` steps. default 0 will
-       not autosave except at end
+       save calculation to ``SRIM Restore`` after every `autosave`
+       ions. default 0 will not autosave except at end. Needed to
+       resume a crashed calculation with
+       :meth:`srim.srim.TRIM.run_resumable`
     plot_mode : :obj:`int`, optional
        Default 5.
        (0) ion distribution with recoils projected on y-plane
@@ -88,14 +497,14 @@ class TRIMSettings(object):
         self._settings = {
             'description': check_input(str, is_quoteless, kwargs.get('description', 'pysrim run')),
             'reminders': check_input(int, is_zero_or_one, kwargs.get('reminders', 0)),
-            'autosave': check_input(int, is_zero_or_one, kwargs.get('autosave', 0)),
+            'autosave': check_input(int, is_positive, kwargs.get('autosave', 0)),
             'plot_mode': check_input(int, is_zero_to_five, kwargs.get('plot_mode', 5)),
             'plot_xmin': check_input(float, is_positive, kwargs.get('plot_xmin', 0.0)),
             'plot_xmax': check_input(float, is_positive, kwargs.get('plot_xmax', 0.0)),
             'ranges': check_input(int, is_zero_or_one, kwargs.get('ranges', 0)),
             'backscattered': check_input(int, is_zero_or_one, kwargs.get('backscattered', 0)),
             'transmit': check_input(int, is_zero_or_one, kwargs.get('transmit', 0)),
-            'sputtered': check_input(int, is_zero_or_one, kwargs.get('ranges', 0)),
+            'sputtered': check_input(int, is_zero_or_one, kwargs.get('sputtered', 0)),
             'collisions': check_input(int, is_zero_to_two, kwargs.get('collisions', 0)),
             'exyz': check_input(int, is_positive, kwargs.get('exyz', 0)),
             'angle_ions': check_input(float, is_srim_degrees, kwargs.get('angle_ions', 0.0)),
@@ -108,7 +517,12 @@ class TRIMSettings(object):
             raise ValueError('xmin must be <= xmax')
 
     def __getattr__(self, attr):
-        return self._settings[attr]
+        # look up through __dict__ so that copy and pickle (which probe
+        # attributes before _settings is restored) get an AttributeError
+        try:
+            return self.__dict__['_settings'][attr]
+        except KeyError:
+            raise AttributeError(attr)
 
 
 class TRIM(object):
@@ -133,6 +547,10 @@ class TRIM(object):
     number_ions : :obj:`int`, optional
         number of ions that you want to simulate. Default 1000. A lot
         better than the 99999 default in TRIM...
+    trim_dat : :class:`srim.input.TRIMDat`, optional
+        ions for calculations 4-8. Written to ``TRIM.DAT`` next to
+        ``TRIM.IN`` when the calculation is run. Default None uses
+        an existing ``TRIM.DAT`` in the srim directory.
     kwargs :
         See :class:`srim.srim.TRIMSettings` for available TRIM
         options. There are many and none are required defaults are
@@ -143,20 +561,51 @@ class TRIM(object):
         If you are doing a simulation with over 1,000 ions it is
         recomended to split the calculaion into several smaller
         calculations. TRIM has been known to unexpectedly crash mainly
-        due to memory usage.
+        due to memory usage. :meth:`srim.srim.TRIM.run_sharded` does
+        this for you.
     """
-    def __init__(self, target, ion, calculation=1, number_ions=1000, **kwargs):
+    def __init__(self, target, ion, calculation=1, number_ions=1000, trim_dat=None, **kwargs):
         """ Initialize TRIM calcualtion"""
         self.settings = TRIMSettings(**kwargs)
-        self.calculation = check_input(int, is_one_to_seven, calculation)
+        self.calculation = check_input(int, is_one_to_eight, calculation)
         self.number_ions = check_input(int, is_positive, number_ions)
         self.target = target
         self.ion = ion
 
-    def _write_input_files(self):
+        if trim_dat is not None and self.calculation < 4:
+            raise ValueError('TRIM.DAT is only used by calculations 4-8')
+        if trim_dat is not None and trim_dat.number_ions is not None and trim_dat.number_ions < self.number_ions:
+            raise ValueError('TRIM.DAT has fewer ions than number_ions')
+        self.trim_dat = trim_dat
+
+    @staticmethod
+    def _input_file(srim_directory):
+        """Path of the input file TRIM reads when launched"""
+        return os.path.join(srim_directory, 'TRIM.IN')
+
+    @staticmethod
+    def _output_files(srim_directory):
+        """Paths of the output files TRIM may write when launched"""
+        return [os.path.join(srim_directory, filename) for filename in sorted(TRIM_OUTPUT_FILES - {'TRIM.IN'})]
+
+    def _cache_key(self):
+        """Bytes identifying calculation in :class:`srim.cache.ResultCache`"""
+        return b'\0'.join([
+            b'TRIM',
+            str(self.calculation).encode('utf-8'),
+            str(self.settings.random_seed).encode('utf-8'),
+            TRIMInput(self).to_bytes(),
+            b'' if self.trim_dat is None else self.trim_dat.digest().encode('utf-8')
+        ])
+
+    def _write_input_files(self, directory='.'):
         """ Write necissary TRIM input files for calculation """
-        AutoTRIM().write()
-        TRIMInput(self).write()
+        if self.trim_dat is not None:
+            self.trim_dat.write(directory)
+            if self.trim_dat.number_ions < self.number_ions:
+                raise ValueError('TRIM.DAT has fewer ions than number_ions')
+        AutoTRIM().write(directory)
+        TRIMInput(self).write(directory)
 
     @staticmethod
     def copy_output_files(src_directory, dest_directory, check_srim_output=True):
@@ -171,21 +620,13 @@ class TRIM(object):
         check_srim_output : :obj:`bool`, optional
             ensure that all files exist
         """
-        known_files = {
-            'TRIM.IN', 'PHONON.txt', 'E2RECOIL.txt', 'IONIZ.txt',
-            'LATERAL.txt', 'NOVAC.txt', 'RANGE.txt', 'VACANCY.txt',
-            'COLLISON.txt', 'BACKSCAT.txt', 'SPUTTER.txt',
-            'RANGE_3D.txt', 'TRANSMIT.txt', 'TRIMOUT.txt',
-            'TDATA.txt'
-        }
-
         if not os.path.isdir(src_directory):
             raise ValueError('src_directory must be directory')
 
         if not os.path.isdir(dest_directory):
             raise ValueError('dest_directory must be directory')
 
-        for known_file in known_files:
+        for known_file in TRIM_OUTPUT_FILES:
             if os.path.isfile(os.path.join(
                     src_directory, known_file)):
                 shutil.copy(os.path.join(
@@ -194,34 +635,273 @@ class TRIM(object):
                 shutil.move(os.path.join(
                     src_directory, 'SRIM Outputs', known_file), dest_directory)
 
-    def run(self, srim_directory=DEFAULT_SRIM_DIRECTORY):
+    def start(self, srim_directory=DEFAULT_SRIM_DIRECTORY, env=None):
+        """Launch configured srim calculation without waiting for it
+
+        Parameters
+        ----------
+        srim_directory : :obj:`str`, optional
+            path to srim directory. ``TRIM.exe`` should be located in
+            this directory. Default ``/tmp/srim``.
+        env : :obj:`dict`, optional
+            environment variables for TRIM process. Default inherit
+            from python process.
+
+        Returns
+        -------
+        :class:`srim.srim.TRIMProcess`
+            handle to wait for or kill the calculation
+        """
+        srim_directory = os.path.abspath(srim_directory)
+        self._write_input_files(srim_directory)
+        return TRIMProcess(self, srim_directory, env)
+
+    def run(self, srim_directory=DEFAULT_SRIM_DIRECTORY, env=None, cache=None,
+            timeout=None, idle_timeout=None):
         """Run configured srim calculation
 
         This method:
          - writes the input file to ``<srim_directory>/TRIM.IN``
          - launches ``<srim_directory>/TRIM.exe``. Uses ``wine`` if available (needed for linux and osx)
 
+        The working directory of the python process is never changed
+        so it is safe to run several calculations (each with its own
+        ``srim_directory``) from multiple threads.
+
         Parameters
         ----------
         srim_directory : :obj:`str`, optional
             path to srim directory. ``SRIM.exe`` should be located in
             this directory. Default ``/tmp/srim/`` will absolutely
             need to change for windows.
+        env : :obj:`dict`, optional
+            environment variables for TRIM process (e.g. ``WINEPREFIX``
+            and ``DISPLAY``). Default inherit from python process. See
+            :class:`srim.wine.WineWorker`.
+        cache : :class:`srim.cache.ResultCache`, optional
+            if the calculation is in cache its output files are copied
+            to ``srim_directory`` instead of launching TRIM. Otherwise
+            the output files are added to cache after the run. Output
+            files of earlier calculations in ``srim_directory`` are
+            removed first.
+        timeout : :obj:`float`, optional
+            seconds before TRIM is killed. Default no limit.
+        idle_timeout : :obj:`float`, optional
+            seconds without TRIM writing an output or autosave file
+            before it is killed. Default no limit.
+
+        Raises
+        ------
+        :class:`srim.srim.TRIMRunError`
+            TRIM timed out or its output files are missing, left over
+            from a previous calculation, or have too few ions. See
+            :meth:`srim.srim.TRIMProcess.wait`.
         """
-        current_directory = os.getcwd()
-        try:
-            os.chdir(srim_directory)
-            self._write_input_files()
-            # Make sure compatible with Windows, OSX, and Linux
-            # If 'wine' command exists use it to launch TRIM
-            if shutil.which("wine"):
-                subprocess.check_call(['wine', str(os.path.join('.', 'TRIM.exe'))])
-            else:
-                subprocess.check_call([str(os.path.join('.', 'TRIM.exe'))])
-            os.chdir(current_directory)
-            return Results(srim_directory)
-        finally:
-            os.chdir(current_directory)
+        srim_directory = os.path.abspath(srim_directory)
+        self._write_input_files(srim_directory)
+        if cache is not None:
+            # outputs of earlier calculations must never be cached for this one
+            _remove_files(self._output_files(srim_directory))
+            if _restore_from_cache(cache, self, srim_directory):
+                return Results(srim_directory)
+
+        process = TRIMProcess(self, srim_directory, env)
+        results = process.wait(timeout, idle_timeout)
+        if cache is not None:
+            cache.put(self, srim_directory, TRIM_OUTPUT_FILES, since=process._since)
+        return results
+
+    async def run_async(self, srim_directory=DEFAULT_SRIM_DIRECTORY, env=None, cache=None,
+                        timeout=None, idle_timeout=None):
+        """Run configured srim calculation from an asyncio event loop
+
+        Same as :meth:`srim.srim.TRIM.run` except that TRIM is
+        awaited instead of blocking (see
+        :meth:`srim.srim.TRIMProcess.wait_async`). Cancelling the task
+        kills TRIM (and wine's children).
+        Concurrent calculations must each use their own
+        ``srim_directory`` (see :func:`srim.parallel.run_many_async`).
+
+        Parameters
+        ----------
+        srim_directory : :obj:`str`, optional
+            path to srim directory. ``TRIM.exe`` should be located in
+            this directory. Default ``/tmp/srim``.
+        env : :obj:`dict`, optional
+            environment variables for TRIM process. Default inherit
+            from python process.
+        cache : :class:`srim.cache.ResultCache`, optional
+            cache of output files. See :meth:`srim.srim.TRIM.run`.
+        timeout : :obj:`float`, optional
+            seconds before TRIM is killed. Default no limit.
+        idle_timeout : :obj:`float`, optional
+            seconds without TRIM writing an output or autosave file
+            before it is killed. Default no limit.
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+
+        Raises
+        ------
+        :class:`srim.srim.TRIMRunError`
+            same as :meth:`srim.srim.TRIM.run`
+        """
+        srim_directory = os.path.abspath(srim_directory)
+        self._write_input_files(srim_directory)
+        if cache is not None:
+            _remove_files(self._output_files(srim_directory))
+            if _restore_from_cache(cache, self, srim_directory):
+                return Results(srim_directory)
+
+        process = TRIMProcess(self, srim_directory, env)
+        results = await process.wait_async(timeout, idle_timeout)
+        if cache is not None:
+            cache.put(self, srim_directory, TRIM_OUTPUT_FILES, since=process._since)
+        return results
+
+    def run_resumable(self, srim_directory=DEFAULT_SRIM_DIRECTORY, max_restarts=3, env=None,
+                      timeout=None, idle_timeout=None):
+        """Run configured srim calculation resuming it if TRIM crashes
+
+        TRIM autosaves the calculation every ``autosave`` ions. When
+        TRIM exits with an error, or exits before all ions are
+        calculated, it is relaunched in :class:`srim.input.AutoTRIM`
+        mode 2 to resume from the last save instead of starting over.
+
+        Parameters
+        ----------
+        srim_directory : :obj:`str`, optional
+            path to srim directory. ``TRIM.exe`` should be located in
+            this directory. Default ``/tmp/srim``.
+        max_restarts : :obj:`int`, optional
+            number of times to resume calculation before giving up.
+            Default 3
+        env : :obj:`dict`, optional
+            environment variables for TRIM process. Default inherit
+            from python process.
+        timeout : :obj:`float`, optional
+            seconds before each launch of TRIM is killed and resumed.
+            Default no limit.
+        idle_timeout : :obj:`float`, optional
+            seconds without progress before TRIM is killed and
+            resumed. Default no limit.
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+        """
+        if self.settings.autosave == 0:
+            raise ValueError('autosave must be greater than zero to resume calculation')
+
+        process = self.start(srim_directory, env)
+        for restart in range(max_restarts + 1):
+            if restart:
+                AutoTRIM(mode=2).write(process.srim_directory)
+                process = TRIMProcess(self, process.srim_directory, env)
+
+            try:
+                return process.wait(timeout, idle_timeout)
+            except (subprocess.CalledProcessError, TRIMRunError) as e:
+                error = e
+
+            if not _has_checkpoint(process.srim_directory, process._since):
+                raise error
+
+        raise TRIMRunError('TRIM did not complete after {} restarts'.format(max_restarts)) from error
+
+    def _shard(self, number_ions, random_seed):
+        """Copy of calculation with different number of ions and random seed"""
+        settings = dict(self.settings._settings, random_seed=random_seed)
+        return TRIM(self.target, self.ion, self.calculation, number_ions, self.trim_dat, **settings)
+
+    def _reshard(self):
+        """Split calculation in two halves with new random seeds"""
+        shard_ions = [self.number_ions - self.number_ions // 2, self.number_ions // 2]
+        shard_ions = [number_ions for number_ions in shard_ions if number_ions]
+        seeds = _shard_seeds(self.settings.random_seed, len(shard_ions))
+        return [self._shard(number_ions, seed) for number_ions, seed in zip(shard_ions, seeds)]
+
+    def run_sharded(self, total_ions=None, shard_size=1000, workers=None,
+                    srim_directory=DEFAULT_SRIM_DIRECTORY, threads=False,
+                    timeout=None, idle_timeout=None, max_retries=0):
+        """Run a large calculation as many small calculations in parallel
+
+        The ions are split into shards of at most ``shard_size``
+        ions. Each shard gets a distinct random seed derived from
+        ``random_seed`` so repeating a sharded calculation gives the
+        same result. Shards are run on a
+        :class:`srim.parallel.TRIMPool` and merged with
+        :meth:`srim.output.Results.merge`. A shard that crashes, times
+        out, or leaves incomplete output files is retried as two
+        smaller shards up to ``max_retries`` times.
+
+        Parameters
+        ----------
+        total_ions : :obj:`int`, optional
+            total number of ions to simulate. Default ``number_ions``
+        shard_size : :obj:`int`, optional
+            maximum number of ions in each shard. Default 1000
+        workers : :obj:`int`, optional
+            number of shards to run at once. Default number of cpus
+            on machine.
+        srim_directory : :obj:`str`, optional
+            path to srim directory. Copied once for each worker.
+            Default ``/tmp/srim``.
+        threads : :obj:`bool`, optional
+            use threads instead of processes for workers. Default False.
+        timeout : :obj:`float`, optional
+            seconds before a shard is killed. Default no limit.
+        idle_timeout : :obj:`float`, optional
+            seconds without progress before a shard is killed. Default
+            no limit.
+        max_retries : :obj:`int`, optional
+            number of times the ions of a failed shard are resubmitted
+            as two smaller shards with new random seeds. Default 0.
+
+        Returns
+        -------
+        :class:`srim.output.Results`
+            results of all shards weighted by their number of ions
+        """
+        if self.trim_dat is not None:
+            raise ValueError('calculations with TRIM.DAT can not be sharded')
+
+        total_ions = check_input(int, is_positive, self.number_ions if total_ions is None else total_ions)
+        shard_size = check_input(int, is_positive, shard_size)
+        if total_ions == 0 or shard_size == 0:
+            raise ValueError('total_ions and shard_size must be greater than zero')
+
+        shard_ions = [shard_size] * (total_ions // shard_size)
+        if total_ions % shard_size:
+            shard_ions.append(total_ions % shard_size)
+
+        seeds = _shard_seeds(self.settings.random_seed, len(shard_ions))
+        shards = [self._shard(number_ions, seed) for number_ions, seed in zip(shard_ions, seeds)]
+
+        results = []
+        workers = min(workers or os.cpu_count() or 1, len(shards))
+        with TRIMPool(srim_directory, workers=workers, threads=threads) as pool:
+            def submit(shard, retries):
+                future = pool.submit(shard, timeout=timeout, idle_timeout=idle_timeout)
+                pending[future] = (shard, retries)
+
+            pending = {}
+            for shard in shards:
+                submit(shard, 0)
+
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    shard, retries = pending.pop(future)
+                    try:
+                        results.append(future.result())
+                    except (subprocess.CalledProcessError, TRIMRunError):
+                        if retries >= max_retries:
+                            raise
+                        for smaller_shard in shard._reshard():
+                            submit(smaller_shard, retries + 1)
+        return Results.merge(results)
 
 
 class SRSettings(object):
@@ -262,7 +942,12 @@ class SRSettings(object):
         }
 
     def __getattr__(self, attr):
-        return self._settings[attr]
+        # look up through __dict__ so that copy and pickle (which probe
+        # attributes before _settings is restored) get an AttributeError
+        try:
+            return self.__dict__['_settings'][attr]
+        except KeyError:
+            raise AttributeError(attr)
 
 
 class SR(object):
@@ -284,35 +969,90 @@ class SR(object):
         self.layer = layer
         self.ion = ion
 
-    def _write_input_file(self):
+    @staticmethod
+    def _input_file(srim_directory):
+        """Path of the input file SRModule reads when launched"""
+        return os.path.join(srim_directory, 'SR Module', 'SR.IN')
+
+    def _output_files(self, srim_directory):
+        """Paths of the output files SRModule writes when launched"""
+        return [os.path.join(srim_directory, 'SR Module', self.settings.output_filename)]
+
+    def _cache_key(self):
+        """Bytes identifying calculation in :class:`srim.cache.ResultCache`"""
+        return b'\0'.join([b'SR', SRInput(self).to_bytes()])
+
+    def _write_input_file(self, directory='.'):
         """ Write necissary SR input file for calculation """
-        SRInput(self).write()
+        SRInput(self).write(directory)
 
-    def run(self, srim_directory=DEFAULT_SRIM_DIRECTORY):
+    def run(self, srim_directory=DEFAULT_SRIM_DIRECTORY, env=None, cache=None):
         """Run configured srim calculation
 
         This method:
          - writes the input file to ``<srim_directory/SR Module/TRIM.IN``
          - launches ``<srim_directory>/SR Module/SRModule.exe``. Uses ``wine`` if available (needed for linux and osx)
 
+        Like :meth:`srim.srim.TRIM.run` the working directory of the
+        python process is never changed.
+
         Parameters
         ----------
         srim_directory : :obj:`str`, optional
             path to srim directory. ``SRIM.exe`` should be located in
             this directory. Default ``/tmp/srim`` will absolutely need
             to be changed for windows.
+        env : :obj:`dict`, optional
+            environment variables for SRModule process. Default
+            inherit from python process.
+        cache : :class:`srim.cache.ResultCache`, optional
+            if the calculation is in cache its output file is copied
+            to ``SR Module`` instead of launching SRModule. Otherwise
+            the output file is added to cache after the run. An output
+            file of an earlier calculation is removed first.
         """
-        current_directory = os.getcwd()
-        try:
-            os.chdir(os.path.join(srim_directory, 'SR Module'))
-            self._write_input_file()
-            # Make sure compatible with Windows, OSX, and Linux
-            # If 'wine' command exists use it to launch TRIM
-            if shutil.which("wine"):
-                subprocess.check_call(['wine', str(os.path.join('.', 'SRModule.exe'))])
-            else:
-                subprocess.check_call([str(os.path.join('.', 'SRModule.exe'))])
+        sr_directory = os.path.join(os.path.abspath(srim_directory), 'SR Module')
+        self._write_input_file(sr_directory)
+        if cache is not None:
+            _remove_files(self._output_files(srim_directory))
+            if _restore_from_cache(cache, self, sr_directory):
+                return SRResults(sr_directory, self.settings.output_filename)
+
+        since = os.path.getmtime(self._input_file(srim_directory))
+        subprocess.check_call(_launch_command(sr_directory, 'SRModule.exe'), cwd=sr_directory, env=env)
+        if cache is not None:
+            cache.put(self, sr_directory, ['SR.IN', self.settings.output_filename], since=since)
+        return SRResults(sr_directory, self.settings.output_filename)
+
+    async def run_async(self, srim_directory=DEFAULT_SRIM_DIRECTORY, env=None, cache=None):
+        """Run configured srim calculation from an asyncio event loop
+
+        Same as :meth:`srim.srim.SR.run` except that SRModule is
+        awaited instead of blocking. Cancelling the task kills SRModule.
+
+        Parameters
+        ----------
+        srim_directory : :obj:`str`, optional
+            path to srim directory. Default ``/tmp/srim``.
+        env : :obj:`dict`, optional
+            environment variables for SRModule process. Default
+            inherit from python process.
+        cache : :class:`srim.cache.ResultCache`, optional
+            cache of output files. See :meth:`srim.srim.SR.run`.
+
+        Returns
+        -------
+        :class:`srim.output.SRResults`
+        """
+        sr_directory = os.path.join(os.path.abspath(srim_directory), 'SR Module')
+        self._write_input_file(sr_directory)
+        if cache is not None:
+            _remove_files(self._output_files(srim_directory))
+            if _restore_from_cache(cache, self, sr_directory):
+                return SRResults(sr_directory, self.settings.output_filename)
 
-            return SRResults(os.path.join(srim_directory, 'SR Module'))
-        finally:
-            os.chdir(current_directory)
+        since = os.path.getmtime(self._input_file(srim_directory))
+        await _check_call_async(_launch_command(sr_directory, 'SRModule.exe'), cwd=sr_directory, env=env)
+        if cache is not None:
+            cache.put(self, sr_directory, ['SR.IN', self.settings.output_filename], since=since)
+        return SRResults(sr_directory, self.settings.output_filename)
@@ -0,0 +1,323 @@
+""" Keep wine (and optionally an X display) warm between SRIM launches
+
+Every ``wine TRIM.exe`` started without a running ``wineserver`` pays
+for starting the server and loading the prefix (5-9 seconds in the
+benchmarks of the documentation). A
+:class:`srim.wine.WineWorker` keeps a persistent ``wineserver`` (and
+optionally an ``Xvfb`` display) alive so that each launch only pays
+for TRIM itself. :class:`srim.wine.WinePool` runs calculations on
+several workers sharing the server of their prefix and records the
+timing of every launch.
+"""
+import os
+import time
+import queue
+import shutil
+import threading
+import tempfile
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import DEFAULT_SRIM_DIRECTORY
+from .parallel import clone_srim_directory
+
+Launch = namedtuple('Launch', ['worker', 'started', 'first_output', 'elapsed'])
+Launch.__doc__ = """Timing of a single TRIM or SR launch
+
+``started`` is the unix time the executable was launched.
+``first_output`` is the seconds until the first output file of the
+executable was seen (None when it wrote no output file). TRIM only
+writes its output files on autosave and exit so this is not the
+startup time of wine. ``elapsed`` is the seconds until the executable
+exited.
+"""
+
+
+def _start_xvfb():
+    """Start Xvfb on a free display and return process and display"""
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        raise ValueError('Xvfb is required for a virtual display')
+
+    # Xvfb picks a free display and writes its number to displayfd
+    read_fd, write_fd = os.pipe()
+    try:
+        process = subprocess.Popen(
+            [xvfb, '-displayfd', str(write_fd), '-nolisten', 'tcp'],
+            pass_fds=(write_fd,),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            display = f.readline().strip()
+    except BaseException:
+        os.close(read_fd)
+        raise
+
+    if not display:
+        process.kill()
+        process.wait()
+        raise RuntimeError('Xvfb failed to start')
+    return process, ':{}'.format(display)
+
+
+def _stat(path):
+    """Identity of the contents of path (None when missing)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class _OutputWatcher(object):
+    """Time the first of paths is created or modified
+
+    The paths are polled every interval seconds from a thread (file
+    access times are not updated on noatime and relatime mounts).
+    """
+    def __init__(self, paths, interval=0.05):
+        self._before = {path: _stat(path) for path in paths}
+        self.first_output = None
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _check(self):
+        if self.first_output is None and any(
+                _stat(path) != before for path, before in self._before.items()):
+            self.first_output = time.time()
+        return self.first_output is not None
+
+    def _watch(self):
+        while not self._stopped.wait(self._interval):
+            if self._check():
+                return
+
+    def stop(self):
+        """Stop polling and return time of first output (or None)"""
+        self._stopped.set()
+        self._thread.join()
+        self._check()
+        return self.first_output
+
+
+class WineWorker(object):
+    """ Persistent wine environment to launch SRIM executables in
+
+    Starts ``wineserver --persistent`` for the worker's wine prefix so
+    that the server is not restarted for every launch.
+
+    Parameters
+    ----------
+    prefix : :obj:`str`, optional
+        ``WINEPREFIX`` to use. Default use the prefix of the python
+        process. A separate prefix gives the worker its own
+        ``wineserver`` but needs the same Visual Basic runtimes that
+        SRIM requires installed.
+    xvfb : :obj:`bool`, optional
+        start an ``Xvfb`` virtual display for the worker. TRIM runs
+        faster rendering into a virtual frame buffer. Default False.
+    wineserver : :obj:`bool`, optional
+        start the persistent ``wineserver`` of the prefix and stop it
+        on :meth:`close`. Workers sharing a prefix share its server so
+        only one of them should own it. Default True.
+
+    Notes
+    -----
+        On systems without ``wineserver`` (e.g. windows) the worker
+        only records launch timings.
+    """
+    def __init__(self, prefix=None, xvfb=False, wineserver=True):
+        self.env = dict(os.environ)
+        if prefix is not None:
+            self.env['WINEPREFIX'] = os.path.abspath(prefix)
+
+        self._xvfb = None
+        if xvfb:
+            self._xvfb, self.env['DISPLAY'] = _start_xvfb()
+
+        self._wineserver = shutil.which('wineserver') if wineserver else None
+        if self._wineserver:
+            subprocess.check_call([self._wineserver, '--persistent'], env=self.env)
+
+        self.launches = []
+
+    def run(self, calculation, srim_directory=DEFAULT_SRIM_DIRECTORY):
+        """Run calculation in srim_directory with worker's environment
+
+        Parameters
+        ----------
+        calculation : :class:`srim.srim.TRIM` or :class:`srim.srim.SR`
+            calculation to run
+        srim_directory : :obj:`str`, optional
+            path to srim directory. Default ``/tmp/srim``.
+
+        Returns
+        -------
+        :class:`srim.output.Results` or :class:`srim.output.SRResults`
+        """
+        watcher = _OutputWatcher(calculation._output_files(srim_directory))
+        started = time.time()
+        try:
+            return calculation.run(srim_directory, env=self.env)
+        finally:
+            elapsed = time.time() - started
+            first_output = watcher.stop()
+            self.launches.append(Launch(
+                worker=self,
+                started=started,
+                first_output=None if first_output is None else min(first_output - started, elapsed),
+                elapsed=elapsed))
+
+    def close(self):
+        """Stop wineserver and virtual display"""
+        if self._wineserver:
+            subprocess.call([self._wineserver, '--kill'], env=self.env)
+            self._wineserver = None
+
+        if self._xvfb is not None:
+            self._xvfb.terminate()
+            self._xvfb.wait()
+            self._xvfb = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class WinePool(object):
+    """ Pool of warm wine workers each with its own copy of SRIM
+
+    Like :class:`srim.parallel.TRIMPool` with threads, except that
+    every worker keeps a :class:`srim.wine.WineWorker` alive for the
+    lifetime of the pool. Works for both TRIM and SR calculations.
+
+    Parameters
+    ----------
+    srim_directory : :obj:`str`, optional
+        path to srim directory to copy for each worker. Default
+        ``/tmp/srim``.
+    workers : :obj:`int`, optional
+        number of calculations to run at once. Default number of
+        cpus on machine.
+    directory : :obj:`str`, optional
+        directory to create worker copies of SRIM in. Default is a
+        temporary directory which is removed when the pool is closed.
+    xvfb : :obj:`bool`, optional
+        give each worker its own ``Xvfb`` display. Default False.
+    prefixes : :obj:`list`, optional
+        one ``WINEPREFIX`` per worker. Default all workers share the
+        prefix of the python process. Workers with the same prefix
+        share one persistent ``wineserver`` which is stopped when the
+        pool is closed.
+
+    Examples
+    --------
+    >>> with WinePool('/tmp/srim', workers=4, xvfb=True) as pool:
+    ...     results = pool.map(trims)
+    ...     print(pool.summary())
+    """
+    def __init__(self, srim_directory=DEFAULT_SRIM_DIRECTORY, workers=None, directory=None,
+                 xvfb=False, prefixes=None):
+        self.workers = workers or os.cpu_count() or 1
+        if self.workers < 1:
+            raise ValueError('workers must be greater than zero')
+        if prefixes is not None and len(prefixes) != self.workers:
+            raise ValueError('prefixes must have one prefix per worker')
+
+        self._temporary = directory is None
+        self.directory = os.path.abspath(directory or tempfile.mkdtemp(prefix='pysrim-'))
+        self._wine_workers = []
+        self._slots = queue.Queue()
+        try:
+            started_prefixes = set()
+            for i in range(self.workers):
+                worker_directory = clone_srim_directory(
+                    srim_directory, os.path.join(self.directory, 'worker-{}'.format(i)))
+                prefix = os.path.abspath(prefixes[i]) if prefixes else None
+                # the first worker of a prefix owns its wineserver
+                wine_worker = WineWorker(prefix=prefix, xvfb=xvfb, wineserver=prefix not in started_prefixes)
+                started_prefixes.add(prefix)
+                self._wine_workers.append(wine_worker)
+                self._slots.put((worker_directory, wine_worker))
+        except BaseException:
+            self.close()
+            raise
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _run(self, calculation):
+        worker_directory, wine_worker = self._slots.get()
+        try:
+            return wine_worker.run(calculation, worker_directory)
+        finally:
+            self._slots.put((worker_directory, wine_worker))
+
+    def submit(self, calculation):
+        """Schedule a TRIM or SR calculation
+
+        Returns
+        -------
+        :class:`concurrent.futures.Future`
+            future of the calculation results
+        """
+        return self._executor.submit(self._run, calculation)
+
+    def map(self, calculations):
+        """Run calculations and wait for all of them
+
+        Returns
+        -------
+        :obj:`list`
+            results in the same order as ``calculations``
+        """
+        futures = [self.submit(calculation) for calculation in calculations]
+        return [future.result() for future in futures]
+
+    @property
+    def launches(self):
+        """:class:`srim.wine.Launch` of every launch sorted by start time"""
+        return sorted((launch for worker in self._wine_workers for launch in worker.launches),
+                      key=lambda launch: launch.started)
+
+    def summary(self):
+        """Count, mean, min, and max of first output and elapsed time [s] of launches"""
+        def stats(values):
+            values = [value for value in values if value is not None]
+            if not values:
+                return None
+            return {
+                'mean': sum(values) / len(values),
+                'min': min(values),
+                'max': max(values)
+            }
+
+        launches = self.launches
+        return {
+            'launches': len(launches),
+            'first_output': stats(launch.first_output for launch in launches),
+            'elapsed': stats(launch.elapsed for launch in launches)
+        }
+
+    def close(self):
+        """Wait for running calculations, stop workers and remove temporary SRIM copies"""
+        executor = getattr(self, '_executor', None)
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        for wine_worker in self._wine_workers:
+            wine_worker.close()
+
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
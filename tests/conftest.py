@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+TESTDATA_DIRECTORY = 'test_files'
+
+# Stand-in for TRIM.exe: reads the number of ions from TRIM.IN and
+# writes the output files of test_files/1 with that number of ions
+FAKE_TRIM = '''#!{python}
+import os
+import re
+
+with open('TRIM.IN', 'rb') as f:
+    number_ions = int(f.read().split(b'\\r\\n')[2].split()[4])
+
+source = {source!r}
+for filename in os.listdir(source):
+    with open(os.path.join(source, filename), 'rb') as f:
+        output = f.read()
+    output = re.sub(rb'Total Ions calculated\\s+=\\s*[\\d.]+', b'Total Ions calculated =%d.00' % number_ions, output)
+    with open(filename, 'wb') as f:
+        f.write(output)
+
+with open('launches', 'a') as f:
+    f.write('TRIM.exe\\n')
+'''
+
+# Stand-in for SRModule.exe: copies SR_OUTPUT.txt of test_files/SRIM
+FAKE_SR = '''#!{python}
+import shutil
+
+shutil.copy({source!r}, 'SR_OUTPUT.txt')
+with open('launches', 'a') as f:
+    f.write('SRModule.exe\\n')
+'''
+
+
+@pytest.fixture
+def fake_srim_directory(tmp_path):
+    """SRIM directory whose ``TRIM.exe`` copies test outputs"""
+    if shutil.which('wine') or sys.platform.startswith('win'):
+        pytest.skip('fake TRIM.exe requires a posix system without wine')
+
+    srim_directory = tmp_path / 'srim'
+    srim_directory.mkdir()
+    trim_exe = srim_directory / 'TRIM.exe'
+    trim_exe.write_text(FAKE_TRIM.format(
+        python=sys.executable,
+        source=os.path.abspath(os.path.join(TESTDATA_DIRECTORY, '1'))))
+    trim_exe.chmod(0o755)
+
+    sr_directory = srim_directory / 'SR Module'
+    sr_directory.mkdir()
+    sr_exe = sr_directory / 'SRModule.exe'
+    sr_exe.write_text(FAKE_SR.format(
+        python=sys.executable,
+        source=os.path.abspath(os.path.join(TESTDATA_DIRECTORY, 'SRIM', 'SR_OUTPUT.txt'))))
+    sr_exe.chmod(0o755)
+    return str(srim_directory)
@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+
+from srim.core.beam import IonBeam
+from srim.core.target import Target
+from srim.core.layer import Layer
+
+
+def test_init():
+    beam = IonBeam('Ni', 2.0e6, energy_spread=1.0e4)
+    assert beam.symbol == 'Ni'
+    assert beam.energy == 2.0e6
+    assert beam.max_energy == 2.04e6
+
+
+def test_init_invalid():
+    with pytest.raises(ValueError):
+        IonBeam('Ni', 2.0e6, energy_spread=-1.0)
+
+    with pytest.raises(ValueError):
+        IonBeam('Ni', 2.0e6, angle=90.0)
+
+
+def test_sample():
+    beam = IonBeam('Ni', 2.0e6, energy_spread=1.0e4, spot_size=100.0, divergence=1.0)
+    trim_dat = beam.sample(100000, seed=42)
+    assert trim_dat.number_ions == 100000
+    assert np.all(trim_dat.atomic_number == 28)
+    assert abs(trim_dat.energy.mean() - 2.0e6) < 1.0e2
+    assert abs(trim_dat.energy.std() - 1.0e4) < 1.0e2
+    assert trim_dat.energy.max() <= beam.max_energy
+    assert np.all(trim_dat.position[:, 0] == 0)
+    assert abs(trim_dat.position[:, 1].std() - 100.0) < 1.0
+    assert np.allclose(np.linalg.norm(trim_dat.direction, axis=1), 1.0)
+    assert abs(np.degrees(np.arctan2(trim_dat.direction[:, 2], trim_dat.direction[:, 0])).std() - 1.0) < 0.01
+
+    assert np.all(beam.sample(10, seed=1).energy == beam.sample(10, seed=1).energy)
+
+
+def test_sample_angle():
+    beam = IonBeam('Ni', 2.0e6, angle=30.0)
+    direction = beam.sample(10, seed=1).direction
+    assert np.allclose(direction, [np.cos(np.radians(30.0)), np.sin(np.radians(30.0)), 0.0])
+
+
+def test_sample_chunks(tmp_path):
+    beam = IonBeam('Ni', 2.0e6, energy_spread=1.0e4)
+    trim_dat = beam.sample(25, seed=3, chunk_size=10)
+    assert [len(chunk.energy) for chunk in trim_dat.chunks()] == [10, 10, 5]
+    assert trim_dat.digest() == beam.sample(25, seed=3, chunk_size=10).digest()
+
+    trim_dat.write(str(tmp_path))
+    assert trim_dat.number_ions == 25
+
+
+def test_from_spectrum():
+    edges = np.linspace(1.0e6, 2.0e6, 41)
+    counts = np.zeros(40)
+    counts[[5, 30]] = [1.0, 3.0]
+    beam = IonBeam.from_spectrum('He', counts, edges)
+    assert beam.max_energy == 2.0e6
+
+    energy = beam.sample(40000, seed=0).energy
+    in_bin_5 = (energy >= edges[5]) & (energy < edges[6])
+    in_bin_30 = (energy >= edges[30]) & (energy < edges[31])
+    assert np.all(in_bin_5 | in_bin_30)
+    assert abs(np.count_nonzero(in_bin_30) / len(energy) - 0.75) < 0.01
+
+    with pytest.raises(ValueError):
+        IonBeam.from_spectrum('He', counts, edges[:-1])
+
+
+def test_trim():
+    beam = IonBeam('Ni', 2.0e6, energy_spread=1.0e4)
+    target = Target([Layer.from_formula('Ni', 8.9, 1000.0)])
+    trim = beam.trim(target, number_ions=1000, seed=7)
+    assert trim.calculation == 4
+    assert trim.ion.energy == beam.max_energy
+    assert trim.trim_dat.number_ions == 1000
+    assert trim.settings.random_seed == 7
+
+    with pytest.raises(ValueError):
+        beam.trim(target, number_ions=1000, calculation=1)
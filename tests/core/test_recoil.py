@@ -0,0 +1,65 @@
+import pytest
+import numpy as np
+
+from srim.core.recoil import PKASpectrum
+from srim.core.target import Target
+from srim.core.layer import Layer
+
+
+@pytest.fixture
+def target():
+    return Target([
+        Layer.from_formula('Ni', 8.9, 1000.0),
+        Layer.from_formula('SiC', 3.21, 3000.0)
+    ])
+
+
+EDGES = np.linspace(1.0e3, 1.0e5, 11)
+COUNTS = np.ones(10)
+
+
+def test_fractions_default(target):
+    pka = PKASpectrum(target, COUNTS, EDGES)
+    fractions = pka.fractions
+    assert set(fractions) == {'Ni', 'Si', 'C'}
+    assert abs(sum(fractions.values()) - 1.0) < 1e-12
+    assert abs(fractions['Si'] - fractions['C']) < 1e-12
+
+
+def test_fractions(target):
+    pka = PKASpectrum(target, COUNTS, EDGES, fractions={'Si': 1.0, 'C': 3.0})
+    assert pka.fractions == {'Ni': 0.0, 'Si': 0.25, 'C': 0.75}
+
+    with pytest.raises(ValueError):
+        PKASpectrum(target, COUNTS, EDGES, fractions={'Au': 1.0})
+
+
+def test_sample(target):
+    pka = PKASpectrum(target, COUNTS, EDGES, fractions={'Ni': 1.0, 'C': 1.0})
+    trim_dat = pka.sample(100000, seed=1)
+
+    nickel = trim_dat.atomic_number == 28
+    carbon = trim_dat.atomic_number == 6
+    assert np.all(nickel | carbon)
+    assert abs(np.count_nonzero(nickel) / 100000 - 0.5) < 0.01
+
+    depth = trim_dat.position[:, 0]
+    assert np.all((depth[nickel] >= 0) & (depth[nickel] <= 1000.0))
+    assert np.all((depth[carbon] >= 1000.0) & (depth[carbon] <= 4000.0))
+    assert np.all((trim_dat.energy >= 1.0e3) & (trim_dat.energy <= 1.0e5))
+
+    # isotropic directions
+    assert np.allclose(np.linalg.norm(trim_dat.direction, axis=1), 1.0)
+    assert np.all(np.abs(trim_dat.direction.mean(axis=0)) < 0.01)
+
+
+def test_trim(target):
+    pka = PKASpectrum(target, COUNTS, EDGES)
+    trim = pka.trim(number_ions=100, calculation=8, seed=3, chunk_size=30)
+    assert trim.calculation == 8
+    assert trim.ion.symbol == 'Ni'
+    assert trim.ion.energy == 1.0e5
+    assert [len(chunk.energy) for chunk in trim.trim_dat.chunks()] == [30, 30, 30, 10]
+
+    with pytest.raises(ValueError):
+        pka.trim(number_ions=100, calculation=4)
@@ -0,0 +1,102 @@
+import os
+
+from srim.srim import TRIM, SR
+from srim.core.target import Target
+from srim.core.layer import Layer
+from srim.core.ion import Ion
+from srim.cache import ResultCache
+
+
+def make_trim(number_ions, random_seed=1):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    return TRIM(Target([layer]), ion, number_ions=number_ions, random_seed=random_seed)
+
+
+def count_launches(directory):
+    path = os.path.join(directory, 'launches')
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return len(f.readlines())
+
+
+def test_cache_key(tmp_path):
+    cache_key = ResultCache(str(tmp_path)).key
+    assert cache_key(make_trim(10)) == cache_key(make_trim(10))
+    assert cache_key(make_trim(10)) != cache_key(make_trim(11))
+    assert cache_key(make_trim(10)) != cache_key(make_trim(10, random_seed=2))
+
+
+def test_trim_run_cache_hit(fake_srim_directory, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    first = make_trim(10).run(fake_srim_directory, cache=cache)
+    second = make_trim(10).run(fake_srim_directory, cache=cache)
+    assert count_launches(fake_srim_directory) == 1
+    assert first.ioniz.num_ions == second.ioniz.num_ions == 10
+
+    make_trim(20).run(fake_srim_directory, cache=cache)
+    assert count_launches(fake_srim_directory) == 2
+
+
+def test_trim_run_cache_restores_output_files(fake_srim_directory, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    make_trim(10).run(fake_srim_directory, cache=cache)
+    make_trim(20).run(fake_srim_directory)
+    results = make_trim(10).run(fake_srim_directory, cache=cache)
+    assert results.range.num_ions == 10
+    assert count_launches(fake_srim_directory) == 2
+
+
+def test_trim_run_cache_skips_stale_output_files(fake_srim_directory, tmp_path):
+    # left behind by a calculation with collision details enabled
+    stale = os.path.join(fake_srim_directory, 'COLLISON.txt')
+    with open(stale, 'w') as f:
+        f.write('stale')
+    os.utime(stale, (0, 0))
+
+    cache = ResultCache(str(tmp_path / 'cache'))
+    make_trim(10).run(fake_srim_directory, cache=cache)
+    entry = cache.get(make_trim(10))
+    assert 'IONIZ.txt' in os.listdir(entry)
+    assert 'COLLISON.txt' not in os.listdir(entry)
+    assert not os.path.exists(stale)
+
+
+def test_cache_put_since(tmp_path):
+    src_directory = tmp_path / 'src'
+    src_directory.mkdir()
+    for filename in ['TRIM.IN', 'IONIZ.txt', 'TRANSMIT.txt']:
+        (src_directory / filename).write_text(filename)
+    os.utime(str(src_directory / 'TRANSMIT.txt'), (0, 0))
+
+    cache = ResultCache(str(tmp_path / 'cache'))
+    since = os.path.getmtime(str(src_directory / 'TRIM.IN'))
+    entry = cache.put(make_trim(10), str(src_directory), ['TRIM.IN', 'IONIZ.txt', 'TRANSMIT.txt'], since=since)
+    assert sorted(os.listdir(entry)) == ['IONIZ.txt', 'TRIM.IN']
+
+
+def test_cache_evicts_least_recently_used(fake_srim_directory, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    make_trim(1).run(fake_srim_directory, cache=cache)
+    entry_size = cache.size
+    cache.max_size = int(2.5 * entry_size)
+
+    make_trim(2).run(fake_srim_directory, cache=cache)
+    os.utime(cache.get(make_trim(2)), (0, 0)) # oldest
+    make_trim(1).run(fake_srim_directory, cache=cache)
+    make_trim(3).run(fake_srim_directory, cache=cache)
+
+    assert cache.get(make_trim(2)) is None
+    assert cache.get(make_trim(1)) is not None
+    assert cache.get(make_trim(3)) is not None
+    assert cache.size <= cache.max_size
+
+
+def test_sr_run_cache_hit(fake_srim_directory, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    layer = Layer.from_formula('SiC', 3.21, 10000.0)
+    for _ in range(2):
+        results = SR(layer, Ion('Xe', energy=1.2e9), output_type=5).run(fake_srim_directory, cache=cache)
+        assert results.data.shape == (6, 159)
+    assert count_launches(os.path.join(fake_srim_directory, 'SR Module')) == 1
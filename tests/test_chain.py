@@ -0,0 +1,111 @@
+import os
+import sys
+
+import pytest
+import numpy as np
+
+from srim.chain import TRIMChain, split_target
+from srim.output import Results, Transmit
+from srim.core.target import Target
+from srim.core.layer import Layer
+from srim.core.ion import Ion
+
+TESTDATA_DIRECTORY = 'test_files'
+
+# Stand-in for TRIM.exe that transmits half of the ions when asked to
+# (only in the first segment unless transmit_later_segments)
+TRANSMITTING_TRIM = """#!{python}
+import os
+
+with open('TRIM.IN', 'rb') as f:
+    lines = f.read().split(b'\\r\\n')
+number_ions = int(lines[2].split()[4])
+calculation = int(lines[4].split()[0])
+transmit = int(lines[6].split()[2])
+
+# calculations 4-5 are the segments after the first
+if transmit and (calculation < 4 or {transmit_later_segments}):
+    with open('TRANSMIT.txt', 'wb') as f:
+        f.write(b'header\\r\\n' * 10)
+        for i in range(number_ions // 2):
+            f.write(b'T %d 2 1.0E+06 1000. 1.0 -2.0 .99995 .00707 .00707\\r\\n' % (i + 1))
+os.execv('./TRIM.real', ['./TRIM.real'])
+"""
+
+
+def test_transmit():
+    transmit = Transmit(os.path.join(TESTDATA_DIRECTORY, 'transmit'))
+    assert transmit.num_ions == 5
+    assert np.all(transmit.ion_number == [1, 2, 3, 5, 6])
+    assert np.all(transmit.atomic_number == 2)
+    assert transmit.energy[0] == 1.4930e6
+    assert np.all(transmit.position[:, 0] == 5000.0)
+    assert np.allclose(transmit.direction[1], [0.99912, 0.04182, -0.00271])
+
+    trim_dat = transmit.to_trim_dat()
+    assert trim_dat.number_ions == 5
+    assert np.all(trim_dat.position[:, 0] == 0.0)
+    assert np.allclose(trim_dat.position[:, 1:], transmit.position[:, 1:])
+
+
+def test_split_target():
+    target = Target([
+        Layer.from_formula('Ni', 8.9, 1500.0),
+        Layer.from_formula('SiC', 3.21, 2000.0)
+    ])
+    segments = split_target(target, 1000.0)
+    assert [[layer.width for layer in segment.layers] for segment in segments] == [
+        [1000.0], [500.0, 500.0], [1000.0], [500.0]
+    ]
+    assert segments[1].layers[1].elements == target.layers[1].elements
+
+    with pytest.raises(ValueError):
+        split_target(target, 0.0)
+
+
+def test_chain_columns():
+    target = Target([
+        Layer.from_formula('Ni', 8.9, 1500.0),
+        Layer.from_formula('SiC', 3.21, 2000.0)
+    ])
+    chain = TRIMChain(target, Ion('He', 2.0e6), 1000.0)
+    assert chain._columns() == ([[0], [0, 1, 2], [1, 2], [1, 2]], 3)
+
+
+def install_transmitting_trim(srim_directory, transmit_later_segments=True):
+    os.rename(os.path.join(srim_directory, 'TRIM.exe'), os.path.join(srim_directory, 'TRIM.real'))
+    with open(os.path.join(srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write(TRANSMITTING_TRIM.format(python=sys.executable, transmit_later_segments=transmit_later_segments))
+    os.chmod(os.path.join(srim_directory, 'TRIM.exe'), 0o755)
+
+
+def test_chain_run(fake_srim_directory):
+    install_transmitting_trim(fake_srim_directory)
+
+    target = Target([Layer.from_formula('Ni', 8.9, 3000.0)])
+    chain = TRIMChain(target, Ion('He', 2.0e6), 1000.0, number_ions=100)
+    results = chain.run(fake_srim_directory, batches=2, workers=2, threads=True)
+
+    # fake TRIM writes the same tables for every segment
+    single = Results(os.path.join(TESTDATA_DIRECTORY, '1'))
+    assert results.ioniz.num_ions == 100
+    assert len(results.ioniz.depth) == 3 * len(single.ioniz.depth)
+    assert np.allclose(results.ioniz.depth[100:200], single.ioniz.depth + 1000.0)
+    assert np.allclose(results.ioniz.ions[:100], single.ioniz.ions)
+    # 50 of 100 ions reach the second and 24 the third segment
+    assert np.allclose(results.ioniz.ions[100:200], single.ioniz.ions * 0.5)
+    assert np.allclose(results.vacancy.vacancies[200:], single.vacancy.vacancies * 0.24)
+
+
+def test_chain_run_segment_without_transmitted_ions(fake_srim_directory):
+    install_transmitting_trim(fake_srim_directory, transmit_later_segments=False)
+
+    # one worker reuses its SRIM directory for every segment
+    target = Target([Layer.from_formula('Ni', 8.9, 3000.0)])
+    chain = TRIMChain(target, Ion('He', 2.0e6), 1000.0, number_ions=100)
+    results = chain.run(fake_srim_directory, batches=1, workers=1, threads=True)
+
+    # no ion gets past the second segment
+    single = Results(os.path.join(TESTDATA_DIRECTORY, '1'))
+    assert len(results.ioniz.depth) == 2 * len(single.ioniz.depth)
+    assert np.allclose(results.ioniz.ions[100:200], single.ioniz.ions * 0.5)
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+import numpy as np
+
+from srim.input import TRIMDat, _fixed_width
+from srim.srim import TRIM
+from srim.core.target import Target
+from srim.core.layer import Layer
+from srim.core.ion import Ion
+
+
+def test_fixed_width():
+    characters = _fixed_width(np.array([0.0, -1.5, 123.456, -0.00001, 9999.9999]), 10, 4)
+    assert characters.shape == (5, 10)
+    assert [row.tobytes() for row in characters] == [
+        b'    0.0000', b'   -1.5000', b'  123.4560', b'    0.0000', b' 9999.9999']
+
+    characters = _fixed_width(np.array([1, 42]), 5, zero_pad=True)
+    assert [row.tobytes() for row in characters] == [b'00001', b'00042']
+
+
+def test_fixed_width_overflow():
+    with pytest.raises(ValueError):
+        _fixed_width(np.array([123456.0]), 5)
+
+    with pytest.raises(ValueError):
+        _fixed_width(np.array([-1234.0]), 4)
+
+    with pytest.raises(ValueError):
+        _fixed_width(np.array([np.nan]), 5)
+
+
+def test_trim_dat_write(tmp_path):
+    energy = np.array([1.0e6, 2.5e5, 3.0e3])
+    position = np.array([[0.0, 0.0, 0.0], [10.5, -20.25, 3.0], [100.0, 0.0, -1.0]])
+    direction = np.array([[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, -1.0]])
+    trim_dat = TRIMDat([28, 28, 14], energy, position, direction)
+    trim_dat.write(str(tmp_path))
+
+    with open(str(tmp_path / 'TRIM.DAT'), 'rb') as f:
+        contents = f.read()
+    lines = contents.split(b'\r\n')
+    assert len(lines) == 10 + 3 + 1
+    assert lines[10].split()[0] == b'0000001'
+
+    data = np.loadtxt(str(tmp_path / 'TRIM.DAT'), skiprows=10)
+    assert np.all(data[:, 0] == [1, 2, 3])
+    assert np.all(data[:, 1] == [28, 28, 14])
+    assert np.allclose(data[:, 2], energy)
+    assert np.allclose(data[:, 3:6], position)
+    assert np.allclose(data[:, 6:9], direction)
+    assert trim_dat.number_ions == 3
+
+
+def test_trim_dat_from_chunks(tmp_path):
+    def chunks():
+        for i in range(3):
+            yield TRIMDat(28, np.full(4, 1.0e6 + i))
+
+    trim_dat = TRIMDat.from_chunks(chunks())
+    assert trim_dat.number_ions is None
+    with pytest.raises(ValueError):
+        trim_dat.digest()
+
+    trim_dat.write(str(tmp_path))
+    assert trim_dat.number_ions == 12
+    data = np.loadtxt(str(tmp_path / 'TRIM.DAT'), skiprows=10)
+    assert np.all(data[:, 0] == np.arange(1, 13))
+    assert np.allclose(data[:, 2], np.repeat([1.0e6, 1.0e6 + 1, 1.0e6 + 2], 4))
+
+    # digest of a written generator is kept
+    assert trim_dat.digest() == TRIMDat.from_chunks(list(chunks())).digest()
+
+
+def test_trim_dat_invalid():
+    with pytest.raises(ValueError):
+        TRIMDat(28, [-1.0])
+
+    with pytest.raises(ValueError):
+        TRIMDat(93, [1.0e6])
+
+    with pytest.raises(ValueError):
+        TRIMDat(28, [1.0e6], direction=(1.0, 1.0, 0.0))
+
+
+def test_trim_trim_dat():
+    ion = Ion('Ni', 1.0e6)
+    target = Target([Layer.from_formula('Ni', 8.9, 1000.0)])
+    trim_dat = TRIMDat(28, np.full(10, 1.0e6))
+
+    trim = TRIM(target, ion, calculation=8, number_ions=10, trim_dat=trim_dat, random_seed=1)
+    assert trim.calculation == 8
+    assert trim._cache_key() != TRIM(target, ion, calculation=8, number_ions=10, random_seed=1)._cache_key()
+
+    with pytest.raises(ValueError):
+        TRIM(target, ion, calculation=1, trim_dat=trim_dat)
+
+    with pytest.raises(ValueError):
+        TRIM(target, ion, calculation=4, number_ions=11, trim_dat=trim_dat)
+
+
+def test_trim_run_writes_trim_dat(fake_srim_directory):
+    ion = Ion('Ni', 1.0e6)
+    target = Target([Layer.from_formula('Ni', 8.9, 1000.0)])
+    trim = TRIM(target, ion, calculation=4, number_ions=10, trim_dat=TRIMDat(28, np.full(10, 1.0e6)))
+    trim.run(fake_srim_directory)
+    assert os.path.isfile(os.path.join(fake_srim_directory, 'TRIM.DAT'))
@@ -1,10 +1,17 @@
 import os
+import shutil
+import multiprocessing
 
+import numpy as np
 import pytest
 
+import srim.output
+
 from srim.output import (
-    Ioniz, NoVacancy, Vacancy, EnergyToRecoils, Phonons, Range,
-    Results, SRResults
+    Ioniz, NoVacancy, Vacancy, EnergyToRecoils, Phonons, Range, Range3D, Range3DPositions,
+    Results, SRResults, SRIMOutputParseError, Collision, CollisionArrays,
+    CollisionStore, Exyz, Backscat, Transmit, Sputter, buffered_findall,
+    _read_rows
 )
 
 TESTDATA_DIRECTORY = 'test_files'
@@ -38,6 +45,32 @@ def test_range_init(directory):
     assert range.depth.shape == (100,)
 
 
+def test_range3d_positions_init():
+    range3d = Range3DPositions(os.path.join(TESTDATA_DIRECTORY, '1'))
+    assert range3d.ion.symbol == 'Ni'
+    assert range3d.ion.energy == 5.0e6
+    # the last row of the file is cut off
+    assert range3d.num_ions == 996
+    assert list(range3d.ion_numbers[:2]) == [1, 2]
+    np.testing.assert_array_equal(range3d.positions[0], [1.4281e4, -3.6408e3, 1.4055e3])
+    np.testing.assert_array_equal(range3d.depth, range3d.positions[:, 0])
+
+
+@pytest.mark.parametrize('output, max_rows, expected', [
+    (b'1.0E+00  2.0\r\n3.0E+00  4.0\r\n\r\nfooter 5 6\r\n', None, [[1, 2], [3, 4]]),
+    (b'1.0E+00  2.0\r\n3.0E+00  4.0\r\n5.0E+00  6.0\r\n', 2, [[1, 2], [3, 4]]),
+    (b'1.0  2.0\n3.0  40.0\n5.0   6.0\n\n', None, [[1, 2], [3, 40], [5, 6]]),
+    (b'1.0  2.0\n3.0  4.0\n5.0  6.', None, [[1, 2], [3, 4]]),
+    (b'1,0  2.0\n', None, None),
+])
+def test_read_rows(output, max_rows, expected):
+    if expected is None:
+        with pytest.raises(SRIMOutputParseError):
+            _read_rows(output, 0, max_rows)
+    else:
+        np.testing.assert_array_equal(_read_rows(output, 0, max_rows), expected)
+
+
 @pytest.mark.parametrize("directory", [("1"), ("2"), ("3")])
 def test_novacancy_init_full_calculation(directory):
     novac = NoVacancy(os.path.join(TESTDATA_DIRECTORY, directory))
@@ -76,6 +109,29 @@ def test_resuls_init_kp_calculation():
     assert isinstance(results.phonons, Phonons)
     assert isinstance(results.range, Range)
 
+@pytest.mark.parametrize("directory", [("1"), ("2"), ("3"), ("4")])
+def test_results_read_run_header_once(directory, mocker):
+    read_target = mocker.spy(Ioniz, '_read_target')
+    results = Results(os.path.join(TESTDATA_DIRECTORY, directory))
+    assert read_target.call_count == 1
+
+    for output in [results.vacancy, results.etorecoils, results.phonons, results.range]:
+        assert output.ion is results.ioniz.ion
+        assert output.num_ions == results.ioniz.num_ions
+        assert output.target is results.ioniz.target
+
+
+def test_read_run_header_matches_whole_file():
+    with open(os.path.join(TESTDATA_DIRECTORY, '3', 'IONIZ.txt'), 'rb') as f:
+        output = f.read()
+    ioniz = Ioniz(os.path.join(TESTDATA_DIRECTORY, '3'))
+    ion, num_ions, target = ioniz._read_run_header(output)
+    assert num_ions == ioniz._read_num_ions(output) == 381
+    assert ion.symbol == 'B'
+    assert [layer.width for layer in target] == [layer.width for layer in ioniz._read_target(output)]
+    assert [element.name for element in target[1].elements] == ['Si', 'O']
+
+
 def test_results_srim_calcluation():
     results = SRResults(os.path.join(TESTDATA_DIRECTORY, 'SRIM'))
     assert results.ion == {'A1': 131.293, 'Z1': 54, 'name': 'Xenon'}
@@ -89,3 +145,400 @@ def test_results_srim_calcluation():
             'Si': [14, 50.0, 70.05]
         }
     }
+
+
+def test_ioniz_merge_weighted_by_num_ions():
+    first = Ioniz(os.path.join(TESTDATA_DIRECTORY, '1'))
+    second = Ioniz(os.path.join(TESTDATA_DIRECTORY, '1'))
+    second._ions = second.ions * 4
+    second._num_ions = 3 * first.num_ions
+
+    merged = Ioniz.merge([first, second])
+    assert merged.num_ions == 4 * first.num_ions
+    np.testing.assert_allclose(merged.ions, first.ions * (1 + 3 * 4) / 4)
+    np.testing.assert_array_equal(merged.depth, first.depth)
+    assert first.ions is not merged.ions
+
+
+def test_merge_different_depths():
+    with pytest.raises(ValueError):
+        Range.merge([
+            Range(os.path.join(TESTDATA_DIRECTORY, '1')),
+            Range(os.path.join(TESTDATA_DIRECTORY, '2'))
+        ])
+
+
+def test_results_merge_kp_calculation():
+    results = Results(os.path.join(TESTDATA_DIRECTORY, '4'))
+    merged = Results.merge([results, results])
+    assert merged.novac is None
+    assert merged.vacancy.num_ions == 2 * results.vacancy.num_ions
+    np.testing.assert_allclose(merged.vacancy.vacancies, results.vacancy.vacancies)
+
+
+@pytest.fixture
+def collision_directory(tmp_path):
+    # copied since the sidecar index is written next to COLLISON.txt
+    shutil.copy(os.path.join(TESTDATA_DIRECTORY, 'collision', 'COLLISON.txt'), str(tmp_path))
+    return str(tmp_path)
+
+
+def test_collision_index(collision_directory):
+    with Collision(collision_directory) as collision:
+        assert list(collision._ion_index) == [334, 1888, 3223]
+        assert len(collision) == 3
+
+
+def test_collision_getitem(collision_directory):
+    with Collision(collision_directory) as collision:
+        first, second = collision[0], collision[1]
+    assert first['ion_number'] == 1
+    assert len(first['collisions']) > 0
+    assert second['ion_number'] == 2
+
+
+def test_collision_getitem_last_and_negative(collision_directory):
+    with Collision(collision_directory) as collision:
+        assert collision[2]['ion_number'] == 3
+        assert collision[-1]['ion_number'] == 3
+        assert len(collision[-1]['collisions']) == 2
+        with pytest.raises(IndexError):
+            collision[3]
+
+
+def test_collision_iter_batches(collision_directory):
+    with Collision(collision_directory) as collision:
+        batches = list(collision.iter_batches(2))
+        arrays = collision.arrays()
+        with pytest.raises(ValueError):
+            next(collision.iter_batches(0))
+
+    assert [list(batch.ions['ion_number']) for batch in batches] == [[1, 2], [3]]
+    for name in ['collisions', 'recoils']:
+        joined = np.concatenate([getattr(batch, name) for batch in batches])
+        for field in joined.dtype.names:
+            np.testing.assert_array_equal(joined[field], getattr(arrays, name)[field])
+
+
+def assert_collision_arrays_equal(actual, desired):
+    for name in ['ions', 'collisions', 'recoils']:
+        for field in getattr(desired, name).dtype.names:
+            np.testing.assert_array_equal(getattr(actual, name)[field], getattr(desired, name)[field])
+    np.testing.assert_array_equal(actual.cascade_offsets, desired.cascade_offsets)
+
+
+def test_collision_arrays_concatenate(collision_directory):
+    with Collision(collision_directory) as collision:
+        arrays = collision.arrays()
+        parts = [collision.arrays(0, 1), collision.arrays(1, 3)]
+    assert_collision_arrays_equal(CollisionArrays.concatenate(parts), arrays)
+
+
+@pytest.mark.parametrize('workers', [1, 2, 3])
+def test_collision_parse_parallel(collision_directory, workers):
+    with Collision(collision_directory) as collision:
+        assert_collision_arrays_equal(collision.parse_parallel(workers), collision.arrays())
+        assert_collision_arrays_equal(collision.parse_parallel(workers, start=1), collision.arrays(1))
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm') or multiprocessing.get_start_method() != 'fork',
+                    reason='workers see patched parser only when forked')
+def test_collision_parse_parallel_error_unlinks_blocks(collision_directory, mocker):
+    parse = srim.output._parse_collisions
+
+    def fail_on_first_ion(text):
+        if 'Summary of Ion #  1' in text:
+            raise SRIMOutputParseError('cannot parse ion 1')
+        return parse(text)
+
+    mocker.patch('srim.output._parse_collisions', side_effect=fail_on_first_ion)
+    blocks = set(os.listdir('/dev/shm'))
+    with Collision(collision_directory) as collision:
+        with pytest.raises(SRIMOutputParseError):
+            collision.parse_parallel(3)
+    assert set(os.listdir('/dev/shm')) <= blocks
+
+
+def test_collision_byte_ranges(collision_directory):
+    with Collision(collision_directory) as collision:
+        assert collision._byte_ranges(0, 3, 8) == [(334, 1888), (1888, 3223), (3223, 4187)]
+        assert collision._byte_ranges(0, 3, 1) == [(334, 4187)]
+        assert collision._byte_ranges(1, 2, 4) == [(1888, 3223)]
+        assert collision._byte_ranges(2, 2, 4) == []
+
+
+def test_collision_store(collision_directory, tmp_path):
+    filename = str(tmp_path / 'collisions.store')
+    with Collision(collision_directory) as collision:
+        collision.to_store(filename, batch_size=2)
+        arrays = collision.arrays()
+        last = collision.arrays(2)
+
+    with CollisionStore(filename) as store:
+        assert len(store) == 3
+        assert [chunk['ions'] for chunk in store.chunks] == [2, 1]
+        assert store.chunks[1]['statistics']['collisions.depth'] == [210.0, 1504.0]
+        assert_collision_arrays_equal(store.read_chunk(1), last)
+        assert_collision_arrays_equal(store.arrays(), arrays)
+    assert os.path.getsize(filename) < os.path.getsize(os.path.join(collision_directory, 'COLLISON.txt'))
+
+
+def test_collision_store_invalid(tmp_path):
+    filename = str(tmp_path / 'collisions.store')
+    with open(filename, 'wb') as f:
+        f.write(b'not a store' * 10)
+    with pytest.raises(ValueError):
+        CollisionStore(filename)
+
+
+@pytest.mark.parametrize('table, filters, expected', [
+    ('collisions', {}, 7),
+    ('collisions', {'depth': (2000, 4000)}, 2),
+    ('collisions', {'ion_number': (2, None)}, 4),
+    ('collisions', {'atom': 'Ta'}, 0),
+    ('collisions', {'atom': [28], 'energy': (None, 40.0)}, 2),
+    ('recoils', {'energy': (1000, None)}, 2),
+    ('recoils', {'ion_number': (2, 2)}, 2),
+    ('recoils', {'atom': 'Ni', 'depth': (2520, 3005)}, 3),
+])
+def test_collision_query(collision_directory, tmp_path, table, filters, expected):
+    filename = str(tmp_path / 'collisions.store')
+    with Collision(collision_directory) as collision:
+        collision.to_store(filename, batch_size=1)
+        rows = collision.query(table, **filters)
+
+    with CollisionStore(filename) as store:
+        store_rows = store.query(table, **filters)
+
+    assert len(rows) == expected
+    assert rows.tobytes() == store_rows.tobytes()
+
+
+def test_collision_store_query_skips_chunks(collision_directory, tmp_path, mocker):
+    filename = str(tmp_path / 'collisions.store')
+    with Collision(collision_directory) as collision:
+        collision.to_store(filename, batch_size=1)
+
+    with CollisionStore(filename) as store:
+        read_chunk = mocker.spy(store, 'read_chunk')
+        rows = store.query('recoils', energy=(1000, None))
+        assert list(rows['recoil_energy']) == [5043.0, 1204.0]
+        # the third ion has no cascades
+        assert [call.args[0] for call in read_chunk.call_args_list] == [0]
+
+
+def test_collision_query_skips_blocks(collision_directory, mocker):
+    mocker.patch.object(Collision, '_block_size', 1)
+    with Collision(collision_directory) as collision:
+        # first query records the statistics of every block
+        expected = collision.query('recoils', energy=(1000, None))
+        assert list(expected['recoil_energy']) == [5043.0, 1204.0]
+
+    for filters in [{'energy': (1000, None)}, {'atom': 'Ni', 'energy': (1000, None)}]:
+        with Collision(collision_directory) as collision:
+            arrays = mocker.spy(collision, 'arrays')
+            rows = collision.query('recoils', **filters)
+            assert rows.tobytes() == expected.tobytes()
+            # statistics are read from the index and the third ion has no cascades
+            assert [call.args for call in arrays.call_args_list] == [(0, 1)]
+
+    with Collision(collision_directory) as collision:
+        arrays = mocker.spy(collision, 'arrays')
+        assert len(collision.query('recoils', atom='H')) == 0
+        arrays.assert_not_called()
+
+
+def test_collision_query_invalid(collision_directory):
+    with Collision(collision_directory) as collision:
+        with pytest.raises(ValueError):
+            collision.query('ions')
+        with pytest.raises(ValueError):
+            collision.query(energy=(1.0,))
+
+
+def test_collision_summaries(collision_directory):
+    with Collision(collision_directory) as collision:
+        summaries = collision.summaries
+        assert list(summaries['ion_number']) == [1, 2, 3]
+        for i in range(len(collision)):
+            ion = collision[i]
+            for name in summaries.dtype.names:
+                assert summaries[name][i] == ion[name]
+
+
+def test_collision_sidecar_index_reused(collision_directory, mocker):
+    Collision(collision_directory).close()
+    assert os.path.isfile(os.path.join(collision_directory, 'COLLISON.txt.idx'))
+
+    findall = mocker.patch('srim.output.mmap_findall')
+    with Collision(collision_directory) as collision:
+        assert list(collision._ion_index) == [334, 1888, 3223]
+        assert list(collision.summaries['ion_number']) == [1, 2, 3]
+        assert collision[1]['ion_number'] == 2
+    findall.assert_not_called()
+
+
+def test_collision_sidecar_index_stale(collision_directory):
+    filename = os.path.join(collision_directory, 'COLLISON.txt')
+    Collision(collision_directory).close()
+
+    # drop the last ion so the file size changes
+    with open(filename, 'rb') as f:
+        data = f.read()
+    with open(filename, 'wb') as f:
+        f.write(data[:3223])
+
+    with Collision(collision_directory) as collision:
+        assert list(collision._ion_index) == [334, 1888]
+
+
+def test_collision_without_sidecar_index(collision_directory):
+    with Collision(collision_directory, index=False) as collision:
+        assert list(collision._ion_index) == [334, 1888, 3223]
+    assert os.listdir(collision_directory) == ['COLLISON.txt']
+
+
+def test_collision_arrays_match_getitem(collision_directory):
+    with Collision(collision_directory) as collision:
+        arrays = collision.arrays()
+        ions = [collision[i] for i in range(len(collision))]
+
+    dict_collisions = [row for ion in ions for row in ion['collisions']]
+    assert len(arrays) == 7
+    for row, expected in zip(arrays.collisions, dict_collisions):
+        assert row['ion_number'] == expected['ion_number']
+        assert row['depth'] == expected['depth']
+        assert row['atom'] == 28
+        if expected['target_disp'] is None:
+            assert np.isnan(row['target_disp'])
+        else:
+            assert row['target_disp'] == expected['target_disp']
+
+    for i, expected in enumerate(dict_collisions):
+        cascade = arrays.cascade(i)
+        assert len(cascade) == len(expected['cascade'] or [])
+        for recoil, expected_recoil in zip(cascade, expected['cascade'] or []):
+            assert recoil['recoil_energy'] == expected_recoil['recoil_energy']
+            np.testing.assert_array_equal(recoil['position'], expected_recoil['position'])
+
+    assert list(arrays.cascade_offsets) == [0, 0, 3, 3, 3, 5, 5, 5]
+    assert list(arrays.ions['ion_number']) == [1, 2, 3]
+
+
+def test_collision_arrays_range(collision_directory):
+    with Collision(collision_directory) as collision:
+        assert list(collision.arrays(1, 2).collisions['ion_number']) == [2, 2]
+        assert list(collision.arrays(2).ions['ion_number']) == [3]
+        empty = collision.arrays(2, 2)
+    assert len(empty) == 0
+    assert list(empty.cascade_offsets) == [0]
+
+
+def test_buffered_findall():
+    filename = os.path.join(TESTDATA_DIRECTORY, 'collision', 'COLLISON.txt')
+    assert buffered_findall(filename, b"  Ion    Energy") == [334, 1888, 3223]
+    assert buffered_findall(filename, b"  Ion    Energy", start=335) == [1888, 3223]
+    assert buffered_findall(filename, b"not in file") == []
+
+
+def test_exyz_batches_keep_trajectories():
+    with Exyz(os.path.join(TESTDATA_DIRECTORY, 'exyz')) as exyz:
+        for batch_size in [1, 2, 3, 100]:
+            batches = list(exyz.iter_batches(batch_size))
+            points = np.concatenate(batches)
+            assert len(points) == 9
+            numbers = [set(batch['ion_number']) for batch in batches]
+            # no ion is split over two batches
+            assert sum(len(ions) for ions in numbers) == 3
+
+        assert points['energy'][1] == 1.5e3
+        np.testing.assert_array_equal(points['position'][1], [1.121e4, -12.35, 4.556])
+        assert points['stopping'][1] == 48.92
+        assert points['recoil_energy'][1] == 12.1
+
+
+def test_exyz_ions():
+    with Exyz(os.path.join(TESTDATA_DIRECTORY, 'exyz')) as exyz:
+        ions = [(number, len(points)) for number, points in exyz.iter_ions(batch_size=2)]
+    assert ions == [(1, 4), (2, 3), (3, 2)]
+
+
+def test_exyz_histogram():
+    with Exyz(os.path.join(TESTDATA_DIRECTORY, 'exyz')) as exyz:
+        counts, edges = exyz.histogram((3, 2, 2), batch_size=2)
+        assert counts.shape == (3, 2, 2)
+        assert counts.sum() == 9
+        assert edges[0][0] == 0.0 and edges[0][-1] == 2.931e4
+
+        counts, edges = exyz.histogram(4, range=[(0, 2e4), (-100, 100), (-100, 100)])
+        # points deeper than 2 um are outside of grid
+        assert counts.sum() == 6
+
+
+def test_backscat():
+    backscat = Backscat(os.path.join(TESTDATA_DIRECTORY, 'backscat'))
+    assert backscat.num_ions == 3
+    assert list(backscat.ion_number) == [12, 47, 131]
+    np.testing.assert_allclose(backscat.energy, [1.231e6, 8.887e5, 1.6022e6])
+    assert np.all(backscat.direction[:, 0] < 0)
+    np.testing.assert_array_equal(backscat.position[1], [0.0, 12.09, -40.12])
+
+
+def test_sputter():
+    sputter = Sputter(os.path.join(TESTDATA_DIRECTORY, 'sputter'))
+    assert sputter.num_ions == 4
+    assert list(sputter.atomic_number) == [14, 6, 6, 14]
+    assert list(sputter.ion_number) == [1, 1, 4, 9]
+    assert sputter.energy[3] == 33.303
+    assert sputter.yields(10) == {6: 0.2, 14: 0.2}
+
+
+def test_particles_wrong_record():
+    # backscattered ions are not read as transmitted ions
+    assert Transmit(os.path.join(TESTDATA_DIRECTORY, 'backscat'), 'BACKSCAT.txt').num_ions == 0
+
+
+@pytest.mark.parametrize("directory", [("1"), ("4")])
+def test_results_lazy(directory, mocker):
+    read = {cls: mocker.spy(cls, '__init__') for cls in [Ioniz, Vacancy, NoVacancy, EnergyToRecoils, Phonons, Range]}
+    results = Results(os.path.join(TESTDATA_DIRECTORY, directory), lazy=True)
+    assert all(spy.call_count == 0 for spy in read.values())
+
+    assert results.available_files == [
+        'IONIZ.txt', 'VACANCY.txt', 'NOVAC.txt', 'E2RECOIL.txt', 'PHONON.txt', 'RANGE.txt']
+    assert all(spy.call_count == 0 for spy in read.values())
+
+    assert isinstance(results.range, Range)
+    assert results.range is results.range
+    assert read[Range].call_count == 1
+    assert sum(spy.call_count for spy in read.values()) == 1
+
+    eager = Results(os.path.join(TESTDATA_DIRECTORY, directory))
+    assert np.all(results.range.ions == eager.range.ions)
+    assert (results.novac is None) == (eager.novac is None)
+
+
+def test_results_lazy_missing_file(tmp_path):
+    shutil.copy(os.path.join(TESTDATA_DIRECTORY, '1', 'RANGE.txt'), str(tmp_path))
+    results = Results(str(tmp_path), lazy=True)
+    assert results.available_files == ['RANGE.txt']
+    assert isinstance(results.range, Range)
+    with pytest.raises(IOError):
+        results.ioniz
+
+
+def test_results_particles_lazy(tmp_path, mocker):
+    for filename in os.listdir(os.path.join(TESTDATA_DIRECTORY, '1')):
+        shutil.copy(os.path.join(TESTDATA_DIRECTORY, '1', filename), str(tmp_path))
+    shutil.copy(os.path.join(TESTDATA_DIRECTORY, 'sputter', 'SPUTTER.txt'), str(tmp_path))
+
+    read = mocker.spy(Sputter, '__init__')
+    results = Results(str(tmp_path))
+    read.assert_not_called()
+
+    assert results.sputter.num_ions == 4
+    assert results.sputter is results.sputter
+    assert read.call_count == 1
+    assert results.backscat is None
+    assert results.transmit is None
+    assert Results.merge([results, results]).sputter is None
@@ -0,0 +1,115 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+from srim.srim import TRIM
+from srim.core.target import Target
+from srim.core.layer import Layer
+from srim.core.ion import Ion
+from srim.output import Results
+from srim.parallel import TRIMPool, run_many, run_many_async, gather, clone_srim_directory
+
+
+def make_trim(number_ions, **kwargs):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    return TRIM(Target([layer]), ion, number_ions=number_ions, **kwargs)
+
+
+def test_clone_srim_directory(fake_srim_directory, tmp_path):
+    clone = clone_srim_directory(fake_srim_directory, str(tmp_path / 'clone'))
+    assert os.path.isfile(os.path.join(clone, 'TRIM.exe'))
+
+
+def test_clone_srim_directory_missing(tmp_path):
+    with pytest.raises(ValueError):
+        clone_srim_directory(str(tmp_path / 'missing'), str(tmp_path / 'clone'))
+
+
+def test_trim_pool_map_submission_order(fake_srim_directory):
+    with TRIMPool(fake_srim_directory, workers=3) as pool:
+        assert len(set(pool.worker_directories)) == 3
+        results = pool.map([make_trim(n) for n in range(1, 8)])
+        directory = pool.directory
+    assert [r.ioniz.num_ions for r in results] == list(range(1, 8))
+    assert all(isinstance(r, Results) for r in results)
+    assert not os.path.exists(directory)
+
+
+def test_run_many_output_directories(fake_srim_directory, tmp_path):
+    output_directories = [str(tmp_path / 'output' / str(i)) for i in range(2)]
+    results = run_many([make_trim(10), make_trim(20)], fake_srim_directory,
+                       workers=2, output_directories=output_directories)
+    assert [r.range.num_ions for r in results] == [10, 20]
+    for output_directory, n in zip(output_directories, [10, 20]):
+        assert Results(output_directory).vacancy.num_ions == n
+
+
+def test_trim_pool_threads(fake_srim_directory):
+    current_directory = os.getcwd()
+    results = run_many([make_trim(n) for n in range(1, 9)], fake_srim_directory,
+                       workers=4, threads=True)
+    assert [r.ioniz.num_ions for r in results] == list(range(1, 9))
+    assert os.getcwd() == current_directory
+
+
+def test_trim_pool_close_cancel(fake_srim_directory):
+    with TRIMPool(fake_srim_directory, workers=1, threads=True) as pool:
+        futures = [pool.submit(make_trim(n)) for n in range(1, 6)]
+        pool.close(cancel=True)
+    assert futures[-1].cancelled()
+    assert all(future.cancelled() or future.result().ioniz.num_ions == n
+               for n, future in enumerate(futures, 1))
+    assert not os.path.exists(pool.directory)
+
+
+def test_gather_limit():
+    running = []
+    peak = []
+
+    async def job(i):
+        running.append(i)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(i)
+        return i
+
+    assert asyncio.run(gather(*[job(i) for i in range(10)], limit=3)) == list(range(10))
+    assert max(peak) == 3
+
+
+def test_run_many_async(fake_srim_directory):
+    trims = [make_trim(n) for n in range(1, 6)]
+    results = asyncio.run(run_many_async(trims, fake_srim_directory, workers=2))
+    assert [r.ioniz.num_ions for r in results] == list(range(1, 6))
+
+
+# Stand-in for TRIM.exe that also writes TRANSMIT.txt when asked to
+TRANSMITTING_TRIM = """#!{python}
+import os
+
+with open('TRIM.IN', 'rb') as f:
+    lines = f.read().split(b'\\r\\n')
+number_ions = int(lines[2].split()[4])
+if int(lines[6].split()[2]):
+    with open('TRANSMIT.txt', 'wb') as f:
+        f.write(b'header\\r\\n' * 10)
+        for i in range(number_ions):
+            f.write(b'T %d 28 1.0E+06 1000. 1.0 -2.0 .99995 .00707 .00707\\r\\n' % (i + 1))
+os.execv('./TRIM.real', ['./TRIM.real'])
+"""
+
+
+def test_run_many_reads_optional_outputs(fake_srim_directory):
+    os.rename(os.path.join(fake_srim_directory, 'TRIM.exe'), os.path.join(fake_srim_directory, 'TRIM.real'))
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write(TRANSMITTING_TRIM.format(python=sys.executable))
+    os.chmod(os.path.join(fake_srim_directory, 'TRIM.exe'), 0o755)
+
+    trims = [make_trim(10, transmit=1), make_trim(20)]
+    # one worker so the second calculation reuses the directory of the first
+    results = run_many(trims, fake_srim_directory, workers=1)
+    assert results[0].transmit.num_ions == 10
+    assert results[1].transmit is None
@@ -1,4 +1,12 @@
-from srim.srim import TRIM, SR
+import os
+import time
+import asyncio
+import subprocess
+
+import pytest
+
+from srim.srim import TRIM, SR, TRIMRunError, TRIMTimeoutError, _shard_seeds
+from srim.input import SRInput, AutoTRIM
 from srim.core.target import Target
 from srim.core.layer import Layer
 from srim.core.ion import Ion
@@ -40,3 +48,266 @@ def test_simple_srim_init():
 
     # resulting file should be equal to
     # test_files/SRIM/SR_OUTPUT.txt
+
+
+def test_trim_run_does_not_change_directory(fake_srim_directory):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, number_ions=42)
+
+    current_directory = os.getcwd()
+    results = trim.run(fake_srim_directory)
+    assert os.getcwd() == current_directory
+    assert results.ioniz.num_ions == 42
+    assert os.path.isfile(os.path.join(fake_srim_directory, 'TRIM.IN'))
+    assert os.path.isfile(os.path.join(fake_srim_directory, 'TRIMAUTO'))
+    assert not os.path.exists('TRIM.IN')
+
+
+def test_sr_input_write_directory(tmp_path):
+    ion = Ion('Xe', energy=1.2e9)
+    layer = Layer.from_formula('SiC', 3.21, 10000.0)
+    SRInput(SR(layer, ion)).write(str(tmp_path))
+    assert (tmp_path / 'SR.IN').read_bytes().startswith(b'---Stopping/Range Input Data')
+
+
+def test_trim_shard_seeds_reproducible():
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, random_seed=42)
+    seeds = [trim._shard(10, seed).settings.random_seed for seed in _shard_seeds(42, 20)]
+    assert len(set(seeds)) == 20
+    assert seeds == _shard_seeds(42, 20)
+    assert _shard_seeds(43, 20) != seeds
+
+
+def test_trim_run_sharded(fake_srim_directory):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, number_ions=2500)
+    results = trim.run_sharded(shard_size=1000, workers=2, srim_directory=fake_srim_directory, threads=True)
+    assert results.ioniz.num_ions == 2500
+    assert results.range.num_ions == 2500
+
+
+def test_trim_run_async(fake_srim_directory):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, number_ions=7)
+    results = asyncio.run(trim.run_async(fake_srim_directory))
+    assert results.ioniz.num_ions == 7
+
+
+def _is_running(pid):
+    """Whether process pid is alive (orphans may stay zombies until reaped)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        # exited since or no /proc
+        return not os.path.isdir('/proc/self')
+
+
+def test_trim_run_async_cancel_kills_trim(fake_srim_directory):
+    trim_exe = os.path.join(fake_srim_directory, 'TRIM.exe')
+    with open(trim_exe, 'w') as f:
+        # like wine, leaves a child behind when killed alone
+        f.write('#!/bin/sh\nsleep 60 &\necho $! > pid\nwait\n')
+
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion)
+
+    async def cancel():
+        task = asyncio.ensure_future(trim.run_async(fake_srim_directory))
+        while not os.path.exists(os.path.join(fake_srim_directory, 'pid')):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(cancel(), timeout=10))
+    with open(os.path.join(fake_srim_directory, 'pid')) as f:
+        pid = int(f.read())
+    deadline = time.time() + 5
+    while _is_running(pid) and time.time() < deadline:
+        time.sleep(0.01)
+    assert not _is_running(pid)
+
+
+def test_trim_run_async_timeout(fake_srim_directory):
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write('#!/bin/sh\nexec sleep 60\n')
+
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion)
+    with pytest.raises(TRIMTimeoutError):
+        asyncio.run(asyncio.wait_for(trim.run_async(fake_srim_directory, timeout=0.2), timeout=10))
+
+
+# Stand-in for TRIM.exe that crashes after autosaving unless resumed
+CRASHING_TRIM = """#!/bin/sh
+echo "$(cat TRIMAUTO)" >> launches
+if [ "$(cat TRIMAUTO)" = "2" ]; then
+    exec ./TRIM.real
+fi
+mkdir -p "SRIM Restore"
+touch "SRIM Restore/TRIM.IN"
+exit 1
+"""
+
+
+def make_crashing_trim(srim_directory):
+    os.rename(os.path.join(srim_directory, 'TRIM.exe'), os.path.join(srim_directory, 'TRIM.real'))
+    with open(os.path.join(srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write(CRASHING_TRIM)
+    os.chmod(os.path.join(srim_directory, 'TRIM.exe'), 0o755)
+
+
+def test_trim_run_resumable(fake_srim_directory):
+    make_crashing_trim(fake_srim_directory)
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, number_ions=50, autosave=10)
+
+    results = trim.run_resumable(fake_srim_directory)
+    assert results.ioniz.num_ions == 50
+    with open(os.path.join(fake_srim_directory, 'launches')) as f:
+        assert f.read().split() == ['1', '2', 'TRIM.exe']
+
+
+def test_trim_run_resumable_requires_autosave():
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    with pytest.raises(ValueError):
+        TRIM(Target([layer]), ion).run_resumable()
+
+
+def test_trim_run_resumable_without_checkpoint(fake_srim_directory):
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write('#!/bin/sh\nexit 1\n')
+
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, autosave=10)
+    with pytest.raises(subprocess.CalledProcessError):
+        trim.run_resumable(fake_srim_directory)
+
+
+def test_trim_autosave_ion_interval():
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    assert TRIM(Target([layer]), ion, autosave=500).settings.autosave == 500
+
+
+def test_trim_settings_output_files():
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    settings = TRIM(Target([layer]), ion, sputtered=1).settings
+    assert settings.sputtered == 1
+    assert settings.ranges == 0
+
+
+def test_autotrim_restart_directory(tmp_path):
+    restart_directory = tmp_path / 'saved'
+    restart_directory.mkdir()
+    (restart_directory / 'TRIM.IN').write_text('saved')
+    AutoTRIM(mode=2, restart_directory=str(restart_directory)).write(str(tmp_path))
+    assert (tmp_path / 'TRIMAUTO').read_text() == '2'
+    assert (tmp_path / 'SRIM Restore' / 'TRIM.IN').read_text() == 'saved'
+
+    with pytest.raises(ValueError):
+        AutoTRIM(mode=1, restart_directory=str(restart_directory))
+
+
+def test_trim_run_stale_outputs(fake_srim_directory):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    TRIM(Target([layer]), ion, number_ions=10).run(fake_srim_directory)
+
+    # crashed TRIM leaving outputs of previous calculation behind
+    os.utime(os.path.join(fake_srim_directory, 'IONIZ.txt'), (0, 0))
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write('#!/bin/sh\nexit 0\n')
+    with pytest.raises(TRIMRunError):
+        TRIM(Target([layer]), ion, number_ions=10).run(fake_srim_directory)
+
+
+def test_trim_run_timeout(fake_srim_directory):
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write('#!/bin/sh\nexec sleep 60\n')
+
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion)
+    process = trim.start(fake_srim_directory)
+    with pytest.raises(TRIMTimeoutError):
+        process.wait(timeout=0.2, poll_interval=0.05)
+    assert process.returncode is not None
+
+    with pytest.raises(TRIMTimeoutError):
+        trim.start(fake_srim_directory).wait(idle_timeout=0.2, poll_interval=0.05)
+
+
+# Stand-in for TRIM.exe that crashes for shards of 1000 ions
+FLAKY_TRIM = """#!/bin/sh
+if [ "$(sed -n 3p TRIM.IN | awk '{print $5}')" = "1000" ]; then
+    exit 1
+fi
+exec ./TRIM.real
+"""
+
+
+def test_trim_run_sharded_retries(fake_srim_directory):
+    os.rename(os.path.join(fake_srim_directory, 'TRIM.exe'), os.path.join(fake_srim_directory, 'TRIM.real'))
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write(FLAKY_TRIM)
+    os.chmod(os.path.join(fake_srim_directory, 'TRIM.exe'), 0o755)
+
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    trim = TRIM(Target([layer]), ion, number_ions=2100)
+    with pytest.raises(subprocess.CalledProcessError):
+        trim.run_sharded(shard_size=1000, workers=2, srim_directory=fake_srim_directory, threads=True)
+
+    results = trim.run_sharded(shard_size=1000, workers=2, srim_directory=fake_srim_directory,
+                               threads=True, max_retries=1)
+    assert results.ioniz.num_ions == 2100
+
+
+# Stand-in for TRIM.exe that reports progress twice before finishing
+SLOW_TRIM = """#!/bin/sh
+sleep 0.2
+printf 'Total Ions calculated =  000010\\r\\n' > TDATA.txt
+sleep 0.2
+printf 'Total Ions calculated =  000020\\r\\n' > TDATA.txt
+sleep 0.2
+exec ./TRIM.real
+"""
+
+
+def test_trim_process_progress(fake_srim_directory):
+    os.rename(os.path.join(fake_srim_directory, 'TRIM.exe'), os.path.join(fake_srim_directory, 'TRIM.real'))
+    with open(os.path.join(fake_srim_directory, 'TRIM.exe'), 'w') as f:
+        f.write(SLOW_TRIM)
+    os.chmod(os.path.join(fake_srim_directory, 'TRIM.exe'), 0o755)
+
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    process = TRIM(Target([layer]), ion, number_ions=40).start(fake_srim_directory)
+    assert process.progress().ions == 0
+
+    progress = list(process.watch(interval=0.05))
+    ions = [p.ions for p in progress]
+    assert ions == sorted(ions)
+    assert 10 in ions and 20 in ions
+    assert progress[-1].ions == 40
+    assert progress[-1].total == 40
+    assert progress[-1].rate > 0 and progress[-1].average_rate > 0
+    assert progress[-1].eta == 0
+    assert process.wait().ioniz.num_ions == 40
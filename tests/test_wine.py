@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pytest
+
+from srim.srim import TRIM
+from srim.core.target import Target
+from srim.core.layer import Layer
+from srim.core.ion import Ion
+from srim.wine import WineWorker, WinePool, Launch
+
+
+def make_trim(number_ions):
+    ion = Ion('Ni', 1.0e6)
+    layer = Layer.from_formula('Ni', 8.9, 1000.0)
+    return TRIM(Target([layer]), ion, number_ions=number_ions)
+
+
+def test_wine_worker_records_launch(fake_srim_directory):
+    with WineWorker() as worker:
+        results = worker.run(make_trim(5), fake_srim_directory)
+    assert results.ioniz.num_ions == 5
+    assert len(worker.launches) == 1
+    launch = worker.launches[0]
+    assert isinstance(launch, Launch)
+    assert launch.elapsed > 0
+    # fake TRIM.exe writes its output files right away
+    assert launch.first_output is not None
+    assert 0 <= launch.first_output <= launch.elapsed
+
+
+def test_wine_pool_map(fake_srim_directory):
+    with WinePool(fake_srim_directory, workers=2) as pool:
+        results = pool.map([make_trim(n) for n in range(1, 6)])
+        summary = pool.summary()
+        launches = pool.launches
+    assert [r.ioniz.num_ions for r in results] == list(range(1, 6))
+    assert summary['launches'] == 5
+    assert summary['elapsed']['min'] <= summary['elapsed']['mean'] <= summary['elapsed']['max']
+    assert len({launch.worker for launch in launches}) <= 2
+
+
+def test_wine_pool_shares_wineserver_of_prefix(fake_srim_directory, tmp_path, monkeypatch):
+    bin_directory = tmp_path / 'bin'
+    bin_directory.mkdir()
+    wineserver = bin_directory / 'wineserver'
+    wineserver.write_text('#!/bin/sh\necho "$WINEPREFIX $1" >> {}\n'.format(tmp_path / 'wineserver.log'))
+    wineserver.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(bin_directory, os.pathsep, os.environ['PATH']))
+
+    prefixes = [str(tmp_path / 'a'), str(tmp_path / 'b'), str(tmp_path / 'a')]
+    with WinePool(fake_srim_directory, workers=3, prefixes=prefixes) as pool:
+        pool.map([make_trim(1), make_trim(2)])
+    calls = (tmp_path / 'wineserver.log').read_text().split('\n')
+    assert sorted(calls) == sorted([
+        '', prefixes[0] + ' --persistent', prefixes[1] + ' --persistent',
+        prefixes[0] + ' --kill', prefixes[1] + ' --kill'])
+
+
+def test_wine_pool_prefixes_per_worker(fake_srim_directory):
+    with pytest.raises(ValueError):
+        WinePool(fake_srim_directory, workers=2, prefixes=['/tmp/prefix'])
+
+
+@pytest.mark.skipif(shutil.which('Xvfb') is None, reason='requires Xvfb')
+def test_wine_worker_xvfb():
+    with WineWorker(xvfb=True) as worker:
+        assert worker.env['DISPLAY'].startswith(':')